@@ -0,0 +1,137 @@
+"""
+Benchmark of action URL dispatching on alarm zone activation.
+
+Compares the old per-call ThreadedQueue(concurrent=100) with the shared
+ActionDispatcher over back-to-back activations against a local stub
+HTTP server, reporting latency, live threads and TCP connections opened.
+
+Usage:
+    python benchmarks/action_dispatch.py [--activations 1000] [--actions 5]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from Queue import Queue
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prometrix_cloud_security.dispatch import ActionDispatcher
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1  # one write per response, avoids delayed ACK stalls
+
+    def do_GET(self):
+        body = 'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        return ThreadingMixIn.process_request(self, request, client_address)
+
+
+class LegacyThreadedQueue(object):
+    """
+        Copy of the removed utils.ThreadedQueue, kept here as the baseline
+    """
+    def __init__(self, concurrent=None):
+        self.concurrent = concurrent or 200
+        self.queue = Queue(concurrent * 2)
+        self.result = {}
+
+    def do_work(self):
+        while True:
+            url = self.queue.get()
+            status, url = self.get_status(url)
+            self.result.update({url: status})
+            self.queue.task_done()
+
+    def get_status(self, ourl):
+        try:
+            r = requests.get(ourl)
+            return r.status_code, ourl
+        except requests.exceptions.RequestException as e:
+            return e, ourl
+
+    def run(self, urls_list):
+        for i in range(self.concurrent):
+            t = threading.Thread(target=self.do_work)
+            t.daemon = True
+            t.start()
+
+        for url in urls_list:
+            self.queue.put(url.strip())
+        self.queue.join()
+
+        return self.result
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run_case(name, activate, server, activations, urls):
+    server.connections = 0
+    threads_before = threading.active_count()
+    latencies = []
+    started = time.time()
+    for i in range(activations):
+        t = time.time()
+        try:
+            activate(urls)
+        except (threading.ThreadError, RuntimeError) as e:
+            print '  {name}: stopped after {i} activations ({error})'.format(name=name, i=i, error=e)
+            break
+        latencies.append((time.time() - t) * 1000)
+    total = time.time() - started
+    print '{name}'.format(name=name)
+    print '  activations:       {0}'.format(len(latencies))
+    print '  total:             {0:.2f} s'.format(total)
+    print '  latency p50/p99:   {0:.2f} / {1:.2f} ms'.format(percentile(latencies, 50), percentile(latencies, 99))
+    print '  threads added:     {0}'.format(threading.active_count() - threads_before)
+    print '  TCP connections:   {0}'.format(server.connections)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--activations', type=int, default=1000)
+    parser.add_argument('--actions', type=int, default=5, help='action URLs per alarm zone')
+    parser.add_argument('--legacy-concurrent', type=int, default=100)
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    urls = ['http://127.0.0.1:{port}/action/{i}'.format(port=server.server_port, i=i)
+            for i in range(args.actions)]
+
+    dispatcher = ActionDispatcher()
+    run_case('ActionDispatcher (shared, pooled)', dispatcher.run, server, args.activations, urls)
+    run_case('ThreadedQueue (per call)',
+             lambda u: LegacyThreadedQueue(concurrent=args.legacy_concurrent).run(u),
+             server, args.activations, urls)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of the in-memory heartbeat index used by the offline detector.
+
+Loads the index with many devices beating every --interval seconds,
+replays heartbeats in real time order for --duration simulated seconds
+while a share of devices goes silent, and reports cost per heartbeat,
+cost per detected device and how late devices were detected after
+their deadline with expiry checked every --poll seconds.
+
+Usage:
+    python benchmarks/heartbeat_monitor.py [--devices 100000] [--interval 30] [--timeout 90] [--silent 0.01]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "prometrix_cloud_security.settings.settings")
+
+import django
+django.setup()
+
+from prometrix_cloud_security.monitor import HeartbeatIndex
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--interval', type=float, default=30)
+    parser.add_argument('--timeout', type=float, default=90)
+    parser.add_argument('--duration', type=float, default=300)
+    parser.add_argument('--poll', type=float, default=0.5)
+    parser.add_argument('--silent', type=float, default=0.01, help="share of devices which stop beating")
+    args = parser.parse_args()
+
+    index = HeartbeatIndex()
+    phases = [random.uniform(0, args.interval) for i in range(args.devices)]
+    started = time.time()
+    index.load(dict((('sensors', i), phase + args.timeout) for i, phase in enumerate(phases)))
+    print 'load: {0:.3f}s for {1} devices'.format(time.time() - started, args.devices)
+
+    silent = set(random.sample(range(args.devices), int(args.devices * args.silent)))
+    beats = sorted((phase + args.interval * n, i) for i, phase in enumerate(phases)
+                   for n in range(1, int(args.duration / args.interval) + 1) if i not in silent)
+
+    beat_time = expire_time = 0.0
+    lateness = []
+    position = 0
+    now = 0.0
+    while now < args.duration:
+        now += args.poll
+        started = time.time()
+        while position < len(beats) and beats[position][0] <= now:
+            when, i = beats[position]
+            index.beat(('sensors', i), when + args.timeout)
+            position += 1
+        beat_time += time.time() - started
+        started = time.time()
+        for device_type, i in index.expire(now):
+            lateness.append(now - (phases[i] + args.timeout))
+        expire_time += time.time() - started
+
+    print 'heartbeats: {0} in {1:.3f}s, {2:.2f}us each'.format(position, beat_time, beat_time / position * 1e6)
+    print 'offline: {0} of {1} silent detected, expiry {2:.3f}s total, max lateness {3:.2f}s'.format(
+        len(lateness), len(silent), expire_time, max(lateness) if lateness else 0)
+    print 'heap entries: {0}'.format(len(index.heap))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Cost of the motion filter per frame against making thumbnails.
+
+Encodes --width x --height JPEG frames of a static scene with noise and
+of a moving square, and reports the time of one MotionFilter check (with
+numpy and with the PIL fallback), the share of frames it would store and
+the time of make_thumbnails the skipped frames no longer need.
+
+Usage:
+    python benchmarks/motion_filter.py [--frames 200] [--width 1280] [--height 720]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "prometrix_cloud_security.settings.settings")
+
+import django
+django.setup()
+
+from PIL import Image as PImage, ImageDraw
+
+from prometrix_cloud_security import motion
+from prometrix_cloud_security.motion import MotionFilter
+from prometrix_cloud_security.thumbnails import make_thumbnails
+
+
+def make_frames(count, width, height, moving):
+    background = PImage.effect_noise((width, height), 20).convert('RGB')
+    frames = []
+    for i in range(count):
+        im = background.copy()
+        if moving and i % 2:
+            x = random.randint(0, width - width / 4)
+            ImageDraw.Draw(im).rectangle([x, height / 4, x + width / 4, height / 2], fill=(255, 255, 255))
+        buf = StringIO.StringIO()
+        im.save(buf, 'jpeg', quality=random.randint(80, 85))
+        frames.append(buf.getvalue())
+    return frames
+
+
+def run(frames):
+    motion_filter = MotionFilter()
+    started = time.time()
+    stored = sum(1 for data in frames if motion_filter.check(1, data))
+    return (time.time() - started) / len(frames), stored / float(len(frames))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    args = parser.parse_args()
+
+    numpy = motion.numpy
+    for scene, moving in (('static', False), ('moving', True)):
+        frames = make_frames(args.frames, args.width, args.height, moving)
+        for name, module in (('numpy', numpy), ('pil', None)):
+            if name == 'numpy' and numpy is None:
+                continue
+            motion.numpy = module
+            seconds, stored = run(frames)
+            print '{scene:<7} {name:<6} check {ms:6.2f}ms/frame  stored {stored:5.1%}'.format(
+                scene=scene, name=name, ms=seconds * 1000, stored=stored)
+    started = time.time()
+    for data in frames[:20]:
+        make_thumbnails(data)
+    print 'make_thumbnails {ms:6.2f}ms/frame'.format(ms=(time.time() - started) / 20 * 1000)
+
+
+if __name__ == '__main__':
+    main()
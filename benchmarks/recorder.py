@@ -0,0 +1,112 @@
+"""
+Benchmark of scheduled camera recording.
+
+Creates cameras recording at 1 fps against a local stub camera serving
+a 1080p JPEG, runs CameraRecorder for a while and reports how many
+frames per second were actually saved, to find how many cameras one
+node sustains. Runs in a temporary directory with its own sqlite
+database and media root.
+
+Usage:
+    python benchmarks/recorder.py [--cameras 50,100,200] [--duration 20] [--workers 50]
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import threading
+import StringIO
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from PIL import Image as PImage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "prometrix_cloud_security.settings.settings")
+
+# settings put database and media into current directory
+workdir = tempfile.mkdtemp()
+os.chdir(workdir)
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from prometrix_cloud_security.models import Site, Camera, CameraImage
+from prometrix_cloud_security.recorder import CameraRecorder
+
+
+def sample_jpeg(size):
+    im = PImage.effect_noise(size, 40).convert('RGB')
+    temp_handle = StringIO.StringIO()
+    im.save(temp_handle, 'jpeg', quality=85)
+    return temp_handle.getvalue()
+
+
+class StubCameraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    jpeg = ''
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.jpeg)))
+        self.end_headers()
+        self.wfile.write(self.jpeg)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # recorder drops connections on exit
+        pass
+
+
+def run_case(count, duration, workers, image_url):
+    Camera.objects.all().delete()
+    CameraImage.objects.all().delete()
+    site = Site.objects.first()
+    Camera.objects.bulk_create([Camera(heartbeat_updated=timezone.now(), site=site,
+                                       image_url=image_url, save_schedule='1')
+                                for i in range(count)])
+    recorder = CameraRecorder(workers=workers)
+    stats = recorder.run(duration=duration)
+    fps = stats['saved'] / float(duration)
+    print '{count:>6} cameras: {fps:8.1f} frames/s of {count} wanted ({ratio:5.1f}%), ' \
+          'failed={failed} max_lag={lag:.2f}s'.format(count=count, fps=fps, ratio=fps / count * 100, **stats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cameras', default='50,100,200')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    StubCameraHandler.jpeg = sample_jpeg((1920, 1080))
+    server = StubServer(('127.0.0.1', 0), StubCameraHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    image_url = 'http://127.0.0.1:{port}/image.jpg'.format(port=server.server_port)
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    Site.objects.create()
+    try:
+        for count in args.cameras.split(','):
+            run_case(int(count), args.duration, args.workers, image_url)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
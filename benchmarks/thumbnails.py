@@ -0,0 +1,95 @@
+"""
+Benchmark of camera image thumbnail creation.
+
+Compares the old CameraImage.create_thumb path (re-read the saved file,
+decode at full resolution, encode into StringIO, copy into ContentFile)
+with make_thumbnails working on the downloaded bytes in JPEG draft mode,
+on synthetic 1080p and 4K frames.
+
+Usage:
+    python benchmarks/thumbnails.py [--rounds 20] [--sizes 150x150,320x240]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import StringIO
+
+from PIL import Image as PImage, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "prometrix_cloud_security.settings.settings")
+
+import django
+django.setup()
+
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+
+from prometrix_cloud_security.thumbnails import make_thumbnails
+
+
+def sample_jpeg(size):
+    """
+        Noisy gradient, compresses roughly like a camera frame
+    """
+    noise = PImage.effect_noise(size, 40).filter(ImageFilter.GaussianBlur(2))
+    gradient = PImage.new('L', (256, 1))
+    gradient.putdata(range(256))
+    gradient = gradient.resize(size)
+    im = PImage.merge('RGB', [noise, gradient, PImage.blend(noise, gradient, 0.5)])
+    temp_handle = StringIO.StringIO()
+    im.save(temp_handle, 'jpeg', quality=85)
+    return temp_handle.getvalue()
+
+
+def legacy_thumbs(storage, data, sizes):
+    # image is saved first, thumbnail is made from the file on disk
+    path = storage.path(storage.save('image.jpg', ContentFile(data)))
+    for size in sizes:
+        im = PImage.open(path)
+        im.thumbnail(size, PImage.ANTIALIAS)
+        temp_handle = StringIO.StringIO()
+        im.save(temp_handle, 'jpeg')
+        temp_handle.seek(0)
+        storage.save('thumb.jpg', ContentFile(temp_handle.read()))
+
+
+def draft_thumbs(storage, data, sizes):
+    storage.save('image.jpg', ContentFile(data))
+    for size, temp_handle in make_thumbnails(data, sizes).items():
+        storage.save('thumb.jpg', File(temp_handle))
+
+
+def run_case(name, func, data, sizes, rounds):
+    location = tempfile.mkdtemp()
+    storage = FileSystemStorage(location=location)
+    try:
+        started = time.time()
+        for i in range(rounds):
+            func(storage, data, sizes)
+        total = time.time() - started
+    finally:
+        shutil.rmtree(location)
+    print '  {name:<22} {per:8.1f} ms/image {rate:8.1f} images/s'.format(
+        name=name, per=total / rounds * 1000, rate=rounds / total)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--sizes', default='150x150')
+    args = parser.parse_args()
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+
+    for label, size in (('1080p', (1920, 1080)), ('4K', (3840, 2160))):
+        data = sample_jpeg(size)
+        print '{label} ({kb} KB), thumbnails {sizes}'.format(label=label, kb=len(data) / 1024, sizes=args.sizes)
+        run_case('re-read + full decode', legacy_thumbs, data, sizes, args.rounds)
+        run_case('in-memory + draft', draft_thumbs, data, sizes, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Site, Sensor, AlarmZone, AlarmLog, Camera, Light, LightGroup, CameraImage
+from .models import Site, Sensor, AlarmZone, AlarmLog, Camera, Light, LightGroup, CameraImage, AlarmJob, AlarmClip
 
-admin.site.register([Site, Sensor, AlarmLog, AlarmZone, Camera, Light, LightGroup, CameraImage])
+admin.site.register([Site, Sensor, AlarmLog, AlarmZone, Camera, Light, LightGroup, CameraImage, AlarmJob, AlarmClip])
 
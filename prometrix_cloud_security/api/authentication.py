@@ -0,0 +1,30 @@
+from django.contrib.auth.models import AnonymousUser
+
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+
+from prometrix_cloud_security.models import Site
+
+
+class DeviceKeyAuthentication(BaseAuthentication):
+    """
+        Authenticates devices by X-Device-Key header,
+        request.auth is id of the device site
+    """
+    def authenticate(self, request):
+        key = request.META.get('HTTP_X_DEVICE_KEY')
+        if not key:
+            return None
+        site_id = Site.get_id_by_device_key(key)
+        if site_id is None:
+            raise AuthenticationFailed("Invalid device key")
+        return AnonymousUser(), site_id
+
+    def authenticate_header(self, request):
+        return 'Device-Key'
+
+
+class IsDevice(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth is not None
@@ -0,0 +1,67 @@
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags, parse_http_date_safe, quote_etag
+
+from rest_framework.response import Response
+
+from prometrix_cloud_security.models import Site, SiteVersion
+from prometrix_cloud_security.settings import settings
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+        etag is unquoted, as parse_etags returns them. If-Modified-Since
+        is used only with last_modified, for content that cannot change
+        twice within one second
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    if last_modified is None:
+        return False
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+class SiteVersionMixin(object):
+    """
+        Conditional GET for views of one site: ETag comes from SiteVersion,
+        so an unchanged site is answered with 304 before the view reads its
+        tables. With API_RESPONSE_CACHE_TIMEOUT responses are also cached
+        by user, path and version
+    """
+    def get(self, request, *args, **kwargs):
+        site_id = kwargs['site_id']
+        if int(site_id) not in Site.get_user_site_ids(request.user.id):
+            return super(SiteVersionMixin, self).get(request, *args, **kwargs)
+
+        version = self.get_version(site_id)
+        etag = '{site}.{version}'.format(site=site_id, version=version)
+        if is_not_modified(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = self.get_cached_response(request, version, *args, **kwargs)
+        response['ETag'] = quote_etag(etag)
+        return response
+
+    def get_version(self, site_id):
+        """
+            Value that changes with every change of the response
+        """
+        return SiteVersion.get(site_id)[0]
+
+    def get_cached_response(self, request, version, *args, **kwargs):
+        timeout = settings.API_RESPONSE_CACHE_TIMEOUT
+        if not timeout:
+            return super(SiteVersionMixin, self).get(request, *args, **kwargs)
+        cache_key = 'response:{user}:{version}:{path}'.format(
+            user=request.user.id, version=version, path=hashlib.md5(request.build_absolute_uri()).hexdigest())
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+        response = super(SiteVersionMixin, self).get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(cache_key, response.data, timeout)
+        return response
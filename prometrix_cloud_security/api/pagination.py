@@ -0,0 +1,81 @@
+from django.http import StreamingHttpResponse
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, _positive_int
+from rest_framework.utils.encoders import JSONEncoder
+
+from prometrix_cloud_security.settings import settings
+
+
+class KeysetPagination(CursorPagination):
+    """
+        Cursor pagination over the orderings allowed by view.get_orderings(),
+        ?ordering=-logged&page_size=100&cursor=...
+        Rows with the same logged / last_alarm are told apart by id
+    """
+    page_size = settings.API_PAGE_SIZE
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param],
+                                 strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        orderings = view.get_orderings()
+        ordering = request.query_params.get(self.ordering_query_param, orderings[0])
+        if ordering not in orderings:
+            raise ValidationError("ordering must be one of: " + ', '.join(orderings))
+        if ordering.lstrip('-') == 'id':
+            return ordering,
+        return ordering, '-id' if ordering.startswith('-') else 'id'
+
+
+STREAM_FORMATS = dict(ndjson='application/x-ndjson', json='application/json')
+
+
+def iterate_batches(queryset, batch_size):
+    """
+        Rows of queryset in batches by id, every batch is a separate
+        query, so rows are never all loaded at once
+    """
+    queryset = queryset.order_by('id')
+    last_id = None
+    while True:
+        batch = list((queryset.filter(id__gt=last_id) if last_id is not None else queryset)[:batch_size])
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1].id
+
+
+def stream_rows(queryset, serializer_class, fmt, context=None):
+    encoder = JSONEncoder()
+    first = True
+    if fmt == 'json':
+        yield '['
+    for batch in iterate_batches(queryset, settings.API_STREAM_BATCH_SIZE):
+        rows = [encoder.encode(row) for row in serializer_class(batch, many=True, context=context).data]
+        if fmt == 'json':
+            yield (',' if not first else '') + ','.join(rows)
+        else:
+            yield '\n'.join(rows) + '\n'
+        first = False
+    if fmt == 'json':
+        yield ']'
+
+
+def stream_response(queryset, serializer_class, fmt, context=None):
+    """
+        All rows of queryset as JSON array or one JSON object
+        per line (?stream=ndjson), memory use does not grow with rows
+    """
+    if fmt not in STREAM_FORMATS:
+        raise ValidationError("stream must be one of: " + ', '.join(sorted(STREAM_FORMATS)))
+    return StreamingHttpResponse(stream_rows(queryset, serializer_class, fmt, context),
+                                 content_type=STREAM_FORMATS[fmt])
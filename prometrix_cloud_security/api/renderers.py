@@ -0,0 +1,16 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+        Lets clients accepting only text/event-stream through content
+        negotiation, the stream itself is a StreamingHttpResponse.
+        Errors are rendered as JSON
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
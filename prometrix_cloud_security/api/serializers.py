@@ -1,5 +1,9 @@
+import json
+import math
+
 from rest_framework import serializers
-from prometrix_cloud_security.models import Site, Sensor, Camera, AlarmZone, CameraImage, AlarmLog, Light
+from prometrix_cloud_security.models import Site, Sensor, Camera, AlarmZone, CameraImage, AlarmLog, Light, AlarmJob, \
+    AlarmClip
 
 
 class SiteSerializer(serializers.ModelSerializer):
@@ -36,8 +40,47 @@ class LightSerializer(serializers.ModelSerializer):
     class Meta:
         model = Light
 
+
+class AlarmJobSerializer(serializers.ModelSerializer):
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AlarmJob
+
+    def get_result(self, obj):
+        return json.loads(obj.result) if obj.result else {}
+
+
+class AlarmClipSerializer(serializers.ModelSerializer):
+    timestamps = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AlarmClip
+
+    def get_timestamps(self, obj):
+        return json.loads(obj.timestamps) if obj.timestamps else []
+
+
+class HeartbeatSerializer(serializers.Serializer):
+    mac_address = serializers.CharField(max_length=255)
+    temperature = serializers.FloatField(required=False)
+    ambient_light = serializers.IntegerField(required=False)
+    digital_inputs = serializers.IntegerField(required=False)
+
+    def validate_temperature(self, value):
+        # "nan" / "inf" pass FloatField and cannot be stored or rolled up
+        if math.isnan(value) or math.isinf(value):
+            raise serializers.ValidationError("A finite number is required.")
+        return value
+
 serializer_classes = dict(sites=SiteSerializer, sensors=SensorSerializer, cameras=CameraSerializer,
                           alarm_zones=AlarmZoneSerializer, camera_images=CameraImageSerializer,
                           alarm_logs=AlarmLogSerializer, lights=LightSerializer)
 
+# many to many fields serializers read, prefetched with one query per relation for
+# a whole page. Foreign keys are rendered as ids and need no select_related
+prefetch_fields = dict(sites=('users',), sensors=('alarm_zones',), alarm_zones=('cameras',))
+
 
+def optimize_queryset(objects, queryset):
+    return queryset.prefetch_related(*prefetch_fields.get(objects, ()))
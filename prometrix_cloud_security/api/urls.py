@@ -26,6 +26,7 @@ router = routers.DefaultRouter()
 router.register(r'users', UserViewSet)
 
 urlpatterns = [
+    url(r'^devices/heartbeats/$', views.DeviceHeartbeatView.as_view(), name='device_heartbeats'),
     url(r'^sites/$', views.SitesListView.as_view(), name='sites_list'),
     url(r'^sites/(?P<site_id>\d+)/$', views.SiteDetailView.as_view(), name='site_detail'),
     url(r'^sites/(?P<site_id>\d+)/(?P<objects>.*)/(?P<object_id>\d+)/enable/$',
@@ -36,11 +37,21 @@ urlpatterns = [
         views.AlarmZoneActivateView.as_view(), name='activate_alarm_zone'),
     url(r'^sites/(?P<site_id>\d+)/alarm_zones/(?P<alarm_zone_id>\d+)/deactivate/$',
         views.AlarmZoneDeactivateView.as_view(), name='deactivate_alarm_zone'),
+    url(r'^sites/(?P<site_id>\d+)/jobs/(?P<job_id>\d+)/$', views.AlarmJobDetailView.as_view(),
+        name='alarm_job_detail'),
     url(r'^sites/(?P<site_id>\d+)/cameras/(?P<camera_id>\d+)/images/$', views.CameraImagesList.as_view(),
         name='camera_images_list'),
+    url(r'^sites/(?P<site_id>\d+)/cameras/(?P<camera_id>\d+)/motion/$', views.CameraMotionStatsView.as_view(),
+        name='camera_motion_stats'),
+    url(r'^sites/(?P<site_id>\d+)/alarm_logs/(?P<alarm_log_id>\d+)/clips/$', views.AlarmLogClipsView.as_view(),
+        name='alarm_log_clips'),
+    url(r'^sites/(?P<site_id>\d+)/(?P<objects>sensors|lights)/(?P<object_id>\d+)/telemetry/$',
+        views.DeviceTelemetryView.as_view(), name='device_telemetry'),
     url(r'^sites/(?P<site_id>\d+)/(?P<objects>.*)/(?P<object_id>\d+)/$', views.SiteObjectDetailView.as_view(),
         name='object_detail_view'),
     url(r'^sites/(?P<site_id>\d+)/last-saved-image/$', views.LastSavedImageView.as_view(), name='last_saved_image'),
+    url(r'^sites/(?P<site_id>\d+)/alarm_stats/$', views.AlarmStatsView.as_view(), name='alarm_stats'),
+    url(r'^sites/(?P<site_id>\d+)/events/$', views.SiteEventsView.as_view(), name='site_events'),
     url(r'^sites/(?P<site_id>\d+)/(?P<objects>.*)/$', views.SiteObjectsListView.as_view(), name='objects_list'),
     url(r'^rest-auth/', include('rest_auth.urls')),
     url(r'^rest-auth/registration/', include('rest_auth.registration.urls')),
@@ -1,16 +1,32 @@
+import time
+
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication, TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status, generics
-from rest_framework.exceptions import APIException
+from rest_framework.exceptions import APIException, ValidationError
 
-from django.shortcuts import get_object_or_404, get_list_or_404
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 
-from prometrix_cloud_security.models import Site, Sensor, Camera, AlarmZone, CameraImage, AlarmLog, Light
+from prometrix_cloud_security.models import Site, Sensor, Camera, AlarmZone, CameraImage, AlarmLog, Light, \
+    AlarmJob, AlarmClip, AlarmStat
 from .serializers import SiteSerializer, SensorSerializer, CameraSerializer,\
-    AlarmZoneSerializer, CameraImageSerializer, serializer_classes
-from prometrix_cloud_security.utils import ThreadedQueue, to_list
+    AlarmZoneSerializer, CameraImageSerializer, AlarmJobSerializer, HeartbeatSerializer, serializer_classes,\
+    optimize_queryset, AlarmClipSerializer
+from .authentication import DeviceKeyAuthentication, IsDevice
+from .pagination import KeysetPagination, stream_response
+from .caching import SiteVersionMixin
+from .renderers import EventStreamRenderer
+from prometrix_cloud_security.utils import to_bool, to_datetime, to_timestamp
+from prometrix_cloud_security.settings import settings
+from prometrix_cloud_security.ingest import record_heartbeats
+from prometrix_cloud_security.telemetry import METRICS, RAW, RESOLUTIONS, query_telemetry
+from prometrix_cloud_security.events import get_event_hub, stream_events
+from prometrix_cloud_security.media import camera_media_path, serve_media
+from prometrix_cloud_security.motion import MotionFilter
 
 
 def verify_model(objects):
@@ -22,50 +38,106 @@ def verify_model(objects):
         raise APIException("Not found")
 
 
-class SitesListView(generics.ListAPIView):
+# orderings lists can be paginated by, the first one is default
+orderings = dict(camera_images=('-id', 'id', '-logged', 'logged'),
+                 alarm_logs=('-id', 'id', '-last_alarm', 'last_alarm'))
+default_orderings = ('id', '-id')
+
+
+class KeysetListView(generics.ListAPIView):
+    """
+        Lists pages by cursor (?cursor=..&page_size=..&ordering=..), or with
+        ?stream=ndjson / ?stream=json all rows streamed in batches
+    """
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
+    objects_name = None
+
+    def get_objects_name(self):
+        return self.objects_name or self.kwargs.get('objects')
+
+    def get_orderings(self):
+        return orderings.get(self.get_objects_name(), default_orderings)
+
+    def list(self, request, *args, **kwargs):
+        queryset = optimize_queryset(self.get_objects_name(), self.filter_queryset(self.get_queryset()))
+        if request.query_params.get('stream'):
+            return stream_response(queryset, self.get_serializer_class(), request.query_params['stream'],
+                                   context=self.get_serializer_context())
+        page = self.paginate_queryset(queryset)
+        if not page and self.paginator.cursor is None:
+            # nothing at all, as get_list_or_404 answered before pagination
+            raise Http404
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class SitesListView(KeysetListView):
     serializer_class = SiteSerializer
+    objects_name = 'sites'
 
     def get_queryset(self):
-        return get_list_or_404(Site.objects.filter(users__in=[self.request.user.id]))
+        return Site.objects.filter(id__in=Site.get_user_site_ids(self.request.user.id))
 
 
-class SiteDetailView(generics.RetrieveAPIView):
+class SiteDetailView(SiteVersionMixin, generics.RetrieveAPIView):
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAuthenticated,)
     serializer_class = SiteSerializer
 
     def retrieve(self, request, *args, **kwargs):
-        instance = Site.objects.filter(users__in=[self.request.user.id],
-                                       pk=kwargs['site_id']).first()
+        instance = Site.filter_user_site(request, kwargs).first()
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
 
-class CameraImagesList(generics.ListAPIView):
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
-    permission_classes = (IsAuthenticated,)
+class CameraImagesList(KeysetListView):
     serializer_class = CameraImageSerializer
+    objects_name = 'camera_images'
 
     def get_queryset(self):
-        return get_list_or_404(CameraImage.filter_camera_images(self.request, self.kwargs))
+        return CameraImage.filter_camera_images(self.request, self.kwargs)
 
 
-class SiteObjectsListView(generics.ListAPIView):
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
-    permission_classes = (IsAuthenticated,)
+class SiteObjectsListView(KeysetListView):
 
     def get_queryset(self):
         model_class = verify_model(self.kwargs['objects'])
-        return get_list_or_404(model_class.filter_user_site(self.request, self.kwargs))
+        return model_class.filter_user_site(self.request, self.kwargs)
+
+    def patch(self, request, site_id, objects):
+        """
+            Enables / disables many objects at once,
+            {"enabled": true, "ids": [1, 2]} or {"enabled": false, "filter": {"type": 2}}
+        """
+        model_class = verify_model(objects)
+        if not isinstance(request.data, dict):
+            raise ValidationError("body must be an object")
+        enabled = request.data.get('enabled')
+        if not isinstance(enabled, bool):
+            raise ValidationError("enabled must be true or false")
+
+        query = model_class.filter_user_site(request, self.kwargs)
+        if 'ids' in request.data:
+            ids = request.data['ids']
+            if not isinstance(ids, list) or not all(type(_id) in (int, long) for _id in ids):
+                raise ValidationError("ids must be a list of integers")
+            query = query.filter(id__in=ids)
+        elif 'filter' in request.data:
+            query = query.filter(**model_class.bulk_filter(request.data['filter']))
+        else:
+            raise ValidationError("ids or filter is required")
+
+        changed = model_class.set_enabled(query, enabled)
+        return Response({model_class.__name__: dict(ids=changed, enabled=enabled)})
 
     def get_serializer_class(self, *args, **kwargs):
         serializer_class = serializer_classes[self.kwargs['objects']]
         return serializer_class
 
 
-class SiteObjectDetailView(generics.RetrieveAPIView):
+class SiteObjectDetailView(SiteVersionMixin, generics.RetrieveAPIView):
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
@@ -113,6 +185,15 @@ class AlarmZoneActivateView(APIView):
     def get(self, request, site_id, alarm_zone_id):
         query = AlarmZone.filter_user_site(request, self.kwargs)
         alarm_zone = get_object_or_404(query, id=alarm_zone_id)
+        if to_bool(request.query_params.get('async')):
+            job = alarm_zone.activate_async(self.request, self.kwargs)
+            if job:
+                return Response(dict(id=alarm_zone.id,
+                                     activated=True,
+                                     job_id=job.id,
+                                     result=dict(alarm_log=job.alarm_log.serialize_to_dict())),
+                                status=status.HTTP_202_ACCEPTED)
+            return Response(dict(id=alarm_zone.id, activated=False, result={}))
         activated_actions, alarm_log = alarm_zone.activate(self.request, self.kwargs)
         if activated_actions and alarm_log:
             return Response(dict(id=alarm_zone.id,
@@ -133,6 +214,15 @@ class AlarmZoneDeactivateView(APIView):
     def get(self, request, site_id, alarm_zone_id):
         query = AlarmZone.filter_user_site(request, self.kwargs)
         alarm_zone = get_object_or_404(query, id=alarm_zone_id)
+        if to_bool(request.query_params.get('async')):
+            job = alarm_zone.deactivate_async(self.request, self.kwargs)
+            if job:
+                return Response(dict(id=alarm_zone.id,
+                                     deactivated=True,
+                                     job_id=job.id,
+                                     result=dict(alarm_log=job.alarm_log.serialize_to_dict())),
+                                status=status.HTTP_202_ACCEPTED)
+            return Response(dict(id=alarm_zone.id, deactivated=False, result={}))
         deactivated_actions, alarm_log = alarm_zone.deactivate(self.request, self.kwargs)
         print deactivated_actions, alarm_log
         if deactivated_actions and alarm_log:
@@ -147,14 +237,203 @@ class AlarmZoneDeactivateView(APIView):
         return Response(dict(id=alarm_zone.id, deactivated=False, result={}))
 
 
-class LastSavedImageView(generics.RetrieveAPIView):
+class LastSavedImageView(SiteVersionMixin, generics.RetrieveAPIView):
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAuthenticated,)
     serializer_class = CameraImageSerializer
 
+    def get_version(self, site_id):
+        # camera images do not bump SiteVersion, the last one and its thumbnail stand for it
+        image = CameraImage.objects.filter(site_id=site_id).order_by('-id')\
+            .values_list('id', 'image_data_thumb').first()
+        if image is None:
+            return 'none'
+        return '{id}{thumb}'.format(id=image[0], thumb='t' if image[1] else '')
+
     def retrieve(self, request, *args, **kwargs):
         instance = CameraImage.get_last_saved_image(request, kwargs['site_id'])
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
 
+class AlarmJobDetailView(generics.RetrieveAPIView):
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+    serializer_class = AlarmJobSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        query = AlarmJob.filter_user_site(request, kwargs)
+        instance = get_object_or_404(query, pk=kwargs['job_id'])
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+
+class AlarmLogClipsView(generics.ListAPIView):
+    """
+        Clips of zone cameras recorded around the alarm
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+    serializer_class = AlarmClipSerializer
+
+    def get_queryset(self):
+        return AlarmClip.filter_user_site(self.request, self.kwargs)\
+            .filter(alarm_log_id=self.kwargs['alarm_log_id']).order_by('id')
+
+
+class DeviceHeartbeatView(APIView):
+    """
+        Heartbeats and telemetry of many devices of a site,
+        {"heartbeats": [{"mac_address": "..", "temperature": 21.5, ...}, ...]}
+    """
+    authentication_classes = (DeviceKeyAuthentication,)
+    permission_classes = (IsDevice,)
+
+    def post(self, request):
+        if not isinstance(request.data, dict):
+            raise ValidationError("body must be an object with heartbeats")
+        serializer = HeartbeatSerializer(data=request.data.get('heartbeats'), many=True)
+        serializer.is_valid(raise_exception=True)
+        updated = record_heartbeats(request.auth, serializer.validated_data)
+        return Response(dict(received=len(serializer.validated_data), updated=updated))
+
+
+class DeviceTelemetryView(APIView):
+    """
+        History of sensor / light metric,
+        ?metric=temperature&start=<timestamp>&end=<timestamp>[&resolution=60]
+        Short ranges are answered with raw readings, longer with minute / hour / day rollups
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, site_id, objects, object_id):
+        model_class = verify_model(objects)
+        if not model_class.filter_user_site(request, self.kwargs).filter(id=object_id).exists():
+            raise Http404
+        metric = request.query_params.get('metric', 'temperature')
+        if metric not in METRICS:
+            raise ValidationError("metric must be one of: " + ', '.join(METRICS))
+        try:
+            end = float(request.query_params.get('end') or time.time())
+            start = float(request.query_params.get('start') or end - 24 * 60 * 60)
+            resolution = request.query_params.get('resolution')
+            resolution = int(resolution) if resolution is not None else None
+        except ValueError:
+            raise ValidationError("start, end and resolution must be numbers")
+        if start >= end:
+            raise ValidationError("start must be before end")
+        if resolution is not None and resolution not in (RAW,) + RESOLUTIONS:
+            raise ValidationError("resolution must be one of: " + ', '.join(map(str, (RAW,) + RESOLUTIONS)))
+
+        resolution, points = query_telemetry(objects, int(object_id), metric, start, end, resolution)
+        return Response(dict(metric=metric, resolution=resolution, points=points))
+
+
+class AlarmStatsView(APIView):
+    """
+        Alarm counts of site, its alarm zones or sensors read from AlarmStat,
+        ?scope=alarm_zones&id=3&resolution=3600&start=<timestamp>&end=<timestamp>
+        Without id there is a series for every object of scope, buckets
+        without alarms are left out
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, site_id):
+        if int(site_id) not in Site.get_user_site_ids(request.user.id):
+            raise Http404
+        scope = request.query_params.get('scope', 'sites')
+        if scope not in AlarmStat.SCOPES:
+            raise ValidationError("scope must be one of: " + ', '.join(AlarmStat.SCOPES))
+        try:
+            resolution = int(request.query_params.get('resolution') or 86400)
+            end = float(request.query_params.get('end') or time.time())
+            start = float(request.query_params.get('start') or end - 30 * 24 * 60 * 60)
+            object_id = request.query_params.get('id')
+            object_id = int(object_id) if object_id is not None else None
+        except ValueError:
+            raise ValidationError("start, end, resolution and id must be numbers")
+        if resolution not in AlarmStat.RESOLUTIONS:
+            raise ValidationError("resolution must be one of: " + ', '.join(map(str, AlarmStat.RESOLUTIONS)))
+        if start >= end:
+            raise ValidationError("start must be before end")
+        if (end - start) / resolution > settings.ALARM_STATS_MAX_POINTS:
+            raise ValidationError("range has more than {0} buckets".format(settings.ALARM_STATS_MAX_POINTS))
+
+        stats = AlarmStat.objects.filter(site_id=site_id, scope=scope, resolution=resolution,
+                                         start__gte=to_datetime(int(start) // resolution * resolution),
+                                         start__lt=to_datetime(end))
+        if object_id is not None:
+            stats = stats.filter(object_id=object_id)
+        series = {}
+        for stat_object_id, stat_start, count in stats.order_by('start').values_list('object_id', 'start', 'count'):
+            series.setdefault(stat_object_id, []).append([int(to_timestamp(stat_start)), count])
+        return Response(dict(scope=scope, resolution=resolution,
+                             series=[dict(id=key, points=series[key]) for key in sorted(series)]))
+
+
+class CameraMotionStatsView(APIView):
+    """
+        Frames of camera saved and skipped by the motion filter,
+        counted only with a shared cache (memcached / redis)
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, site_id, camera_id):
+        if not Camera.filter_user_site(request, dict(site_id=site_id)).filter(id=camera_id).exists():
+            raise Http404
+        stats = MotionFilter.get_stats(int(camera_id))
+        if stats is None:
+            return Response(dict(detail="Motion statistics need a shared cache"),
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(dict(stats, camera=int(camera_id)))
+
+
+class SiteEventsView(APIView):
+    """
+        Server-Sent Events of a site: alarm_log, alarm_zone_activated,
+        alarm_zone_deactivated, enabled and camera_image. Reconnecting
+        clients send Last-Event-ID and get the events they missed
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = (EventStreamRenderer, JSONRenderer)
+
+    def get(self, request, site_id):
+        if int(site_id) not in Site.get_user_site_ids(request.user.id):
+            raise Http404
+        hub = get_event_hub()
+        # every stream holds a worker thread
+        if hub.count() >= settings.EVENTS_MAX_STREAMS:
+            response = Response(dict(detail="Too many event streams"), status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = settings.EVENTS_RETRY
+            return response
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+        response = StreamingHttpResponse(stream_events(hub, int(site_id),
+                                                       int(last_event_id) if last_event_id.isdigit() else None),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx would buffer the stream otherwise
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class CameraMediaView(APIView):
+    """
+        Images and thumbnails of cam/pictures/<camera_id>/, only to
+        users of the camera's site
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, camera_id, name):
+        site_id = Camera.objects.filter(id=camera_id).values_list('site_id', flat=True).first()
+        path = camera_media_path(camera_id, name)
+        if site_id not in Site.get_user_site_ids(request.user.id) or path is None:
+            raise Http404
+        response = serve_media(request, path)
+        if response is None:
+            raise Http404
+        return response
@@ -0,0 +1,82 @@
+import os
+import glob
+import gzip
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from prometrix_cloud_security.models import AlarmLog, AlarmJob, AlarmClip
+from prometrix_cloud_security.retention import mark_alarm_frames
+from prometrix_cloud_security.utils import ensure_dir
+from settings import settings
+
+
+def archive_path(month, first_id, last_id):
+    """
+        month is 'YYYY-MM' of last_alarm (UTC), ids are the first
+        and the last log of the batch written to the file
+    """
+    return os.path.join(settings.ALARM_LOG_ARCHIVE_DIR, 'alarm_logs_{month}.{first}-{last}.ndjson.gz'.format(
+        month=month, first=first_id, last=last_id))
+
+
+def read_archive(month):
+    """
+        Archived alarm logs of month as dicts, a log written
+        again by an interrupted run is read once
+    """
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(settings.ALARM_LOG_ARCHIVE_DIR,
+                                              'alarm_logs_{month}.*.ndjson.gz'.format(month=month)))):
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                row = json.loads(line)
+                if row['id'] not in seen:
+                    seen.add(row['id'])
+                    yield row
+
+
+class AlarmLogArchiver(object):
+    """
+        Moves alarm logs older than before into gzipped files of one month,
+        one JSON object per line. Every batch goes to its own file named by
+        its ids, written aside and renamed, then the logs are deleted; a run
+        interrupted in between writes the same file again. AlarmStat keeps
+        counting them. Logs with clips stay, their jobs lose the link.
+        Frames retention keeps around the logs are marked to be kept first
+    """
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.ALARM_LOG_ARCHIVE_BATCH_SIZE
+        self.archived = 0
+        self.months = set()
+
+    def run(self, before):
+        logs = AlarmLog.objects.filter(last_alarm__lt=before)\
+            .exclude(id__in=AlarmClip.objects.values('alarm_log_id')).order_by('id')
+        last_id = 0
+        while True:
+            rows = list(logs.filter(id__gt=last_id).values()[:self.batch_size])
+            if not rows:
+                break
+            self.write(rows)
+            mark_alarm_frames([(row['alarm_zone_id'], row['last_alarm']) for row in rows])
+            ids = [row['id'] for row in rows]
+            AlarmJob.objects.filter(alarm_log_id__in=ids).update(alarm_log=None)
+            AlarmLog.objects.filter(id__in=ids).delete()
+            self.archived += len(rows)
+            last_id = ids[-1]
+        return self
+
+    def write(self, rows):
+        months = defaultdict(list)
+        for row in rows:
+            months[row['last_alarm'].strftime('%Y-%m')].append(row)
+        ensure_dir(settings.ALARM_LOG_ARCHIVE_DIR)
+        for month, month_rows in months.items():
+            path = archive_path(month, month_rows[0]['id'], month_rows[-1]['id'])
+            temp_path = path + '.tmp'
+            with gzip.open(temp_path, 'wb') as f:
+                f.write(''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in month_rows))
+            os.rename(temp_path, path)
+            self.months.add(month)
@@ -0,0 +1,72 @@
+import time
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from django.db import close_old_connections
+
+from settings import settings
+
+
+class SnapshotCapture(object):
+    """
+        Saves images of several cameras concurrently,
+        bounded by per-camera timeout and overall deadline
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or settings.CAMERA_CAPTURE_WORKERS
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+        return self.pool
+
+    @staticmethod
+    def capture_image(image, timeout):
+        started = time.time()
+        try:
+            image.save(timeout=timeout, conditional=True)
+            return dict(status='not_modified' if image.not_modified else 'ok',
+                        image=image.id, seconds=round(time.time() - started, 3))
+        except Exception as e:
+            return dict(status='error', error=str(e), seconds=round(time.time() - started, 3))
+        finally:
+            close_old_connections()
+
+    def capture(self, images, timeout=None, deadline=None):
+        """
+            Returns {camera_id: {status, seconds, ...}}, cameras which
+            did not finish before deadline are reported as 'timeout'
+            (images saved by others are kept)
+        """
+        timeout = timeout or settings.CAMERA_CAPTURE_TIMEOUT
+        deadline = deadline or settings.CAMERA_CAPTURE_ZONE_DEADLINE
+        started = time.time()
+        pool = self.get_pool()
+        pending = [(image, pool.apply_async(self.capture_image, (image, timeout))) for image in images]
+        result = {}
+        for image, async_result in pending:
+            try:
+                result[image.camera_id] = async_result.get(max(0, started + deadline - time.time()))
+            except TimeoutError:
+                result[image.camera_id] = dict(status='timeout', seconds=round(time.time() - started, 3))
+        return result
+
+
+_snapshot_capture = None
+_snapshot_capture_lock = threading.Lock()
+
+
+def get_snapshot_capture():
+    """
+        Returns snapshot capture shared by the whole process
+    """
+    global _snapshot_capture
+    if _snapshot_capture is None:
+        with _snapshot_capture_lock:
+            if _snapshot_capture is None:
+                _snapshot_capture = SnapshotCapture()
+    return _snapshot_capture
@@ -0,0 +1,218 @@
+import json
+import time
+import logging
+import threading
+from collections import deque
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from prometrix_cloud_security.models import Camera, AlarmZone, AlarmClip
+from prometrix_cloud_security.fetch import get_camera_fetcher
+from prometrix_cloud_security.utils import to_timestamp
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRing(object):
+    """
+        Last frames of one camera as (timestamp, jpeg), bounded
+        by number of frames and by their bytes
+    """
+    def __init__(self, max_frames=None, max_bytes=None):
+        self.max_frames = max_frames or settings.CLIP_RING_FRAMES
+        self.max_bytes = max_bytes or settings.CLIP_RING_BYTES
+        self.frames = deque()
+        self.bytes = 0
+
+    def append(self, timestamp, data):
+        self.frames.append((timestamp, data))
+        self.bytes += len(data)
+        while len(self.frames) > self.max_frames or self.bytes > self.max_bytes:
+            self.bytes -= len(self.frames.popleft()[1])
+
+    def between(self, start, end):
+        return [frame for frame in self.frames if start <= frame[0] <= end]
+
+
+class Recording(object):
+    """
+        Clip being collected, frames before the event are
+        taken from the ring when the clip is picked up
+    """
+    def __init__(self, clip_id, camera_id, alarm_log_id, event, pre):
+        self.clip_id = clip_id
+        self.camera_id = camera_id
+        self.alarm_log_id = alarm_log_id
+        self.event = event
+        self.pre = pre
+        self.post = []
+
+
+class ClipRecorder(object):
+    """
+        Fetches a frame of every camera of alarm zones each CLIP_FRAME_INTERVAL
+        into its FrameRing. Pending AlarmClips get CLIP_PRE_SECONDS of frames
+        from the ring and the next CLIP_POST_FRAMES frames, then are written.
+        Clips older than CLIP_RETENTION days are removed every CLIP_PRUNE_INTERVAL
+    """
+    def __init__(self, workers=None, interval=None, refresh=None, poll_interval=None):
+        self.workers = workers or settings.CLIP_WORKERS
+        self.interval = interval or settings.CLIP_FRAME_INTERVAL
+        self.refresh = refresh or settings.CLIP_REFRESH
+        self.poll_interval = poll_interval or settings.CLIP_POLL_INTERVAL
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.cameras = {}
+        self.rings = {}
+        self.due = {}
+        self.in_flight = set()
+        self.recordings = {}
+        self.stats = dict(frames=0, failed=0, clips=0)
+        self.pool = None
+
+    def load_cameras(self):
+        camera_ids = set(AlarmZone.cameras.through.objects.values_list('camera_id', flat=True))
+        cameras = dict((camera.id, camera) for camera in Camera.objects.filter(id__in=camera_ids, enabled=True))
+        with self.lock:
+            for camera_id in set(self.rings) - set(cameras):
+                del self.rings[camera_id]
+                self.due.pop(camera_id, None)
+            self.cameras = cameras
+
+    def fetch(self, camera):
+        try:
+            image_file = get_camera_fetcher().fetch(camera, conditional=False)
+            result = 'frames'
+        except Exception as e:
+            image_file = None
+            result = 'failed'
+            logger.warning("Camera (id=%s) frame failed: %s", camera.id, e)
+        now = time.time()
+        with self.lock:
+            self.in_flight.discard(camera.id)
+            self.stats[result] += 1
+            if image_file is None:
+                return
+            frame = (now, image_file.content)
+            self.rings.setdefault(camera.id, FrameRing()).append(*frame)
+            for recording in self.recordings.values():
+                if recording.camera_id == camera.id and len(recording.post) < settings.CLIP_POST_FRAMES:
+                    recording.post.append(frame)
+
+    def fetch_due(self, now):
+        with self.lock:
+            cameras = [camera for camera_id, camera in self.cameras.items()
+                       if camera_id not in self.in_flight and self.due.get(camera_id, 0) <= now]
+            for camera in cameras:
+                self.in_flight.add(camera.id)
+                self.due[camera.id] = now + self.interval
+        for camera in cameras:
+            self.pool.apply_async(self.fetch, (camera,))
+
+    def pick_clips(self):
+        """
+            Starts recording of pending clips, clips older than
+            CLIP_POST_TIMEOUT have missed their frames and fail, so do
+            clips of recorders that stopped
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.CLIP_POST_TIMEOUT)
+        # a recorder writes its clips within CLIP_POST_TIMEOUT, older ones lost theirs with it
+        abandoned = now - timedelta(seconds=2 * settings.CLIP_POST_TIMEOUT)
+        AlarmClip.objects.filter(Q(status=AlarmClip.PENDING, created__lt=stale) |
+                                 Q(status=AlarmClip.RECORDING, created__lt=abandoned))\
+            .update(status=AlarmClip.FAILED, finished=now)
+        pending = list(AlarmClip.objects.filter(status=AlarmClip.PENDING)
+                       .values_list('id', 'camera_id', 'alarm_log_id', 'created'))
+        # another recorder may have claimed some of them meanwhile
+        pending = [clip for clip in pending if AlarmClip.objects.filter(id=clip[0], status=AlarmClip.PENDING)
+                   .update(status=AlarmClip.RECORDING)]
+        if not pending:
+            return
+        # cameras added to a zone after the last load
+        missing = list(Camera.objects.filter(id__in=set(clip[1] for clip in pending) - set(self.cameras)))
+        with self.lock:
+            for camera in missing:
+                self.cameras[camera.id] = camera
+            for clip_id, camera_id, alarm_log_id, created in pending:
+                event = to_timestamp(created)
+                ring = self.rings.get(camera_id) or FrameRing()
+                recording = Recording(clip_id, camera_id, alarm_log_id, event,
+                                      ring.between(event - settings.CLIP_PRE_SECONDS, event))
+                recording.post = ring.between(event + 1e-6, float('inf'))[:settings.CLIP_POST_FRAMES]
+                self.recordings[clip_id] = recording
+
+    def finish_clips(self, now):
+        with self.lock:
+            finished = [recording for recording in self.recordings.values()
+                        if len(recording.post) >= settings.CLIP_POST_FRAMES
+                        or now >= recording.event + settings.CLIP_POST_TIMEOUT]
+            for recording in finished:
+                del self.recordings[recording.clip_id]
+        for recording in finished:
+            self.write(recording)
+
+    def write(self, recording):
+        frames = recording.pre + recording.post
+        clip = AlarmClip(id=recording.clip_id, camera_id=recording.camera_id, alarm_log_id=recording.alarm_log_id)
+        if frames:
+            try:
+                clip.clip.save('clip.mjpeg', ContentFile(''.join(data for timestamp, data in frames)), save=False)
+            except Exception:
+                logger.exception("Clip (id=%s) could not be stored", recording.clip_id)
+                frames = []
+        written = AlarmClip.objects.filter(id=recording.clip_id, status=AlarmClip.RECORDING).update(
+            status=AlarmClip.DONE if frames else AlarmClip.FAILED, finished=timezone.now(), clip=clip.clip.name or '',
+            pre_frames=len(recording.pre), frames=len(frames),
+            timestamps=json.dumps([round(timestamp - recording.event, 3) for timestamp, data in frames]))
+        if not written:
+            # failed as abandoned meanwhile
+            if clip.clip.name:
+                clip.clip.storage.delete(clip.clip.name)
+            return
+        self.stats['clips'] += 1
+
+    def prune(self):
+        if settings.CLIP_RETENTION:
+            AlarmClip.prune(timezone.now() - timedelta(days=settings.CLIP_RETENTION))
+
+    def run(self, duration=None):
+        self.pool = ThreadPool(self.workers)
+        started = time.time()
+        self.load_cameras()
+        next_refresh = started + self.refresh
+        next_prune = started
+        while not self.stopped.is_set():
+            now = time.time()
+            if duration and now - started >= duration:
+                break
+            try:
+                if now >= next_refresh:
+                    self.load_cameras()
+                    next_refresh = now + self.refresh
+                if now >= next_prune:
+                    next_prune = now + settings.CLIP_PRUNE_INTERVAL
+                    self.prune()
+                self.fetch_due(now)
+                self.pick_clips()
+                self.finish_clips(now)
+            except Exception:
+                logger.exception("Clip recorder failed")
+            finally:
+                close_old_connections()
+            wake_up = now + self.poll_interval
+            if self.due:
+                wake_up = min(wake_up, min(self.due.values()))
+            self.stopped.wait(max(0, wake_up - time.time()))
+        self.pool.close()
+        self.pool.join()
+        return self.stats
+
+    def stop(self):
+        self.stopped.set()
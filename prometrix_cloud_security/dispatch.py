@@ -0,0 +1,161 @@
+import logging
+import threading
+from Queue import Queue
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ActionBatch(object):
+    """
+        Set of action URLs submitted to the dispatcher at once,
+        collects results in {url: status} form
+    """
+    def __init__(self, size, callback=None):
+        self.result = {}
+        self.pending = size
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        if not size:
+            self.finish()
+
+    def set_result(self, url, status):
+        with self.lock:
+            self.result.update({url: status})
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            self.finish()
+
+    def finish(self):
+        try:
+            if self.callback:
+                self.callback(self.result)
+        except Exception:
+            logger.exception("Action batch callback failed")
+        finally:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """
+            Results collected so far, URLs still pending after timeout are missing
+        """
+        self.done.wait(timeout)
+        with self.lock:
+            return dict(self.result)
+
+
+class ActionDispatcher(object):
+    """
+        Process-wide pool of worker threads requesting action URLs.
+        Every worker keeps its own session, so connections are
+        pooled per host and reused between alarms
+    """
+    TIMED_OUT = 'timed out'
+
+    def __init__(self, workers=None, timeout=None, pool_maxsize=None, max_wait=None):
+        self.workers = workers or settings.ACTION_DISPATCH_WORKERS
+        self.timeout = timeout or settings.ACTION_DISPATCH_TIMEOUT
+        self.max_wait = max_wait or settings.ACTION_DISPATCH_WAIT
+        self.pool_maxsize = pool_maxsize or settings.ACTION_DISPATCH_POOL_MAXSIZE
+        self.queue = Queue()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self.do_work, name='action-dispatch-%d' % i)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+
+    def get_session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_maxsize, pool_maxsize=self.pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return session
+
+    def do_work(self):
+        while True:
+            batch, url, timeout = self.queue.get()
+            try:
+                batch.set_result(url, self.get_status(url, timeout))
+            except Exception:
+                # the worker must survive whatever an action does
+                logger.exception("Action %s failed", url)
+            finally:
+                self.queue.task_done()
+
+    def get_status(self, url, timeout):
+        try:
+            r = self.get_session().get(url, timeout=timeout)
+            return r.status_code
+        except Exception as e:
+            # RequestException, or ValueError of a bad timeout,
+            # as text so results can be returned as JSON
+            return '{name}: {error}'.format(name=e.__class__.__name__, error=e)
+
+    def parse_action(self, action):
+        """
+            Action is either plain url string or dict
+            like {"url": "http://...", "timeout": 2.5}
+        """
+        if isinstance(action, dict):
+            timeout = action.get('timeout')
+            return action['url'].strip(), self.timeout if timeout is None else timeout
+        return action.strip(), self.timeout
+
+    def submit(self, actions, callback=None):
+        """
+            Queue actions without waiting for them,
+            callback receives {url: status} when the batch completes
+        """
+        self.start()
+        tasks = [self.parse_action(action) for action in actions]
+        batch = ActionBatch(len(set(url for url, timeout in tasks)), callback=callback)
+        seen = set()
+        for url, timeout in tasks:
+            if url not in seen:
+                seen.add(url)
+                self.queue.put((batch, url, timeout))
+        return batch
+
+    def run(self, actions, wait=None):
+        """
+            Waits for the actions at most wait seconds (ACTION_DISPATCH_WAIT),
+            URLs not answered by then are reported as timed out
+        """
+        batch = self.submit(actions)
+        result = batch.wait(wait or self.max_wait)
+        for action in actions:
+            result.setdefault(self.parse_action(action)[0], self.TIMED_OUT)
+        return result
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+        Returns dispatcher shared by the whole process
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = ActionDispatcher()
+    return _dispatcher
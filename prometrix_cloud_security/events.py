@@ -0,0 +1,264 @@
+import json
+import logging
+import threading
+import time
+from Queue import Queue, Empty, Full
+from collections import defaultdict, deque, namedtuple
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, close_old_connections
+from django.db.models import Max
+from django.utils.module_loading import import_string
+
+from prometrix_cloud_security.utils import to_datetime
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', 'id site_id kind payload')
+
+
+class Subscription(object):
+    """
+        Events of one site for one client, overflowed is set
+        when the client reads slower than events come
+    """
+    def __init__(self, hub, site_id, queue_size, last_id=None):
+        self.hub = hub
+        self.site_id = site_id
+        self.queue = Queue(queue_size)
+        self.overflowed = False
+        # used by DatabaseEventHub: id of the last event handed over, ids
+        # handed over recently and the id events have to be newer than
+        self.last_id = last_id
+        self.seen = set()
+        self.floor = last_id
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub(object):
+    """
+        In-process fan-out of site events: every event is encoded once and
+        handed to all subscriptions of its site. Keeps the last events of
+        every site, so reconnecting clients get what they missed.
+        Only sees events of its own process and its ids mean nothing to
+        other processes, so it is for single process deployments and
+        tests; DatabaseEventHub has the same interface
+    """
+    def __init__(self, queue_size=None, history=None):
+        self.queue_size = queue_size or settings.EVENTS_QUEUE_SIZE
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+        self.history = defaultdict(lambda: deque(maxlen=history or settings.EVENTS_HISTORY))
+        self.last_id = 0
+
+    def publish(self, site_id, kind, data):
+        payload = json.dumps(data, cls=DjangoJSONEncoder)
+        with self.lock:
+            self.last_id += 1
+            event = Event(self.last_id, site_id, kind, payload)
+            self.history[site_id].append(event)
+            subscriptions = list(self.subscriptions.get(site_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+        return event
+
+    def subscribe(self, site_id, last_event_id=None):
+        subscription = Subscription(self, site_id, self.queue_size)
+        with self.lock:
+            self.subscriptions[site_id].add(subscription)
+            if last_event_id is not None:
+                for event in self.history.get(site_id, ()):
+                    if event.id > last_event_id:
+                        subscription.put(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.site_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.site_id]
+
+    def count(self):
+        """
+            Open subscriptions of the process
+        """
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+
+class DatabaseEventHub(EventHub):
+    """
+        Site events shared by all processes through SiteEvent rows, so
+        events of record_cameras or of other web workers reach every
+        client and event ids are the same everywhere. One thread per
+        process polls new events of the sites it has subscriptions for
+        each EVENTS_POLL_INTERVAL and hands them out; every subscription
+        continues from its own last id, which makes Last-Event-ID replay
+        the same query. Ids come before commits, so the last EVENTS_POLL_WINDOW
+        ids are read again and events committed out of order are handed over
+        late rather than never. Rows older than EVENTS_RETENTION are removed
+    """
+    def __init__(self, queue_size=None, poll_interval=None, retention=None, window=None):
+        super(DatabaseEventHub, self).__init__(queue_size)
+        self.poll_interval = poll_interval or settings.EVENTS_POLL_INTERVAL
+        self.retention = retention or settings.EVENTS_RETENTION
+        self.window = settings.EVENTS_POLL_WINDOW if window is None else window
+        self.thread = None
+
+    @property
+    def model(self):
+        # models publish events, they cannot be imported here
+        return apps.get_model('prometrix_cloud_security', 'SiteEvent')
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='event-hub')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def publish(self, site_id, kind, data):
+        payload = json.dumps(data, cls=DjangoJSONEncoder)
+        row = self.model.objects.create(site_id=site_id, kind=kind, payload=payload)
+        return Event(row.id, site_id, kind, payload)
+
+    def subscribe(self, site_id, last_event_id=None):
+        last_id = self.model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        if last_event_id is None or last_event_id > last_id:
+            last_event_id = last_id
+        subscription = Subscription(self, site_id, self.queue_size, last_id=last_event_id)
+        with self.lock:
+            self.subscriptions[site_id].add(subscription)
+        self.start()
+        return subscription
+
+    def poll(self):
+        with self.lock:
+            subscriptions = [subscription for site_subscriptions in self.subscriptions.values()
+                             for subscription in site_subscriptions]
+        if not subscriptions:
+            return
+        since = min(max(subscription.floor, subscription.last_id - self.window) for subscription in subscriptions)
+        rows = self.model.objects.filter(site_id__in=set(subscription.site_id for subscription in subscriptions),
+                                         id__gt=since)\
+            .order_by('id').values_list('id', 'site_id', 'kind', 'payload')[:settings.EVENTS_POLL_LIMIT]
+        events = defaultdict(list)
+        for row in rows:
+            events[row[1]].append(Event(*row))
+        for subscription in subscriptions:
+            for event in events.get(subscription.site_id, ()):
+                if event.id > subscription.floor and event.id not in subscription.seen:
+                    subscription.put(event)
+                    subscription.seen.add(event.id)
+                    subscription.last_id = max(subscription.last_id, event.id)
+            subscription.seen = set(_id for _id in subscription.seen if _id > subscription.last_id - self.window)
+
+    def prune(self):
+        self.model.objects.filter(created__lt=to_datetime(time.time() - self.retention)).delete()
+
+    def run(self):
+        next_prune = time.time() + 60
+        while True:
+            try:
+                self.poll()
+                if time.time() >= next_prune:
+                    self.prune()
+                    next_prune = time.time() + 60
+            except Exception:
+                logger.exception("Event hub poll failed")
+            finally:
+                close_old_connections()
+            time.sleep(self.poll_interval)
+
+
+_event_hub = None
+_event_hub_lock = threading.Lock()
+
+
+def get_event_hub():
+    """
+        Returns event hub shared by the whole process
+    """
+    global _event_hub
+    if _event_hub is None:
+        with _event_hub_lock:
+            if _event_hub is None:
+                _event_hub = import_string(settings.EVENT_HUB_BACKEND)()
+    return _event_hub
+
+
+_frames_published = {}
+_frames_published_lock = threading.Lock()
+
+
+def is_frame_due(camera_id, now=None):
+    """
+        True at most once per EVENTS_FRAME_INTERVAL seconds for camera,
+        frames are stored far more often than dashboards need them
+    """
+    now = now or time.time()
+    with _frames_published_lock:
+        if now - _frames_published.get(camera_id, 0) < settings.EVENTS_FRAME_INTERVAL:
+            return False
+        _frames_published[camera_id] = now
+    return True
+
+
+def publish(site_id, kind, data):
+    """
+        Publishes event once the current transaction commits,
+        rolled back changes are never announced
+    """
+    def publish_committed():
+        try:
+            get_event_hub().publish(site_id, kind, data)
+        except Exception:
+            # the change is committed, it must not fail because of its event
+            logger.exception("Event %s of site %s was not published", kind, site_id)
+    transaction.on_commit(publish_committed)
+
+
+def format_event(event):
+    return 'id: {id}\nevent: {kind}\ndata: {payload}\n\n'.format(id=event.id, kind=event.kind, payload=event.payload)
+
+
+def stream_events(hub, site_id, last_event_id=None, keepalive=None, max_age=None):
+    """
+        Server-Sent Events of site. Ends after max_age seconds (or on
+        overflow), the browser reconnects with Last-Event-ID. Subscribes
+        when iterated, a response never started leaves nothing behind
+    """
+    keepalive = keepalive or settings.EVENTS_KEEPALIVE
+    deadline = time.time() + (max_age or settings.EVENTS_STREAM_MAX_AGE)
+    subscription = hub.subscribe(site_id, last_event_id)
+    try:
+        yield 'retry: {ms}\n\n'.format(ms=settings.EVENTS_RETRY * 1000)
+        while time.time() < deadline:
+            event = subscription.get(min(keepalive, max(0, deadline - time.time())))
+            if subscription.overflowed:
+                yield 'event: reset\ndata: {}\n\n'
+                return
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_event(event)
+    finally:
+        subscription.close()
@@ -0,0 +1,168 @@
+import threading
+import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.core.files.base import File
+
+from settings import settings
+
+
+class CameraFetchError(Exception):
+    pass
+
+
+class ImageTooLarge(CameraFetchError):
+    pass
+
+
+class ResponseFile(File):
+    """
+        File reading body of a streamed response in chunks,
+        so it goes to storage without being held in memory
+    """
+    def __init__(self, response, name=None, max_size=None, keep_content=False):
+        super(ResponseFile, self).__init__(response.raw, name)
+        self.response = response
+        self.max_size = max_size
+        self.size_read = 0
+        self.kept = [] if keep_content else None
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.response.iter_content(chunk_size or self.DEFAULT_CHUNK_SIZE):
+            self.size_read += len(chunk)
+            if self.max_size and self.size_read > self.max_size:
+                raise ImageTooLarge("Image is larger than {max_size} bytes".format(max_size=self.max_size))
+            if self.kept is not None:
+                self.kept.append(chunk)
+            yield chunk
+
+    @property
+    def content(self):
+        """
+            Streamed bytes, available with keep_content=True
+        """
+        return ''.join(self.kept) if self.kept is not None else None
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+    @property
+    def size(self):
+        return self.size_read
+
+
+class CameraFetcher(object):
+    """
+        Downloads camera images keeping one keep-alive session per camera host.
+        Remembers ETag / Last-Modified of every camera, so unchanged
+        frames are answered with 304 and not downloaded again
+    """
+    def __init__(self, timeout=None, max_size=None, pool_maxsize=None):
+        self.timeout = timeout or settings.CAMERA_CAPTURE_TIMEOUT
+        self.max_size = max_size or settings.CAMERA_FETCH_MAX_SIZE
+        self.pool_maxsize = pool_maxsize or settings.CAMERA_FETCH_POOL_MAXSIZE
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.validators = {}
+
+    def get_session(self, parsed_url):
+        host = (parsed_url.scheme, parsed_url.hostname, parsed_url.port)
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount(parsed_url.scheme + '://', adapter)
+                self.sessions[host] = session
+        return session
+
+    def get_headers(self, camera_id):
+        etag, last_modified = self.validators.get(camera_id, (None, None))
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def open(self, camera, timeout=None, conditional=True):
+        """
+            Returns streamed response of camera image or None
+            when the frame is unchanged since the last fetch
+        """
+        parsed_url = urlparse.urlparse(camera.image_url)
+        auth = (parsed_url.username, parsed_url.password) if parsed_url.username and parsed_url.password else None
+        headers = self.get_headers(camera.id) if conditional else {}
+        r = self.get_session(parsed_url).get(camera.image_url, auth=auth, headers=headers,
+                                             timeout=timeout or self.timeout, stream=True)
+        if r.status_code == 304:
+            # read the empty body, so the connection goes back to the pool
+            r.content
+            r.close()
+            return None
+        if r.status_code != 200:
+            r.close()
+            raise CameraFetchError("Camera (id={id}) answered {status}".format(id=camera.id, status=r.status_code))
+        if int(r.headers.get('Content-Length') or 0) > self.max_size:
+            r.close()
+            raise ImageTooLarge("Image is larger than {max_size} bytes".format(max_size=self.max_size))
+        return r
+
+    def fetch(self, camera, timeout=None, conditional=True):
+        """
+            Reads camera image into memory, returns ResponseFile with
+            content or None if the frame was not modified
+        """
+        r = self.open(camera, timeout=timeout, conditional=conditional)
+        if r is None:
+            return None
+        response_file = ResponseFile(r, max_size=self.max_size, keep_content=True)
+        try:
+            for chunk in response_file.chunks():
+                pass
+        finally:
+            r.close()
+        self.validators[camera.id] = (r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        return response_file
+
+    def save_to(self, field_file, filename, camera, timeout=None, conditional=True, keep_content=False):
+        """
+            Streams camera image into storage of field_file, returns
+            the saved ResponseFile or None if the frame was not modified
+        """
+        r = self.open(camera, timeout=timeout, conditional=conditional)
+        if r is None:
+            return None
+        storage, field = field_file.storage, field_file.field
+        name = storage.get_available_name(field.generate_filename(field_file.instance, filename),
+                                          max_length=field.max_length)
+        response_file = ResponseFile(r, name, max_size=self.max_size, keep_content=keep_content)
+        try:
+            name = storage.save(name, response_file, max_length=field.max_length)
+        except Exception:
+            if storage.exists(name):
+                storage.delete(name)
+            raise
+        finally:
+            r.close()
+        setattr(field_file.instance, field.name, name)
+        self.validators[camera.id] = (r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        return response_file
+
+
+_camera_fetcher = None
+_camera_fetcher_lock = threading.Lock()
+
+
+def get_camera_fetcher():
+    """
+        Returns camera fetcher shared by the whole process
+    """
+    global _camera_fetcher
+    if _camera_fetcher is None:
+        with _camera_fetcher_lock:
+            if _camera_fetcher is None:
+                _camera_fetcher = CameraFetcher()
+    return _camera_fetcher
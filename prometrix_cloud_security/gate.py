@@ -0,0 +1,90 @@
+import math
+import threading
+from collections import defaultdict
+
+from django.core.cache import cache
+
+from settings import settings
+
+
+class TriggerGate(object):
+    """
+        Remembers until when alarm zones and sensors are blocked from
+        triggering again. Checks are answered from process memory, with
+        shared=True blocks also go through django cache (cache.add), so
+        several processes let only one trigger through
+    """
+    PREFIX = 'alarm_gate:'
+    # expired blocks are purged once there are this many
+    MAX_BLOCKS = 10000
+
+    def __init__(self, shared=None):
+        self.shared = settings.ALARM_GATE_SHARED if shared is None else shared
+        self.lock = threading.Lock()
+        self.blocks = {}
+        self.coalesced = defaultdict(int)
+
+    def blocked_until(self, key, now):
+        """
+            Timestamp the key is blocked until or None,
+            every blocked check is counted as coalesced trigger
+        """
+        with self.lock:
+            expires = self.blocks.get(key)
+            if expires > now:
+                self.coalesced[key] += 1
+                return expires
+        if self.shared:
+            expires = cache.get(self.PREFIX + key)
+            if expires > now:
+                with self.lock:
+                    self.blocks[key] = expires
+                    self.coalesced[key] += 1
+                return expires
+        return None
+
+    def claim(self, key, seconds, now):
+        """
+            Blocks key for seconds, returns False when
+            another trigger claimed it first
+        """
+        expires = now + seconds
+        if self.shared and not cache.add(self.PREFIX + key, expires, int(math.ceil(seconds))):
+            return False
+        with self.lock:
+            if self.blocks.get(key) > now:
+                return False
+            if len(self.blocks) >= self.MAX_BLOCKS:
+                self.purge(now)
+            self.blocks[key] = expires
+        return True
+
+    def block(self, key, expires):
+        """
+            Blocks key until expires without claiming it, for blocks known
+            from elsewhere (e.g. Sensor.last_alarm after restart)
+        """
+        with self.lock:
+            self.blocks[key] = max(self.blocks.get(key), expires)
+
+    def purge(self, now):
+        for key, expires in self.blocks.items():
+            if expires <= now:
+                del self.blocks[key]
+                self.coalesced.pop(key, None)
+
+
+_trigger_gate = None
+_trigger_gate_lock = threading.Lock()
+
+
+def get_trigger_gate():
+    """
+        Returns trigger gate shared by the whole process
+    """
+    global _trigger_gate
+    if _trigger_gate is None:
+        with _trigger_gate_lock:
+            if _trigger_gate is None:
+                _trigger_gate = TriggerGate()
+    return _trigger_gate
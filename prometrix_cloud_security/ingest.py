@@ -0,0 +1,58 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from prometrix_cloud_security.models import Sensor, Light, SiteVersion
+from prometrix_cloud_security.telemetry import METRICS, get_telemetry_buffer
+from prometrix_cloud_security.utils import chunked
+from settings import settings
+
+
+def build_update(model, site_id, readings, now):
+    """
+        UPDATE of heartbeat_updated and telemetry of many devices,
+        values differ per device so they go through CASE mac_address.
+        Built by hand, ORM Case / When compiles far slower than the query runs
+    """
+    qn = connection.ops.quote_name
+    mac_column = qn(model._meta.get_field('mac_address').column)
+    heartbeat_field = model._meta.get_field('heartbeat_updated')
+    sets = ['{column} = %s'.format(column=qn(heartbeat_field.column))]
+    params = [heartbeat_field.get_db_prep_value(now, connection)]
+
+    for name in METRICS:
+        field = model._meta.get_field(name)
+        values = [(reading['mac_address'], reading[name]) for reading in readings if reading.get(name) is not None]
+        if not values:
+            continue
+        column = qn(field.column)
+        sets.append('{column} = CASE {mac} {whens} ELSE {column} END'.format(
+            column=column, mac=mac_column, whens=' '.join(['WHEN %s THEN %s'] * len(values))))
+        for mac_address, value in values:
+            params.extend([mac_address, field.get_db_prep_value(value, connection)])
+
+    macs = [reading['mac_address'] for reading in readings]
+    sql = 'UPDATE {table} SET {sets} WHERE {site} = %s AND {mac} IN ({macs})'.format(
+        table=qn(model._meta.db_table), sets=', '.join(sets),
+        site=qn(model._meta.get_field('site').column), mac=mac_column, macs=', '.join(['%s'] * len(macs)))
+    return sql, params + [site_id] + macs
+
+
+def record_heartbeats(site_id, readings, now=None):
+    """
+        Applies heartbeats of many sensors / lights of a site, readings are
+        dicts with mac_address and optional telemetry fields. Every chunk of
+        devices costs one UPDATE per device model, all in one transaction.
+        Telemetry also goes to the history buffer. Returns number of updated rows
+    """
+    now = now or timezone.now()
+    updated = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for chunk in chunked(readings, settings.INGEST_CHUNK_SIZE):
+            for model in (Sensor, Light):
+                cursor.execute(*build_update(model, site_id, chunk, now))
+                updated += cursor.rowcount
+        # heartbeat_updated is part of sensor and light details, one bump per batch
+        if updated:
+            SiteVersion.bump([site_id])
+    get_telemetry_buffer().add(site_id, readings, now)
+    return updated
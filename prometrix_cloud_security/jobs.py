@@ -0,0 +1,84 @@
+import logging
+import threading
+from Queue import Queue
+
+from django.db import close_old_connections
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue(object):
+    """
+        In-process background queue, no external broker needed.
+        Jobs are plain callables executed by a bounded set of threads
+    """
+    def __init__(self, workers=None, sync=None):
+        self.workers = workers or settings.JOB_QUEUE_WORKERS
+        self.sync = settings.JOB_QUEUE_SYNC if sync is None else sync
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            self.recover()
+            for i in range(self.workers):
+                t = threading.Thread(target=self.do_work, name='job-queue-%d' % i)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+
+    def recover(self):
+        """
+            Jobs of a process that died are never finished, they are
+            failed once older than JOB_QUEUE_STALE_AFTER
+        """
+        from prometrix_cloud_security.models import AlarmJob
+        try:
+            AlarmJob.fail_stale(settings.JOB_QUEUE_STALE_AFTER)
+        except Exception:
+            logger.exception("Stale jobs were not failed")
+
+    def do_work(self):
+        while True:
+            func, args, kwargs = self.queue.get()
+            try:
+                self.execute(func, args, kwargs)
+            finally:
+                self.queue.task_done()
+
+    def execute(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Background job %r failed", func)
+        finally:
+            if not self.sync:
+                close_old_connections()
+
+    def enqueue(self, func, *args, **kwargs):
+        if self.sync:
+            self.execute(func, args, kwargs)
+            return
+        self.start()
+        self.queue.put((func, args, kwargs))
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+        Returns job queue shared by the whole process
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
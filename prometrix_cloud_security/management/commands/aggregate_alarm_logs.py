@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from prometrix_cloud_security.models import AlarmStat
+from prometrix_cloud_security.settings import settings
+
+
+class Command(BaseCommand):
+    help = "Recounts hour and day alarm statistics (AlarmStat) of the last days from AlarmLog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help="UTC days to recount, today included")
+
+    def handle(self, *args, **options):
+        today = int(time.time()) // 86400 * 86400
+        # older logs may be archived already, their counts are kept
+        days = min(options['days'], settings.ALARM_LOG_ARCHIVE_AFTER)
+        for day in range(today - (days - 1) * 86400, today + 1, 86400):
+            count = AlarmStat.rebuild(day)
+            self.stdout.write("{day} logs={count}".format(day=time.strftime('%Y-%m-%d', time.gmtime(day)),
+                                                         count=count))
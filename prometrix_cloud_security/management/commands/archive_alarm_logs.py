@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from prometrix_cloud_security.archive import AlarmLogArchiver
+from prometrix_cloud_security.settings import settings
+
+
+class Command(BaseCommand):
+    help = "Moves alarm logs older than ALARM_LOG_ARCHIVE_AFTER days into monthly files in ALARM_LOG_ARCHIVE_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="archive logs older than this many days")
+        parser.add_argument('--batch-size', type=int, default=None, help="logs moved at once")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'] or settings.ALARM_LOG_ARCHIVE_AFTER)
+        archiver = AlarmLogArchiver(batch_size=options['batch_size']).run(before)
+        self.stdout.write("archived={archived} months={months}".format(
+            archived=archiver.archived, months=','.join(sorted(archiver.months)) or '-'))
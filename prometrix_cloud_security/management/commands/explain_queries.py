@@ -0,0 +1,99 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils import timezone
+
+from prometrix_cloud_security.models import Site, Sensor, Camera, AlarmZone, CameraImage, AlarmLog, Light, \
+    TelemetryChunk, AlarmStat, SiteEvent
+
+
+class ExplainRequest(object):
+    """
+        Stands in for request in filter_user_site(request, kwargs)
+    """
+    def __init__(self, user_id):
+        self.user = User(id=user_id)
+
+
+def hot_queries(site_id, user_id, camera_id, zone_id):
+    request = ExplainRequest(user_id)
+    kwargs = dict(site_id=site_id, camera_id=camera_id)
+    day_ago = timezone.now() - timedelta(days=1)
+    queries = [(model.__name__ + '.filter_user_site', model.filter_user_site(request, kwargs).order_by('id')[:100])
+               for model in (Sensor, Camera, AlarmZone, Light)]
+    queries += [
+        ('Site.users of user', Site.users.through.objects.filter(user_id=user_id).values_list('site_id')),
+        ('Site.device_key', Site.objects.filter(device_key='key', enabled=True).values_list('id')),
+        ('CameraImage.filter_camera_images',
+         CameraImage.filter_camera_images(request, kwargs).order_by('-logged', '-id')[:100]),
+        ('CameraImage.get_last_saved_image',
+         Site.scope(CameraImage.objects.all(), request, site_id).order_by('-id')[:1]),
+        ('CameraImage by file', CameraImage.objects.filter(image_data__in=['a', 'b']).values_list('image_data')),
+        ('AlarmLog by site', AlarmLog.filter_user_site(request, kwargs).order_by('-last_alarm', '-id')[:100]),
+        ('AlarmStat of site', AlarmStat.objects.filter(site_id=site_id, scope='alarm_zones', resolution=3600,
+                                                       start__gte=day_ago).order_by('start')),
+        ('SiteEvent poll', SiteEvent.objects.filter(site_id__in=[site_id], id__gt=0).order_by('id')[:1000]),
+        ('AlarmLog by zone and time',
+         AlarmLog.objects.filter(alarm_zone_id=zone_id, last_alarm__gte=day_ago).order_by('-last_alarm')),
+        ('Sensor by mac_address', Sensor.objects.filter(site_id=site_id, mac_address__in=['a', 'b'])),
+        ('Light by mac_address', Light.objects.filter(site_id=site_id, mac_address__in=['a', 'b'])),
+        ('Sensor heartbeats since', Sensor.objects.filter(enabled=True, heartbeat_updated__gt=day_ago)),
+        ('TelemetryChunk range', TelemetryChunk.objects.filter(device_type='sensors', device_id=1,
+                                                               metric='temperature', start__gte=day_ago)),
+    ]
+    return queries
+
+
+def explain(queryset):
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return ['no query, user has no access to the site']
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    # sqlite rows are (id, parent, notused, detail), others one column of plan text
+    return [row[-1] for row in rows]
+
+
+def is_full_scan(line):
+    if connection.vendor == 'sqlite':
+        return line.startswith('SCAN TABLE') and 'USING' not in line
+    return 'Seq Scan' in line
+
+
+class Command(BaseCommand):
+    help = "Prints query plans of the hot site-scoped queries and flags full table scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site', type=int, default=None, help="site id, first site by default")
+        parser.add_argument('--user', type=int, default=None, help="user id, first user of the site by default")
+        parser.add_argument('--fail', action='store_true',
+                            help="exit with error when any query scans a whole table "
+                                 "(on PostgreSQL use a database with realistic row counts)")
+
+    def handle(self, *args, **options):
+        site_id = options['site'] or Site.objects.values_list('id', flat=True).order_by('id').first() or 1
+        user_id = options['user'] or Site.users.through.objects.filter(site_id=site_id)\
+            .values_list('user_id', flat=True).first() or 1
+        camera_id = Camera.objects.filter(site_id=site_id).values_list('id', flat=True).first() or 1
+        zone_id = AlarmZone.objects.filter(site_id=site_id).values_list('id', flat=True).first() or 1
+
+        scans = []
+        for name, queryset in hot_queries(site_id, user_id, camera_id, zone_id):
+            started = time.time()
+            plan = explain(queryset)
+            self.stdout.write("{name} ({ms:.1f}ms)".format(name=name, ms=(time.time() - started) * 1000))
+            for line in plan:
+                flag = ''
+                if is_full_scan(line):
+                    flag = '  <-- full scan'
+                    scans.append(name)
+                self.stdout.write("    {line}{flag}".format(line=line, flag=flag))
+        if scans and options['fail']:
+            raise CommandError("Full table scans in: " + ', '.join(sorted(set(scans))))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from prometrix_cloud_security.monitor import HeartbeatMonitor
+
+
+class Command(BaseCommand):
+    help = "Reports sensors, lights and cameras which stopped sending heartbeats"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=None, help="seconds to run, forever by default")
+
+    def handle(self, *args, **options):
+        monitor = HeartbeatMonitor()
+        try:
+            stats = monitor.run(duration=options['duration'])
+        except KeyboardInterrupt:
+            monitor.stop()
+            stats = monitor.stats
+        self.stdout.write("offline={offline} online={online}".format(**stats))
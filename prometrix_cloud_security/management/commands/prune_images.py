@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from prometrix_cloud_security.retention import RetentionRun
+
+
+class Command(BaseCommand):
+    help = "Removes camera images past the retention policy of their site (Site.image_retention)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site', type=int, action='append', default=None, help="site id, all sites by default")
+        parser.add_argument('--dry-run', action='store_true', help="only report what would be removed")
+        parser.add_argument('--batch-size', type=int, default=None, help="images read and deleted at once")
+
+    def handle(self, *args, **options):
+        result = RetentionRun(dry_run=options['dry_run'], batch_size=options['batch_size']).run(options['site'])
+        self.stdout.write("scanned={scanned} deleted={deleted} files={files} reclaimed={mb:.1f}MB{dry}".format(
+            scanned=result.scanned, deleted=result.deleted, files=result.files, mb=result.bytes / 1048576.0,
+            dry=' (dry run)' if options['dry_run'] else ''))
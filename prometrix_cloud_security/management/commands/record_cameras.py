@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from prometrix_cloud_security.recorder import CameraRecorder
+from prometrix_cloud_security.thumbnails import get_thumbnail_pool
+
+
+class Command(BaseCommand):
+    help = "Saves images of all enabled cameras according to their save_schedule"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="concurrent captures")
+        parser.add_argument('--duration', type=float, default=None, help="seconds to run, forever by default")
+
+    def handle(self, *args, **options):
+        # forks, so before the recorder starts its threads
+        get_thumbnail_pool().start()
+        recorder = CameraRecorder(workers=options['workers'])
+        try:
+            stats = recorder.run(duration=options['duration'])
+        except KeyboardInterrupt:
+            recorder.stop()
+            stats = recorder.stats
+        self.stdout.write("saved={saved} not_modified={not_modified} failed={failed} max_lag={lag:.2f}s".format(**stats))
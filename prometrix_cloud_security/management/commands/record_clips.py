@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from prometrix_cloud_security.clips import ClipRecorder
+
+
+class Command(BaseCommand):
+    help = "Buffers frames of alarm zone cameras and records clips of their activations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="concurrent frame fetches")
+        parser.add_argument('--duration', type=float, default=None, help="seconds to run, forever by default")
+
+    def handle(self, *args, **options):
+        recorder = ClipRecorder(workers=options['workers'])
+        try:
+            stats = recorder.run(duration=options['duration'])
+        except KeyboardInterrupt:
+            recorder.stop()
+            stats = recorder.stats
+        self.stdout.write("frames={frames} failed={failed} clips={clips}".format(**stats))
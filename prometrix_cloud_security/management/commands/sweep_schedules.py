@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from prometrix_cloud_security.models import AlarmZone
+
+
+class Command(BaseCommand):
+    help = "Enables alarm zones whose enabledSchedule fires in the current minute"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--disable', action='store_true',
+                            help="also disable zones whose schedule does not fire")
+        parser.add_argument('--loop', action='store_true', help="sweep at the start of every minute")
+
+    def handle(self, *args, **options):
+        while True:
+            enabled, disabled = AlarmZone.sweep_schedules(disable=options['disable'])
+            self.stdout.write("enabled={enabled} disabled={disabled}".format(enabled=enabled, disabled=disabled))
+            if not options['loop']:
+                break
+            time.sleep(60 - time.time() % 60)
@@ -0,0 +1,130 @@
+import os
+import re
+import mimetypes
+
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, quote_etag
+
+from prometrix_cloud_security.api.caching import is_not_modified
+from settings import settings
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# alarm clips, JPEG frames one after another
+mimetypes.add_type('video/x-motion-jpeg', '.mjpeg')
+
+
+def camera_media_path(camera_id, name):
+    """
+        Absolute path of image (or thumbnail) name of camera, name may
+        have a shard directory. None for names reaching out of the
+        camera directory
+    """
+    parts = name.split('/')
+    if len(parts) > 2 or any(not part or part.startswith('.') or '\\' in part for part in parts):
+        return None
+    return os.path.join(settings.MEDIA_ROOT, 'cam', 'pictures', str(camera_id), *parts)
+
+
+def parse_range(header, size):
+    """
+        (start, end) of a single "bytes=" range, end inclusive.
+        None when the whole file is sent (no header, several ranges
+        or a unit other than bytes), ValueError when not satisfiable
+    """
+    match = RANGE_RE.match(header.replace(' ', '')) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            raise ValueError(header)
+        # suffix range, the last N bytes
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+class RangeFile(object):
+    """
+        Reads at most length bytes of f from start. Has no fileno,
+        so servers cannot sendfile() past the end of the range
+    """
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def serve_media(request, path):
+    """
+        Response with file at absolute path under MEDIA_ROOT. Camera images
+        never change once written, so responses carry a strong ETag and are
+        cached by browsers for MEDIA_CACHE_MAX_AGE. The file is handed to the
+        front server with MEDIA_SERVE_BACKEND x-sendfile (Apache, lighttpd)
+        or x-accel-redirect (nginx), which then also answer ranges; with
+        'file' it is streamed through wsgi.file_wrapper, which app servers
+        send with sendfile()
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    etag = '{mtime:x}-{size:x}'.format(mtime=int(stat.st_mtime), size=stat.st_size)
+    if is_not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        response = build_response(request, path, stat.st_size, etag)
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = 'private, max-age={0}'.format(settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+
+def build_response(request, path, size, etag):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    backend = settings.MEDIA_SERVE_BACKEND
+    if backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+    if backend == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + \
+            os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        return response
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    try:
+        # a range of a file changed since If-Range would be mixed with the old one
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size) \
+            if not if_range or if_range == quote_etag(etag) else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{0}'.format(size)
+        return response
+
+    f = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(f, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
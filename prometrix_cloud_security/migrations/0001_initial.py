@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:01
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import prometrix_cloud_security.utils
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlarmLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('description', models.TextField(null=True)),
+                ('visible', models.BooleanField(default=True)),
+                ('location', models.TextField(null=True)),
+                ('type', models.IntegerField(null=True)),
+                ('last_alarm', models.DateTimeField()),
+                ('alarm_text', models.TextField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AlarmZone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('description', models.TextField(null=True)),
+                ('visible', models.BooleanField(default=True)),
+                ('location', models.TextField(null=True)),
+                ('type', models.IntegerField(null=True)),
+                ('last_alarm', models.DateTimeField()),
+                ('enabledSchedule', models.CharField(default=b'* * * * *', max_length=150)),
+                ('priority', models.IntegerField()),
+                ('activated_actions', models.TextField(blank=True)),
+                ('deactivated_actions', models.TextField(blank=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Camera',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('description', models.TextField(null=True)),
+                ('visible', models.BooleanField(default=True)),
+                ('location', models.TextField(null=True)),
+                ('type', models.IntegerField(null=True)),
+                ('heartbeat_updated', models.DateTimeField()),
+                ('username', models.CharField(max_length=255)),
+                ('password', models.CharField(max_length=255)),
+                ('public_ip', models.CharField(max_length=255)),
+                ('image_url', models.CharField(default=b'http://185.70.145.75/jpg/image.jpg', max_length=255)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='CameraImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_data', models.ImageField(blank=True, upload_to=prometrix_cloud_security.utils.gen_save_path)),
+                ('image_data_thumb', models.ImageField(blank=True, upload_to=prometrix_cloud_security.utils.gen_save_path_thumb)),
+                ('logged', models.DateTimeField(auto_now_add=True)),
+                ('meta', models.CharField(blank=True, max_length=400)),
+                ('camera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Camera')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Light',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('description', models.TextField(null=True)),
+                ('visible', models.BooleanField(default=True)),
+                ('location', models.TextField(null=True)),
+                ('type', models.IntegerField(null=True)),
+                ('heartbeat_updated', models.DateTimeField()),
+                ('mac_address', models.CharField(max_length=255)),
+                ('public_ip', models.CharField(max_length=255)),
+                ('status', models.BooleanField()),
+                ('light_intensity', models.IntegerField()),
+                ('light_mode', models.IntegerField(null=True)),
+                ('digital_output', models.CharField(max_length=50, null=True)),
+                ('ambient_light', models.IntegerField(null=True)),
+                ('digital_inputs', models.IntegerField(null=True)),
+                ('temperature', models.FloatField(null=True)),
+                ('alarm_zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.AlarmZone')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='LightGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('description', models.TextField(null=True)),
+                ('visible', models.BooleanField(default=True)),
+                ('location', models.TextField(null=True)),
+                ('type', models.IntegerField(null=True)),
+                ('status', models.BooleanField()),
+                ('light_intensity', models.IntegerField()),
+                ('light', models.ManyToManyField(related_name='lights', to='prometrix_cloud_security.Light')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Sensor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('description', models.TextField(null=True)),
+                ('visible', models.BooleanField(default=True)),
+                ('location', models.TextField(null=True)),
+                ('type', models.IntegerField(null=True)),
+                ('heartbeat_updated', models.DateTimeField()),
+                ('mac_address', models.CharField(max_length=255)),
+                ('public_ip', models.CharField(max_length=255)),
+                ('last_alarm', models.DateTimeField()),
+                ('alarm_enable', models.BooleanField()),
+                ('timeout', models.IntegerField()),
+                ('digital_output', models.IntegerField(null=True)),
+                ('ambient_light', models.IntegerField(null=True)),
+                ('digital_inputs', models.IntegerField(null=True)),
+                ('temperature', models.FloatField(null=True)),
+                ('alarm_zones', models.ManyToManyField(related_name='sensors', to='prometrix_cloud_security.AlarmZone')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Site',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('description', models.TextField(null=True)),
+                ('visible', models.BooleanField(default=True)),
+                ('location', models.TextField(null=True)),
+                ('type', models.IntegerField(null=True)),
+                ('users', models.ManyToManyField(to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='lightgroup',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='light',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='cameraimage',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='alarmzone',
+            name='cameras',
+            field=models.ManyToManyField(related_name='alarm_zones', to='prometrix_cloud_security.Camera'),
+        ),
+        migrations.AddField(
+            model_name='alarmzone',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='alarmlog',
+            name='alarm_zone',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.AlarmZone'),
+        ),
+        migrations.AddField(
+            model_name='alarmlog',
+            name='sensor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Sensor'),
+        ),
+        migrations.AddField(
+            model_name='alarmlog',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+    ]
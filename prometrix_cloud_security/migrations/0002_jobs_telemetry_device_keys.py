@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlarmJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('status', models.CharField(default=b'queued', max_length=20)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('result', models.TextField(blank=True)),
+                ('alarm_log', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.AlarmLog')),
+                ('alarm_zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.AlarmZone')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TelemetryChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_type', models.CharField(max_length=20)),
+                ('device_id', models.IntegerField()),
+                ('metric', models.CharField(max_length=20)),
+                ('day', models.DateField(db_index=True)),
+                ('start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('offsets', models.BinaryField()),
+                ('values', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TelemetryRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_type', models.CharField(max_length=20)),
+                ('device_id', models.IntegerField()),
+                ('metric', models.CharField(max_length=20)),
+                ('resolution', models.IntegerField()),
+                ('start', models.DateTimeField()),
+                ('count', models.IntegerField()),
+                ('total', models.FloatField()),
+                ('minimum', models.FloatField()),
+                ('maximum', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='save_schedule',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='site',
+            name='device_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='camera',
+            name='heartbeat_updated',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='light',
+            name='heartbeat_updated',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='sensor',
+            name='heartbeat_updated',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AddField(
+            model_name='telemetryrollup',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='telemetrychunk',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AddField(
+            model_name='alarmjob',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='telemetryrollup',
+            unique_together=set([('device_type', 'device_id', 'metric', 'resolution', 'start')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='telemetrychunk',
+            unique_together=set([('device_type', 'device_id', 'metric', 'start')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:01
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0002_jobs_telemetry_device_keys'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='alarmlog',
+            index_together=set([('site', 'last_alarm'), ('alarm_zone', 'last_alarm')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='cameraimage',
+            index_together=set([('camera', 'logged'), ('site', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='light',
+            index_together=set([('site', 'mac_address')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='sensor',
+            index_together=set([('site', 'mac_address')]),
+        ),
+    ]
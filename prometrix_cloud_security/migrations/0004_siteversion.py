@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0003_site_scoped_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteVersion',
+            fields=[
+                ('site', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='version', serialize=False, to='prometrix_cloud_security.Site')),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0004_siteversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='site',
+            name='image_retention',
+            field=models.TextField(blank=True),
+        ),
+    ]
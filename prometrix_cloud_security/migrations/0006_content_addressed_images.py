@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import prometrix_cloud_security.storage
+import prometrix_cloud_security.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0005_site_image_retention'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cameraimage',
+            name='image_data',
+            field=models.ImageField(blank=True, db_index=True, storage=prometrix_cloud_security.storage.ContentAddressedStorage(), upload_to=prometrix_cloud_security.utils.gen_save_path),
+        ),
+        migrations.AlterField(
+            model_name='cameraimage',
+            name='image_data_thumb',
+            field=models.ImageField(blank=True, db_index=True, storage=prometrix_cloud_security.storage.ContentAddressedStorage(), upload_to=prometrix_cloud_security.utils.gen_save_path_thumb),
+        ),
+    ]
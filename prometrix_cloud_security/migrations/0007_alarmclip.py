@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import prometrix_cloud_security.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0006_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlarmClip',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(db_index=True, default=b'pending', max_length=20)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('pre_frames', models.IntegerField(default=0)),
+                ('frames', models.IntegerField(default=0)),
+                ('timestamps', models.TextField(blank=True)),
+                ('clip', models.FileField(blank=True, upload_to=prometrix_cloud_security.utils.gen_clip_path)),
+                ('alarm_log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='clips', to='prometrix_cloud_security.AlarmLog')),
+                ('camera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Camera')),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site')),
+            ],
+        ),
+    ]
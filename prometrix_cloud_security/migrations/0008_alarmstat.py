@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0007_alarmclip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlarmStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('resolution', models.IntegerField()),
+                ('start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='alarmstat',
+            unique_together=set([('scope', 'object_id', 'resolution', 'start')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='alarmstat',
+            index_together=set([('site', 'scope', 'resolution', 'start')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0008_alarmstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('payload', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prometrix_cloud_security.Site')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='siteevent',
+            index_together=set([('site', 'id')]),
+        ),
+    ]
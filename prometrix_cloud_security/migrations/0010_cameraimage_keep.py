@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 09:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prometrix_cloud_security', '0009_siteevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cameraimage',
+            name='keep',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,29 +1,63 @@
 import time
 import json
-from datetime import datetime
-import urlparse
+import hashlib
+import logging
+from collections import defaultdict
+from functools import partial
 
-import StringIO
+from rest_framework.exceptions import APIException, NotFound, ValidationError, Throttled
 
-import cronex
-import requests
-from PIL import Image as PImage
 
-from rest_framework.exceptions import APIException, NotFound
-
-
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Min, F
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django.core.files.base import ContentFile
-from django.core.serializers import serialize
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.base import File, ContentFile
+from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.encoding import is_protected_type
 
 import utils
-from prometrix_cloud_security.utils import ThreadedQueue, to_list
+from prometrix_cloud_security.utils import to_list, chunked, to_datetime, to_timestamp, is_cache_shared
+from prometrix_cloud_security.dispatch import get_dispatcher
+from prometrix_cloud_security.jobs import get_job_queue
+from prometrix_cloud_security.capture import get_snapshot_capture
+from prometrix_cloud_security.fetch import get_camera_fetcher
+from prometrix_cloud_security.thumbnails import make_thumbnails, get_thumbnail_pool
+from prometrix_cloud_security.schedule import get_schedule, split_firing
+from prometrix_cloud_security.gate import get_trigger_gate
+from prometrix_cloud_security.motion import MotionFilter, get_motion_filter
+from prometrix_cloud_security.events import publish, is_frame_due
+from prometrix_cloud_security.storage import ContentAddressedStorage
 from settings import settings
 
+logger = logging.getLogger(__name__)
+
+
+_json_encoder = DjangoJSONEncoder()
+
+
+def serialize_value(field, instance):
+    """
+        Value of field as the json serializer writes it
+    """
+    value = field.value_from_object(instance)
+    if not is_protected_type(value):
+        return field.value_to_string(instance)
+    if isinstance(value, (int, long, float, type(None))):
+        return value
+    # datetime / date / time / Decimal
+    return _json_encoder.default(value)
+
 
 class BaseModel(models.Model):
+    # column holding id of the site, see SiteVersion
+    site_field = 'site_id'
+
     index = models.IntegerField(null=True)  # index to be used for sorting in some lists
     enabled = models.BooleanField(default=True)  # if the site is enabled / disabled in the system
     description = models.TextField(null=True)  # Site description, like address or other.
@@ -45,8 +79,7 @@ class BaseModel(models.Model):
             Filter objects of model for
             particular site which belongs to current user
         """
-        return cls.objects.filter(site__id=kwargs['site_id'],
-                                  site__users__in=[request.user.id])
+        return Site.scope(cls.objects.all(), request, kwargs['site_id'])
 
     # TODO: remove all to_dict(s)
     def to_dict(self):
@@ -60,33 +93,181 @@ class BaseModel(models.Model):
                     and not key.startswith('_s'))
 
     def serialize_to_dict(self):
-        fields = json.loads(serialize('json', [self, ]))[0].get("fields")
-        fields.update(dict(id=self.pk))
+        """
+            Same dict django serializers give, built from field values directly:
+            foreign keys as ids, many to many as lists of ids (prefetched if any),
+            dates and times as strings DjangoJSONEncoder makes of them
+        """
+        fields = dict((field.name, serialize_value(field, self))
+                      for field in self._meta.concrete_fields if field.serialize)
+        for field in self._meta.many_to_many:
+            fields[field.name] = [related.pk for related in getattr(self, field.name).all()]
+        fields['id'] = self.pk
         return fields
 
     def enable(self):
         if not self.enabled:
             self.enabled = True
             self.save()
+            self.publish_enabled([(self.id, getattr(self, self.site_field))], True)
 
     def disable(self):
         if self.enabled:
             self.enabled = False
             self.save()
+            self.publish_enabled([(self.id, getattr(self, self.site_field))], False)
+
+    @classmethod
+    def publish_enabled(cls, rows, enabled):
+        """
+            Announces enabled change of (id, site_id) rows, one event per site
+        """
+        sites = {}
+        for _id, site_id in rows:
+            sites.setdefault(site_id, []).append(_id)
+        for site_id, ids in sites.items():
+            publish(site_id, 'enabled', dict(model=cls.__name__, ids=ids, enabled=enabled))
+
+    @classmethod
+    def bulk_filter(cls, filters):
+        """
+            Validates {field: value} filter of bulk requests, only plain
+            fields of the model can be used, values are converted by the fields
+        """
+        fields = dict((f.name, f) for f in cls._meta.concrete_fields if not f.is_relation)
+        if not isinstance(filters, dict) or not filters:
+            raise ValidationError("filter must be a non-empty object")
+        unknown = set(filters) - set(fields)
+        if unknown:
+            raise ValidationError("Unknown filter fields: {fields}".format(fields=', '.join(sorted(unknown))))
+        try:
+            return dict((name, fields[name].to_python(value)) for name, value in filters.items())
+        except DjangoValidationError as e:
+            raise ValidationError("Invalid filter value: {error}".format(error='; '.join(e.messages)))
+
+    @classmethod
+    def set_enabled(cls, queryset, enabled):
+        """
+            Switches all objects of queryset to enabled state, returns ids of
+            the changed objects. They are locked while read, so the ids are
+            exactly the objects the UPDATE changes
+        """
+        with transaction.atomic():
+            rows = list(queryset.exclude(enabled=enabled).select_for_update()
+                        .values_list('id', cls.site_field).order_by('id'))
+            ids = [_id for _id, site_id in rows]
+            for chunk in chunked(ids, 500):
+                cls.objects.filter(id__in=chunk).update(enabled=enabled)
+            if rows:
+                SiteVersion.bump(set(site_id for _id, site_id in rows))
+                cls.publish_enabled(rows, enabled)
+        return ids
 
 
 class Site(BaseModel):
+    site_field = 'id'
+
     users = models.ManyToManyField(User)
+    device_key = models.CharField(max_length=64, blank=True, db_index=True)  # key devices of the site send in X-Device-Key header
+    image_retention = models.TextField(blank=True)  # json camera image retention policy, empty - IMAGE_RETENTION
+
+    @classmethod
+    def get_id_by_device_key(cls, key):
+        """
+            Site id for device key, cached so devices are authenticated
+            without a query on every heartbeat. The key comes from the
+            client, it is hashed to be a safe cache key
+        """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        cache_key = 'device_key:' + hashlib.sha1(key).hexdigest()
+        site_id = cache.get(cache_key)
+        if site_id is None:
+            site_id = cls.objects.filter(device_key=key, enabled=True).values_list('id', flat=True).first() or 0
+            cache.set(cache_key, site_id, settings.DEVICE_KEY_CACHE_TIMEOUT)
+        return site_id or None
+
+    @classmethod
+    def get_user_site_ids(cls, user_id):
+        """
+            Ids of sites of user. With SITE_MEMBERSHIP_CACHE_TIMEOUT they are
+            cached until the user is added to or removed from a site, only
+            when the cache is shared: other processes would keep granting
+            access to sites the user was removed from
+        """
+        if user_id is None:
+            return frozenset()
+        query = cls.users.through.objects.filter(user_id=user_id).values_list('site_id', flat=True)
+        if not settings.SITE_MEMBERSHIP_CACHE_TIMEOUT or not is_cache_shared():
+            return frozenset(query)
+        cache_key = 'user_sites:{id}'.format(id=user_id)
+        site_ids = cache.get(cache_key)
+        if site_ids is None:
+            site_ids = frozenset(query)
+            cache.set(cache_key, site_ids, settings.SITE_MEMBERSHIP_CACHE_TIMEOUT)
+        return site_ids
+
+    @classmethod
+    def forget_user_sites(cls, user_ids):
+        cache.delete_many(['user_sites:{id}'.format(id=user_id) for user_id in user_ids])
+
+    @classmethod
+    def scope(cls, queryset, request, site_id, field='site_id'):
+        """
+            Narrows queryset to site_id if the site belongs to current user,
+            a plain column filter instead of a join through Site.users
+        """
+        if int(site_id) not in cls.get_user_site_ids(request.user.id):
+            return queryset.none()
+        return queryset.filter(**{field: site_id})
+
+    @classmethod
+    def filter_user_site(cls, request, kwargs):
+        return cls.scope(cls.objects.all(), request, kwargs['site_id'], field='id')
+
+
+class SiteVersion(models.Model):
+    """
+        Counter bumped on every change of the site or its objects,
+        read endpoints answer conditional GETs from it
+    """
+    site = models.OneToOneField(Site, primary_key=True, related_name='version')
+    version = models.BigIntegerField(default=0)
+    updated = models.DateTimeField()
+
+    @classmethod
+    def bump(cls, site_ids):
+        """
+            Sites without counter yet get it on the first read
+        """
+        site_ids = list(site_ids)
+        if site_ids:
+            cls.objects.filter(site_id__in=site_ids).update(version=F('version') + 1, updated=timezone.now())
+
+    @classmethod
+    def get(cls, site_id):
+        """
+            Returns (version, updated) of site
+        """
+        row = cls.objects.filter(site_id=site_id).values_list('version', 'updated').first()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(site_id=site_id, updated=timezone.now())
+            except IntegrityError:
+                pass
+            row = cls.objects.filter(site_id=site_id).values_list('version', 'updated').first()
+        return row
 
 
 class Camera(BaseModel):
-    heartbeat_updated = models.DateTimeField()  # timestamp for when the camera heartbeat last communicated with the server
+    heartbeat_updated = models.DateTimeField(db_index=True)  # timestamp for when the camera heartbeat last communicated with the server
     username = models.CharField(max_length=255)  # IP camera username
     password = models.CharField(max_length=255)  # IP camera password
     public_ip = models.CharField(max_length=255)  # IP to access the camera "online"
     site = models.ForeignKey(Site)  # The alarmzone a sensor can trigger
     image_url = models.CharField(max_length=255, default='http://185.70.145.75/jpg/image.jpg')
-    # save_schedule =
+    save_schedule = models.CharField(max_length=150, blank=True)  # recording interval in seconds or cron expression, empty - not recorded
 
 
 class AlarmZone(BaseModel):
@@ -103,12 +284,14 @@ class AlarmZone(BaseModel):
                                                      status="Activated" if self.enabled else "Deactivated"))
 
     def save_images(self, request, kwargs):
-        for camera in self.cameras.all():
-            image = CameraImage.objects.filter(site__id=kwargs['site_id'],
-                                               site__users__in=[request.user.id],
-                                               camera__id=camera.id).first()
-            if image:
-                image.save()
+        """
+            Saves images of all zone cameras concurrently,
+            returns per-camera status and timing
+        """
+        first_images = Site.scope(CameraImage.objects.filter(camera__alarm_zones=self), request, kwargs['site_id'])\
+            .values('camera').annotate(first_id=Min('id')).values('first_id')
+        images = CameraImage.objects.filter(id__in=first_images).select_related('camera')
+        return get_snapshot_capture().capture(images)
 
     def get_sensor(self, request, kwargs):
         sensor = Sensor.filter_user_site(request, kwargs).filter(alarm_zones__in=[kwargs['alarm_zone_id']]).first()
@@ -116,35 +299,105 @@ class AlarmZone(BaseModel):
             raise NotFound("Sensor for alarm_zone (id={id}) not found".format(id=kwargs['alarm_zone_id']))
         return sensor
 
-    def make_alarm_log_entry(self, request, kwargs):
+    def pass_gate(self, request, kwargs):
+        """
+            Lets the first trigger through and raises Throttled for repeated
+            ones, the zone is blocked for ALARM_ZONE_DEBOUNCE seconds and its
+            sensor for Sensor.timeout. A blocked zone costs one cache check.
+            Returns the sensor
+        """
+        gate = get_trigger_gate()
+        now = time.time()
+        zone_key = 'zone:{id}'.format(id=self.id)
+        self.check_gate(gate, zone_key, now)
+
         sensor = self.get_sensor(request, kwargs)
-        alarm_log = AlarmLog(last_alarm=datetime.now(),
+        sensor_key = 'sensor:{id}'.format(id=sensor.id)
+        # last alarm of the sensor may come from before restart
+        gate.block(sensor_key, to_timestamp(sensor.last_alarm) + sensor.timeout)
+        self.check_gate(gate, sensor_key, now, zone_key)
+
+        if not gate.claim(sensor_key, sensor.timeout, now):
+            self.check_gate(gate, sensor_key, now, zone_key)
+        if not gate.claim(zone_key, max(settings.ALARM_ZONE_DEBOUNCE, sensor.timeout), now):
+            self.check_gate(gate, zone_key, now)
+        sensor.last_alarm = to_datetime(now)
+        Sensor.objects.filter(id=sensor.id).update(last_alarm=sensor.last_alarm)
+        SiteVersion.bump([sensor.site_id])
+        return sensor
+
+    def check_gate(self, gate, key, now, zone_key=None):
+        expires = gate.blocked_until(key, now)
+        if expires is None:
+            return
+        if zone_key:
+            # further triggers of the zone stop at the zone check
+            gate.block(zone_key, expires)
+        raise Throttled(wait=expires - now, detail="Alarm zone (id={id}) triggered again too soon, "
+                                                   "{count} triggers coalesced.".format(id=self.id,
+                                                                                       count=gate.coalesced[key]))
+
+    def make_alarm_log_entry(self, request, kwargs, sensor=None):
+        sensor = sensor or self.get_sensor(request, kwargs)
+        alarm_log = AlarmLog(last_alarm=timezone.now(),
                              alarm_text="Some alarm text",
                              alarm_zone=self,
                              site=Site.objects.get(id=kwargs['site_id']),
                              sensor=sensor)
-        alarm_log.save()
+        # counted in the same transaction, see AlarmStat.rebuild
+        with transaction.atomic():
+            alarm_log.save()
         return alarm_log
 
     def enable(self):
-        job = cronex.CronExpression(str(self.enabledSchedule))
-        if job.check_trigger(time.gmtime(time.time())[:5]) and (not self.enabled):
+        if get_schedule(self.enabledSchedule).fires_at(time.time()) and (not self.enabled):
             self.enabled = True
             self.save()
+            self.publish_enabled([(self.id, self.site_id)], True)
+
+    @classmethod
+    def set_enabled(cls, queryset, enabled):
+        if enabled:
+            # same as enable(), zones are enabled only while their schedule fires
+            firing, idle = split_firing(queryset.values_list('enabledSchedule', flat=True).distinct(), time.time())
+            queryset = queryset.filter(enabledSchedule__in=firing)
+        return super(AlarmZone, cls).set_enabled(queryset, enabled)
+
+    @classmethod
+    def sweep_schedules(cls, now=None, disable=False):
+        """
+            Enables all zones whose enabledSchedule fires in the current minute,
+            with disable=True also disables zones whose schedule does not.
+            Every distinct expression is evaluated once and zones are changed
+            with bulk updates, returns (enabled count, disabled count)
+        """
+        firing, idle = split_firing(cls.objects.values_list('enabledSchedule', flat=True).distinct(),
+                                    now or time.time())
+
+        enabled = sum(len(cls.set_enabled(cls.objects.filter(enabledSchedule__in=expressions), True))
+                      for expressions in chunked(firing, 500))
+        disabled = 0
+        if disable:
+            disabled = sum(len(cls.set_enabled(cls.objects.filter(enabledSchedule__in=expressions), False))
+                           for expressions in chunked(idle, 500))
+        return enabled, disabled
 
     def activate(self, request, kwargs):
         if not self.enabled:
             return None, None
+        sensor = self.pass_gate(request, kwargs)
 
         # saving images from cameras
         self.save_images(request, kwargs)
 
         # create alarm_log
-        alarm_log = self.make_alarm_log_entry(request, kwargs)
+        alarm_log = self.make_alarm_log_entry(request, kwargs, sensor)
+        AlarmClip.request_clips(self, alarm_log)
+
+        self.publish_activity('alarm_zone_activated', alarm_log)
 
-        # sending requests to URLs in separated threads
-        threaded_queue = ThreadedQueue(concurrent=100)
-        activated_actions = threaded_queue.run(to_list(self.activated_actions))
+        # sending requests to URLs through the shared dispatcher
+        activated_actions = get_dispatcher().run(to_list(self.activated_actions))
         return activated_actions, alarm_log
 
     def deactivate(self, request, kwargs):
@@ -153,15 +406,47 @@ class AlarmZone(BaseModel):
 
         # create alarm_log
         alarm_log = self.make_alarm_log_entry(request, kwargs)
+        self.publish_activity('alarm_zone_deactivated', alarm_log)
 
-        # deactivating in separated threads
-        threaded_queue = ThreadedQueue(concurrent=100)
-        deactivated_actions = threaded_queue.run(to_list(self.deactivated_actions))
+        # deactivating through the shared dispatcher
+        deactivated_actions = get_dispatcher().run(to_list(self.deactivated_actions))
         return deactivated_actions, alarm_log
 
+    def enqueue_job(self, kind, request, kwargs, sensor=None):
+        alarm_log = self.make_alarm_log_entry(request, kwargs, sensor)
+        job = AlarmJob.objects.create(kind=kind,
+                                      site=alarm_log.site,
+                                      alarm_zone=self,
+                                      alarm_log=alarm_log)
+        get_job_queue().enqueue(job.run, request, kwargs)
+        return job
+
+    def activate_async(self, request, kwargs):
+        """
+            Persists alarm_log and leaves images and actions
+            to the background job queue
+        """
+        if not self.enabled:
+            return None
+        sensor = self.pass_gate(request, kwargs)
+        job = self.enqueue_job(AlarmJob.ACTIVATE, request, kwargs, sensor)
+        AlarmClip.request_clips(self, job.alarm_log)
+        self.publish_activity('alarm_zone_activated', job.alarm_log, job)
+        return job
+
+    def deactivate_async(self, request, kwargs):
+        if self.enabled:
+            return None
+        job = self.enqueue_job(AlarmJob.DEACTIVATE, request, kwargs)
+        self.publish_activity('alarm_zone_deactivated', job.alarm_log, job)
+        return job
+
+    def publish_activity(self, kind, alarm_log, job=None):
+        publish(self.site_id, kind, dict(alarm_zone=self.id, alarm_log=alarm_log.id, job=job.id if job else None))
+
 
 class Sensor(BaseModel):
-    heartbeat_updated = models.DateTimeField()  # timestamp for when the sensor heartbeat last communicated with the server
+    heartbeat_updated = models.DateTimeField(db_index=True)  # timestamp for when the sensor heartbeat last communicated with the server
     mac_address = models.CharField(max_length=255)  #
     public_ip = models.CharField(max_length=255)
     alarm_zones = models.ManyToManyField(AlarmZone, related_name='sensors')
@@ -174,12 +459,20 @@ class Sensor(BaseModel):
     digital_inputs = models.IntegerField(null=True)  # (binary value for the digital inputs)
     temperature = models.FloatField(null=True)  # ambient temperature degrees(c)
 
+    class Meta:
+        # heartbeats and telemetry look devices up by site and mac_address
+        index_together = [('site', 'mac_address')]
+
     def to_dict(self):
         result = dict((key, value) for key, value in self.__dict__.iteritems()
                       if not callable(value)
                       and not key.startswith('__')
                       and not key.startswith('_s'))
-        result.update({"alarm_zones": [amz.id for amz in self.alarm_zones.all()]})
+        if 'alarm_zones' in getattr(self, '_prefetched_objects_cache', {}):
+            alarm_zones = [amz.id for amz in self.alarm_zones.all()]
+        else:
+            alarm_zones = list(self.alarm_zones.values_list('id', flat=True))
+        result.update({"alarm_zones": alarm_zones})
         return result
 
 
@@ -191,6 +484,10 @@ class AlarmLog(BaseModel):
     alarm_zone = models.ForeignKey(AlarmZone)
     # images =
 
+    class Meta:
+        # logs are listed by site or zone, newest first
+        index_together = [('site', 'last_alarm'), ('alarm_zone', 'last_alarm')]
+
     def to_dict(self):
         """
         Convert object to dictonary where keys are names
@@ -201,14 +498,273 @@ class AlarmLog(BaseModel):
                     and not key.startswith('__')
                     and not key.startswith('_s'))
 
-    def serialize_to_dict(self):
-        fields = json.loads(serialize('json', [self, ]))[0].get("fields")
-        fields.update(dict(id=self.pk))
-        return fields
+    @classmethod
+    def log_offline_sensors(cls, sensor_ids):
+        """
+            Writes "Sensor offline" entry for every sensor with alarm zone,
+            entry goes to the zone with the lowest id
+        """
+        zones = {}
+        for chunk in chunked(sensor_ids, 500):
+            for sensor_id, site_id, zone_id in Sensor.alarm_zones.through.objects.filter(sensor_id__in=chunk)\
+                    .values_list('sensor_id', 'sensor__site_id', 'alarmzone_id').order_by('-alarmzone_id'):
+                zones[sensor_id] = (site_id, zone_id)
+        now = timezone.now()
+        with transaction.atomic():
+            logs = cls.objects.bulk_create([cls(last_alarm=now, alarm_text="Sensor offline", site_id=site_id,
+                                                sensor_id=sensor_id, alarm_zone_id=zone_id)
+                                            for sensor_id, (site_id, zone_id) in zones.items()])
+            AlarmStat.count_logs([(log.site_id, log.alarm_zone_id, log.sensor_id, log.last_alarm) for log in logs])
+        SiteVersion.bump(set(site_id for site_id, zone_id in zones.values()))
+        return logs
+
+
+class SiteEvent(models.Model):
+    """
+        Event published to dashboards of the site, see events.DatabaseEventHub
+    """
+    site = models.ForeignKey(Site)
+    kind = models.CharField(max_length=50)
+    payload = models.TextField()  # json
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        index_together = ('site', 'id')
+
+
+class AlarmStat(models.Model):
+    """
+        Number of alarm logs of a site, alarm zone or sensor per hour and
+        per day (UTC). Counted on every AlarmLog insert, so reports never
+        read AlarmLog; rebuild() recounts days from AlarmLog
+    """
+    SCOPES = ('sites', 'alarm_zones', 'sensors')
+    RESOLUTIONS = (3600, 86400)
+
+    site = models.ForeignKey(Site)
+    scope = models.CharField(max_length=20)  # sites / alarm_zones / sensors
+    object_id = models.IntegerField()
+    resolution = models.IntegerField()  # seconds, 3600 / 86400
+    start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('scope', 'object_id', 'resolution', 'start')
+        # reports read one site by scope and time
+        index_together = [('site', 'scope', 'resolution', 'start')]
+
+    @classmethod
+    def bucket_counts(cls, rows):
+        """
+            {(site_id, scope, object_id, resolution, start): count}
+            of (site_id, alarm_zone_id, sensor_id, last_alarm) rows
+        """
+        counts = defaultdict(int)
+        for site_id, alarm_zone_id, sensor_id, last_alarm in rows:
+            timestamp = int(to_timestamp(last_alarm))
+            for resolution in cls.RESOLUTIONS:
+                start = timestamp // resolution * resolution
+                for scope, object_id in zip(cls.SCOPES, (site_id, alarm_zone_id, sensor_id)):
+                    counts[(site_id, scope, object_id, resolution, start)] += 1
+        return counts
+
+    @classmethod
+    def add_counts(cls, counts):
+        for keys in chunked(counts, 500):
+            existing = dict(((scope, object_id, resolution, to_timestamp(start)), stat_id)
+                            for stat_id, scope, object_id, resolution, start in
+                            cls.objects.filter(object_id__in=set(key[2] for key in keys),
+                                               start__in=set(to_datetime(key[4]) for key in keys))
+                            .values_list('id', 'scope', 'object_id', 'resolution', 'start'))
+            increments = defaultdict(list)
+            created = []
+            for key in keys:
+                stat_id = existing.get(key[1:])
+                if stat_id:
+                    increments[counts[key]].append(stat_id)
+                else:
+                    created.append(cls(site_id=key[0], scope=key[1], object_id=key[2], resolution=key[3],
+                                       start=to_datetime(key[4]), count=counts[key]))
+            for count, stat_ids in increments.items():
+                cls.objects.filter(id__in=stat_ids).update(count=F('count') + count)
+            cls.objects.bulk_create(created)
+
+    @classmethod
+    def count_logs(cls, rows):
+        """
+            Adds (site_id, alarm_zone_id, sensor_id, last_alarm) rows,
+            a few statements for one log or for many. Errors are logged,
+            logs are written anyway and rebuild() recounts them
+        """
+        counts = cls.bucket_counts(rows)
+        try:
+            try:
+                with transaction.atomic():
+                    cls.add_counts(counts)
+            except IntegrityError:
+                # another insert created the same hour meanwhile
+                with transaction.atomic():
+                    cls.add_counts(counts)
+        except Exception:
+            logger.exception("Alarm statistics of %s logs not counted", len(rows))
+
+    @classmethod
+    def rebuild(cls, day):
+        """
+            Recounts the UTC day starting at timestamp day from AlarmLog,
+            logs of the day have to be in AlarmLog (not archived). Rows of
+            the day are locked and updated in place, so logs inserted
+            meanwhile (counted in their transaction) are either read here
+            or counted after the rebuild, never both
+        """
+        start, end = to_datetime(day), to_datetime(day + 86400)
+        try:
+            with transaction.atomic():
+                counts = cls.replace_counts(start, end)
+        except IntegrityError:
+            # an insert created an hour of the day meanwhile
+            with transaction.atomic():
+                counts = cls.replace_counts(start, end)
+        return sum(count for key, count in counts.items() if key[1] == 'sites' and key[3] == 86400)
+
+    @classmethod
+    def replace_counts(cls, start, end):
+        existing = dict(((scope, object_id, resolution, to_timestamp(bucket)), stat_id)
+                        for stat_id, scope, object_id, resolution, bucket in
+                        cls.objects.select_for_update().filter(start__gte=start, start__lt=end)
+                        .values_list('id', 'scope', 'object_id', 'resolution', 'start'))
+        counts = cls.bucket_counts(AlarmLog.objects.filter(last_alarm__gte=start, last_alarm__lt=end)
+                                   .values_list('site_id', 'alarm_zone_id', 'sensor_id', 'last_alarm').iterator())
+        recounted = defaultdict(list)
+        created = []
+        for key, count in counts.items():
+            stat_id = existing.pop(key[1:], None)
+            if stat_id:
+                recounted[count].append(stat_id)
+            else:
+                created.append(cls(site_id=key[0], scope=key[1], object_id=key[2], resolution=key[3],
+                                   start=to_datetime(key[4]), count=count))
+        # rows without logs stay, inserts may be waiting for them
+        recounted[0].extend(existing.values())
+        for count, stat_ids in recounted.items():
+            for chunk in chunked(stat_ids, 500):
+                cls.objects.filter(id__in=chunk).update(count=count)
+        cls.objects.bulk_create(created)
+        return counts
+
+
+class AlarmJob(models.Model):
+    ACTIVATE = 'activate'
+    DEACTIVATE = 'deactivate'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    kind = models.CharField(max_length=20)  # activate / deactivate
+    status = models.CharField(max_length=20, default=QUEUED)
+    site = models.ForeignKey(Site)
+    alarm_zone = models.ForeignKey(AlarmZone)
+    alarm_log = models.ForeignKey(AlarmLog, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True)
+    result = models.TextField(blank=True)  # json with per-action results
+
+    def __unicode__(self):
+        return '{kind} job (id={id}) - {status}'.format(kind=self.kind, id=self.id, status=self.status)
+
+    @classmethod
+    def fail_stale(cls, age):
+        """
+            Fails queued / running jobs created more than age seconds ago,
+            the in-process queue lost them on restart
+        """
+        return cls.objects.filter(status__in=[cls.QUEUED, cls.RUNNING],
+                                  created__lt=to_datetime(time.time() - age))\
+            .update(status=cls.FAILED, finished=timezone.now(),
+                    result=json.dumps(dict(error="Job was lost on restart")))
+
+    def run(self, request, kwargs):
+        self.status = AlarmJob.RUNNING
+        self.save(update_fields=['status'])
+        result = {}
+        try:
+            if self.kind == AlarmJob.ACTIVATE:
+                result['images'] = self.alarm_zone.save_images(request, kwargs)
+                result['activated_actions'] = get_dispatcher().run(to_list(self.alarm_zone.activated_actions))
+            else:
+                result['deactivated_actions'] = get_dispatcher().run(to_list(self.alarm_zone.deactivated_actions))
+            self.status = AlarmJob.DONE
+        except Exception as e:
+            result['error'] = str(e)
+            self.status = AlarmJob.FAILED
+        self.result = json.dumps(result, default=str)
+        self.finished = timezone.now()
+        self.save(update_fields=['status', 'result', 'finished'])
+
+    @classmethod
+    def filter_user_site(cls, request, kwargs):
+        return Site.scope(cls.objects.all(), request, kwargs['site_id'])
+
+
+class AlarmClip(models.Model):
+    """
+        Frames of a zone camera around an activation, stored as MJPEG
+        (JPEG frames one after another). Activation leaves it pending,
+        the record_clips command fills it from its frame buffers
+    """
+    PENDING = 'pending'
+    RECORDING = 'recording'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    alarm_log = models.ForeignKey(AlarmLog, related_name='clips')
+    camera = models.ForeignKey(Camera)
+    site = models.ForeignKey(Site)
+    status = models.CharField(max_length=20, default=PENDING, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)  # time of the event
+    finished = models.DateTimeField(null=True)
+    pre_frames = models.IntegerField(default=0)  # frames taken before the event
+    frames = models.IntegerField(default=0)
+    timestamps = models.TextField(blank=True)  # json, seconds of every frame from created
+    clip = models.FileField(upload_to=utils.gen_clip_path, blank=True)
+
+    def __unicode__(self):
+        return 'clip (id={id}) of camera (id={camera}) - {status}'.format(id=self.id, camera=self.camera_id,
+                                                                        status=self.status)
+
+    @classmethod
+    def request_clips(cls, alarm_zone, alarm_log):
+        """
+            Pending clip for every camera of zone, with ALARM_CLIPS_ENABLED
+        """
+        if not settings.ALARM_CLIPS_ENABLED:
+            return []
+        return cls.objects.bulk_create([cls(alarm_log=alarm_log, camera_id=camera_id, site_id=alarm_zone.site_id)
+                                        for camera_id in alarm_zone.cameras.values_list('id', flat=True)])
+
+    @classmethod
+    def filter_user_site(cls, request, kwargs):
+        return Site.scope(cls.objects.all(), request, kwargs['site_id'])
+
+    @classmethod
+    def prune(cls, before, batch_size=None):
+        """
+            Deletes finished clips created before, their files go with
+            the rows (alarm_clip_deleted). Returns number of deleted clips
+        """
+        clips = cls.objects.filter(created__lt=before, status__in=(cls.DONE, cls.FAILED)).order_by('id')
+        deleted = 0
+        while True:
+            ids = list(clips.values_list('id', flat=True)[:batch_size or settings.CLIP_PRUNE_BATCH_SIZE])
+            if not ids:
+                return deleted
+            cls.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
 
 
 class Light(BaseModel):
-    heartbeat_updated = models.DateTimeField()  # timestamp for when the sensor heartbeat last communicated with the server
+    heartbeat_updated = models.DateTimeField(db_index=True)  # timestamp for when the sensor heartbeat last communicated with the server
     mac_address = models.CharField(max_length=255)  # Sensor hardware mac address
     public_ip = models.CharField(max_length=255)
     alarm_zone = models.ForeignKey(AlarmZone)
@@ -221,6 +777,9 @@ class Light(BaseModel):
     digital_inputs = models.IntegerField(null=True)  # (binary value for the digital inputs)
     temperature = models.FloatField(null=True)  # ambient temperature degrees(c)
 
+    class Meta:
+        index_together = [('site', 'mac_address')]
+
 
 class LightGroup(BaseModel):
     status = models.BooleanField()  # is the lightgroup currently switched on/off ?
@@ -229,52 +788,204 @@ class LightGroup(BaseModel):
     light = models.ManyToManyField(Light, related_name='lights')  # All the lights in this light group
 
 
+class TelemetryChunk(models.Model):
+    """
+        Raw telemetry readings of one device metric for one hour,
+        packed into arrays of float32 (see telemetry.pack)
+    """
+    site = models.ForeignKey(Site)
+    device_type = models.CharField(max_length=20)  # sensors / lights
+    device_id = models.IntegerField()
+    metric = models.CharField(max_length=20)  # temperature / ambient_light / digital_inputs
+    day = models.DateField(db_index=True)  # history is partitioned, pruned and archived by whole days
+    start = models.DateTimeField()  # hour the chunk covers
+    count = models.IntegerField(default=0)
+    offsets = models.BinaryField()  # seconds from start
+    values = models.BinaryField()
+
+    class Meta:
+        unique_together = ('device_type', 'device_id', 'metric', 'start')
+
+
+class TelemetryRollup(models.Model):
+    """
+        Aggregate of device metric readings over one minute, hour or day
+    """
+    site = models.ForeignKey(Site)
+    device_type = models.CharField(max_length=20)
+    device_id = models.IntegerField()
+    metric = models.CharField(max_length=20)
+    resolution = models.IntegerField()  # seconds, 60 / 3600 / 86400
+    start = models.DateTimeField()
+    count = models.IntegerField()
+    total = models.FloatField()
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+
+    class Meta:
+        unique_together = ('device_type', 'device_id', 'metric', 'resolution', 'start')
+
+
 class CameraImage(models.Model):
     camera = models.ForeignKey(Camera)
-    image_data = models.ImageField(upload_to=utils.gen_save_path, blank=True)
-    image_data_thumb = models.ImageField(upload_to=utils.gen_save_path_thumb, blank=True)
+    # files are named by content, equal frames of a camera share one file
+    image_data = models.ImageField(upload_to=utils.gen_save_path, storage=ContentAddressedStorage(),
+                                   blank=True, db_index=True)
+    image_data_thumb = models.ImageField(upload_to=utils.gen_save_path_thumb, storage=ContentAddressedStorage(),
+                                         blank=True, db_index=True)
     site = models.ForeignKey(Site)
     logged = models.DateTimeField(auto_now_add=True)
     meta = models.CharField(max_length=400, blank=True)
+    keep = models.BooleanField(default=False)  # taken around an archived alarm, kept by retention
+
+    class Meta:
+        # images of camera by time, last saved image of site
+        index_together = [('camera', 'logged'), ('site', 'id')]
 
     def save(self, *args, **kwargs):
-        parsed_url = urlparse.urlparse(self.camera.image_url)
-        if parsed_url.username and parsed_url.password:
-            r = requests.get(self.camera.image_url,
-                             auth=(parsed_url.username, parsed_url.password))
+        """
+            Downloads image from camera and saves it with thumbnail.
+            With conditional=True nothing is saved (not_modified is set)
+            when the camera reports the frame unchanged since the last fetch.
+            With MOTION_FILTER_ENABLED frames hardly differing from the last
+            stored one are not saved either, or only their thumbnails
+            (MOTION_FILTER_ACTION='thumbnail')
+        """
+        timeout = kwargs.pop('timeout', None)
+        conditional = kwargs.pop('conditional', False)
+        filename = "temp.jpg"
+
+        motion_filter = get_motion_filter()
+        if motion_filter is None:
+            image_file = get_camera_fetcher().save_to(self.image_data, filename, self.camera,
+                                                      timeout=timeout, conditional=conditional, keep_content=True)
+        else:
+            # the frame is compared before it goes to storage
+            image_file = get_camera_fetcher().fetch(self.camera, timeout=timeout, conditional=conditional)
+            if image_file is not None:
+                if motion_filter.check(self.camera_id, image_file.content):
+                    self.image_data.save(filename, ContentFile(image_file.content), save=False)
+                elif motion_filter.action == MotionFilter.DROP:
+                    image_file = None
+        self.not_modified = image_file is None
+        if self.not_modified:
+            return
+        thumbnail_pool = get_thumbnail_pool()
+        if thumbnail_pool.inline:
+            self.create_thumb(image_file.content)
+            super(CameraImage, self).save(*args, **kwargs)
+            self.restore_files(image_file.content)
         else:
-            r = requests.get(self.camera.image_url)
+            # image_data_thumb is filled in when the pool is done
+            super(CameraImage, self).save(*args, **kwargs)
+            self.restore_files(image_file.content)
+            thumbnail_pool.submit(image_file.content, partial(CameraImage.fill_thumbs, self.pk))
 
-        filename = "temp.jpg"
+    def restore_files(self, data):
+        """
+            Files of a frame shared with other rows may be deleted with the
+            last of them before this row is saved, they are stored again
+        """
+        storage = self.image_data.storage
+        if self.image_data.name and not storage.exists(self.image_data.name):
+            storage.save(self.image_data.name, ContentFile(data))
+        if self.image_data_thumb.name and not storage.exists(self.image_data_thumb.name):
+            self.save_thumbs(make_thumbnails(data))
 
-        self.image_data.save(
-            filename,
-            ContentFile(r.content),
-            save=False
-        )
-        self.create_thumb(self.image_data.path)
-        super(CameraImage, self).save(*args, **kwargs)
+    def create_thumb(self, data=None):
+        """
+            Creates thumbnails of all CAMERA_THUMBNAIL_SIZES from image bytes
+            (read from storage when not given)
+        """
+        if data is None:
+            self.image_data.open('rb')
+            try:
+                data = self.image_data.read()
+            finally:
+                self.image_data.close()
+        self.save_thumbs(make_thumbnails(data))
 
-    def create_thumb(self, image_path):
-        filename = image_path
-        im = PImage.open(image_path)
-        im.thumbnail((150, 150), PImage.ANTIALIAS)
-        temp_handle = StringIO.StringIO()
-        im.save(temp_handle, 'jpeg')
-        temp_handle.seek(0)
+    def save_thumbs(self, thumbs):
+        """
+            The first of CAMERA_THUMBNAIL_SIZES is image_data_thumb,
+            others are stored next to the image
+        """
+        sizes = settings.CAMERA_THUMBNAIL_SIZES
+        filename = "temp.jpg"
 
         self.image_data_thumb.save(
             filename,
-            ContentFile(temp_handle.read()),
+            File(thumbs[tuple(sizes[0])]),
             save=False
         )
+        if not self.image_data:
+            # thumbnail only frame, nothing to name the others after
+            return
+        for size in sizes[1:]:
+            self.image_data.storage.save(utils.gen_thumb_name(self.image_data.name, size), File(thumbs[tuple(size)]))
+
+    @classmethod
+    def fill_thumbs(cls, pk, thumbs):
+        image = cls.objects.filter(pk=pk).select_related('camera').first()
+        if image is None:
+            return
+        image.save_thumbs(thumbs)
+        # update() does not go through save(), which would download the image again
+        cls.objects.filter(pk=pk).update(image_data_thumb=image.image_data_thumb.name)
+        if not image.image_data_thumb.storage.exists(image.image_data_thumb.name):
+            # deleted with another row sharing them before the update
+            image.save_thumbs(thumbs)
 
     def delete(self, *args, **kwargs):
-        storage_image, path = self.image_data.storage, self.image_data.path
-        storage_thumb, path = self.image_data_thumb.storage, self.image_data_thumb.path
+        files = (self.image_data.name, self.image_data_thumb.name)
         super(CameraImage, self).delete(*args, **kwargs)
-        storage_image.delete(path)
-        storage_thumb.delete(path)
+        self.delete_files(self.unreferenced_files([files]))
+
+    @staticmethod
+    def file_names(image_name, thumb_name):
+        """
+            Stored files of image: the image, image_data_thumb
+            and the other CAMERA_THUMBNAIL_SIZES next to the image
+        """
+        names = [name for name in (image_name, thumb_name) if name]
+        if image_name:
+            names += [utils.gen_thumb_name(image_name, size) for size in settings.CAMERA_THUMBNAIL_SIZES[1:]]
+        return names
+
+    @classmethod
+    def unreferenced_files(cls, files, exclude_ids=()):
+        """
+            Stored files of (image_data, image_data_thumb) names which no row
+            (besides exclude_ids) refers to, equal frames share their files
+        """
+        files = set(files)
+        rows = cls.objects.exclude(id__in=exclude_ids)
+        images = set(rows.filter(image_data__in=[image for image, thumb in files if image])
+                     .values_list('image_data', flat=True))
+        thumbs = set(rows.filter(image_data_thumb__in=[thumb for image, thumb in files if thumb])
+                     .values_list('image_data_thumb', flat=True))
+        names = set()
+        for image, thumb in files:
+            names.update(cls.file_names(image if image not in images else '', thumb if thumb not in thumbs else ''))
+        return sorted(names)
+
+    @classmethod
+    def delete_files(cls, names):
+        """
+            Removes files from storage, returns number of bytes reclaimed.
+            Files already gone or kept by the storage are skipped
+        """
+        storage = cls._meta.get_field('image_data').storage
+        reclaimed = 0
+        for name in names:
+            try:
+                size = storage.size(name)
+            except (OSError, IOError):
+                continue
+            storage.delete(name)
+            if not storage.exists(name):
+                reclaimed += size
+        return reclaimed
 
     def __unicode__(self):
         return settings.MEDIA_URL + self.image_data.name
@@ -291,11 +1002,99 @@ class CameraImage(models.Model):
             Filter objects of model for particular
             site and camera which belongs to current user
         """
-        return cls.objects.filter(site__id=kwargs['site_id'],
-                                  site__users__in=[request.user.id],
-                                  camera__id=kwargs['camera_id'])
+        return Site.scope(cls.objects.filter(camera__id=kwargs['camera_id']), request, kwargs['site_id'])
 
     @classmethod
     def get_last_saved_image(cls, request, site_id):
-        return cls.objects.filter(site__id=site_id,
-                                  site__users__in=[request.user.id]).order_by("-id").first()
+        return Site.scope(cls.objects.all(), request, site_id).order_by("-id").first()
+
+
+@receiver(m2m_changed, sender=Site.users.through)
+def site_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Drops cached site ids of users added to or removed from sites
+    """
+    if action == 'pre_clear':
+        # ids are gone after clear, remember them for post_clear
+        if reverse:
+            instance._cleared_ids = [instance.pk], list(instance.site_set.values_list('id', flat=True))
+        else:
+            instance._cleared_ids = list(instance.users.values_list('id', flat=True)), [instance.pk]
+    elif action == 'post_clear':
+        user_ids, site_ids = getattr(instance, '_cleared_ids', ([], []))
+        Site.forget_user_sites(user_ids)
+        SiteVersion.bump(site_ids)
+    elif action in ('post_add', 'post_remove'):
+        Site.forget_user_sites([instance.pk] if reverse else pk_set)
+        SiteVersion.bump(pk_set if reverse else [instance.pk])
+
+
+# camera images are left out, recording cameras would change their site every second
+VERSIONED_MODELS = (Site, Sensor, Camera, AlarmZone, AlarmLog, Light, LightGroup)
+
+
+def bump_site_version(sender, instance, **kwargs):
+    """
+        Bumps version of the site of saved or deleted object, deletes of
+        querysets, in admin and cascades included
+    """
+    SiteVersion.bump([instance.pk if sender is Site else instance.site_id])
+
+
+def bump_m2m_site_version(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        SiteVersion.bump([instance.site_id])
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_site_version, sender=model, dispatch_uid='site_version_save_' + model.__name__)
+    post_delete.connect(bump_site_version, sender=model, dispatch_uid='site_version_delete_' + model.__name__)
+for relation in (AlarmZone.cameras, Sensor.alarm_zones, LightGroup.light):
+    m2m_changed.connect(bump_m2m_site_version, sender=relation.through)
+
+
+@receiver(post_save, sender=AlarmLog)
+def alarm_log_saved(sender, instance, created, **kwargs):
+    if created:
+        publish(instance.site_id, 'alarm_log', instance.serialize_to_dict())
+
+
+@receiver(post_save, sender=AlarmLog)
+def count_alarm_log(sender, instance, created, **kwargs):
+    # never raises, a failed count does not fail the activation
+    if created:
+        AlarmStat.count_logs([(instance.site_id, instance.alarm_zone_id, instance.sensor_id, instance.last_alarm)])
+
+
+@receiver(post_save, sender=CameraImage)
+def camera_image_saved(sender, instance, created, **kwargs):
+    # each event is a write, recording cameras announce some of their frames
+    if created and is_frame_due(instance.camera_id):
+        publish(instance.site_id, 'camera_image', dict(
+            id=instance.id, camera=instance.camera_id, logged=instance.logged,
+            image_data=instance.image_data.url if instance.image_data else None,
+            image_data_thumb=instance.image_data_thumb.url if instance.image_data_thumb else None))
+
+
+@receiver(post_delete, sender=AlarmClip)
+def alarm_clip_deleted(sender, instance, **kwargs):
+    # also deletes of alarm logs and cameras, the file stays if the transaction rolls back
+    if instance.clip:
+        name, storage = instance.clip.name, instance.clip.storage
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(pre_delete, sender=Site)
+def site_pre_delete(sender, instance, **kwargs):
+    instance._deleted_user_ids = list(instance.users.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Site)
+def site_post_delete(sender, instance, **kwargs):
+    Site.forget_user_sites(getattr(instance, '_deleted_user_ids', []))
+
+
+@receiver(post_delete, sender=User)
+def user_post_delete(sender, instance, **kwargs):
+    # memberships go with the user without m2m_changed
+    Site.forget_user_sites([instance.pk])
@@ -0,0 +1,184 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections
+
+from prometrix_cloud_security.models import Sensor, Light, Camera, AlarmLog
+from prometrix_cloud_security.utils import to_datetime, to_timestamp
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+DEVICE_MODELS = (('sensors', Sensor), ('lights', Light), ('cameras', Camera))
+
+
+class HeartbeatIndex(object):
+    """
+        Heap of next expected heartbeats, keys are (device_type, id).
+        Superseded heap entries are skipped lazily when they come up,
+        so every heartbeat and every expiry costs O(log n)
+    """
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        self.offline = set()
+
+    def load(self, deadlines):
+        """
+            Replaces the index with {key: deadline}, devices which are still
+            offline are not reported again. Returns keys of devices back online
+        """
+        online = [key for key in self.offline if key in deadlines and self.deadlines.get(key) != deadlines[key]]
+        self.offline = set(key for key in self.offline if self.deadlines.get(key) == deadlines.get(key))
+        self.deadlines = deadlines
+        self.heap = [(deadline, key) for key, deadline in deadlines.items()]
+        heapq.heapify(self.heap)
+        return online
+
+    def beat(self, key, deadline):
+        """
+            Returns True when the device was offline
+        """
+        if self.deadlines.get(key) == deadline:
+            return False
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+        if key in self.offline:
+            self.offline.discard(key)
+            return True
+        return False
+
+    def expire(self, now):
+        """
+            Keys of devices whose deadline passed since the last call
+        """
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, key = heapq.heappop(self.heap)
+            if self.deadlines.get(key) == deadline and key not in self.offline:
+                self.offline.add(key)
+                expired.append(key)
+        if len(self.heap) > 4 * len(self.deadlines) + 1000:
+            self.load(self.deadlines)
+        return expired
+
+    def next_deadline(self):
+        return self.heap[0][0] if self.heap else None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+def report_offline(keys):
+    """
+        Default offline handler, logs devices and writes
+        AlarmLog entries of sensors
+    """
+    for device_type, device_id in keys:
+        logger.warning("Device %s (id=%s) is offline", device_type, device_id)
+    AlarmLog.log_offline_sensors([device_id for device_type, device_id in keys if device_type == 'sensors'])
+
+
+def report_online(keys):
+    for device_type, device_id in keys:
+        logger.info("Device %s (id=%s) is back online", device_type, device_id)
+
+
+class HeartbeatMonitor(object):
+    """
+        Detects sensors, lights and cameras which stopped sending heartbeats.
+        Builds HeartbeatIndex from the database on start, then polls only rows
+        whose heartbeat_updated moved since the last poll and wakes up at the
+        nearest deadline, so detection lags at most poll_interval
+    """
+    def __init__(self, timeouts=None, poll_interval=None, refresh=None, overlap=None,
+                 on_offline=report_offline, on_online=report_online):
+        self.timeouts = timeouts or settings.HEARTBEAT_TIMEOUTS
+        self.poll_interval = poll_interval or settings.HEARTBEAT_MONITOR_POLL_INTERVAL
+        self.refresh = refresh or settings.HEARTBEAT_MONITOR_REFRESH
+        self.overlap = settings.HEARTBEAT_MONITOR_OVERLAP if overlap is None else overlap
+        self.on_offline = on_offline
+        self.on_online = on_online
+        self.index = HeartbeatIndex()
+        self.watermark = None
+        self.stopped = threading.Event()
+        self.stats = dict(offline=0, online=0)
+
+    def load(self):
+        """
+            Rebuilds the index from all enabled devices
+        """
+        deadlines = {}
+        watermark = None
+        for device_type, model in DEVICE_MODELS:
+            timeout = self.timeouts[device_type]
+            rows = model.objects.filter(enabled=True).values_list('id', 'heartbeat_updated').iterator()
+            for device_id, heartbeat in rows:
+                deadlines[(device_type, device_id)] = to_timestamp(heartbeat) + timeout
+                watermark = max(watermark, heartbeat) if watermark else heartbeat
+        online = self.index.load(deadlines)
+        self.watermark = watermark or to_datetime(time.time())
+        self.report_online(online)
+
+    def poll(self):
+        """
+            Applies heartbeats received since the last poll. Rows are read
+            overlap seconds back, heartbeats committed late are not missed
+        """
+        since = self.watermark - timedelta(seconds=self.overlap)
+        online = []
+        for device_type, model in DEVICE_MODELS:
+            timeout = self.timeouts[device_type]
+            rows = model.objects.filter(enabled=True, heartbeat_updated__gt=since)\
+                .values_list('id', 'heartbeat_updated').iterator()
+            for device_id, heartbeat in rows:
+                key = (device_type, device_id)
+                if self.index.beat(key, to_timestamp(heartbeat) + timeout):
+                    online.append(key)
+                self.watermark = max(self.watermark, heartbeat)
+        self.report_online(online)
+
+    def report_online(self, online):
+        if online:
+            self.stats['online'] += len(online)
+            self.on_online(online)
+
+    def check(self, now=None):
+        expired = self.index.expire(now or time.time())
+        if expired:
+            self.stats['offline'] += len(expired)
+            self.on_offline(expired)
+        return expired
+
+    def run(self, duration=None):
+        started = time.time()
+        self.load()
+        next_refresh = started + self.refresh
+        while not self.stopped.is_set():
+            now = time.time()
+            if duration and now - started >= duration:
+                break
+            try:
+                if now >= next_refresh:
+                    # picks up added, removed and disabled devices
+                    self.load()
+                    next_refresh = now + self.refresh
+                else:
+                    self.poll()
+                self.check()
+            except Exception:
+                logger.exception("Heartbeat monitor failed")
+            finally:
+                close_old_connections()
+            wake_up = now + self.poll_interval
+            next_deadline = self.index.next_deadline()
+            if next_deadline is not None:
+                wake_up = min(wake_up, next_deadline)
+            self.stopped.wait(max(0, wake_up - time.time()))
+        return self.stats
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,121 @@
+import StringIO
+import threading
+from collections import OrderedDict
+
+from PIL import Image as PImage, ImageChops
+
+from django.core.cache import cache
+
+from prometrix_cloud_security.utils import is_cache_shared
+from settings import settings
+
+# optional and not in requirements.txt, PIL does the same a bit slower
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def signature(data, size):
+    """
+        Downscaled grayscale of JPEG bytes, draft mode lets the decoder
+        scale down while decoding
+    """
+    im = PImage.open(StringIO.StringIO(data))
+    im.draft('L', size)
+    im = im.convert('L').resize(size, PImage.BILINEAR)
+    return numpy.asarray(im, dtype=numpy.int16) if numpy is not None else im
+
+
+def changed_fraction(previous, current, pixel_threshold):
+    """
+        Share of pixels differing by more than pixel_threshold,
+        PIL does the same without numpy (a bit slower)
+    """
+    if numpy is not None:
+        return numpy.count_nonzero(numpy.abs(current - previous) > pixel_threshold) / float(current.size)
+    histogram = ImageChops.difference(previous, current).histogram()
+    return sum(histogram[pixel_threshold + 1:]) / float(current.size[0] * current.size[1])
+
+
+class MotionFilter(object):
+    """
+        Tells if a frame differs from the last stored frame of its camera.
+        Signatures of the last stored frames are kept for the most recently
+        seen cameras only; frames of a camera not remembered are stored.
+        Saved / skipped frames of every camera are counted in django cache
+        when it is shared, the web process reads what the recorder counted
+    """
+    SAVED = 'saved'
+    SKIPPED = 'skipped'
+    DROP = 'drop'
+    THUMBNAIL = 'thumbnail'
+    PREFIX = 'motion:'
+
+    def __init__(self, threshold=None, pixel_threshold=None, size=None, cameras=None, action=None):
+        self.threshold = settings.MOTION_FILTER_THRESHOLD if threshold is None else threshold
+        self.pixel_threshold = settings.MOTION_FILTER_PIXEL_THRESHOLD if pixel_threshold is None else pixel_threshold
+        self.size = tuple(size or settings.MOTION_FILTER_SIZE)
+        self.cameras = cameras or settings.MOTION_FILTER_CAMERAS
+        self.action = action or settings.MOTION_FILTER_ACTION
+        self.lock = threading.Lock()
+        self.signatures = OrderedDict()
+
+    def check(self, camera_id, data):
+        """
+            True when the frame is to be stored, it becomes the
+            frame the next ones of the camera are compared with
+        """
+        current = signature(data, self.size)
+        # compared under the lock, a concurrent frame of the camera must see this one
+        with self.lock:
+            previous = self.signatures.pop(camera_id, None)
+            changed = previous is None or \
+                changed_fraction(previous, current, self.pixel_threshold) >= self.threshold
+            self.signatures[camera_id] = current if changed else previous
+            while len(self.signatures) > self.cameras:
+                self.signatures.popitem(last=False)
+        self.count(camera_id, self.SAVED if changed else self.SKIPPED)
+        return changed
+
+    def count(self, camera_id, outcome):
+        if not is_cache_shared():
+            return
+        key = '{prefix}{camera}:{outcome}'.format(prefix=self.PREFIX, camera=camera_id, outcome=outcome)
+        if not cache.add(key, 1, None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # expired meanwhile
+                cache.add(key, 1, None)
+
+    @classmethod
+    def get_stats(cls, camera_id):
+        """
+            {'saved': n, 'skipped': n} frames of camera, None without a shared cache
+        """
+        if not is_cache_shared():
+            return None
+        keys = dict(('{prefix}{camera}:{outcome}'.format(prefix=cls.PREFIX, camera=camera_id, outcome=outcome),
+                     outcome) for outcome in (cls.SAVED, cls.SKIPPED))
+        counts = cache.get_many(keys.keys())
+        return dict((outcome, counts.get(key, 0)) for key, outcome in keys.items())
+
+
+_motion_filter = None
+_motion_filter_lock = threading.Lock()
+
+
+def get_motion_filter():
+    """
+        Returns motion filter shared by the whole process,
+        None when MOTION_FILTER_ENABLED is off
+    """
+    global _motion_filter
+    if not settings.MOTION_FILTER_ENABLED:
+        return None
+    if _motion_filter is None:
+        with _motion_filter_lock:
+            if _motion_filter is None:
+                _motion_filter = MotionFilter()
+    return _motion_filter
@@ -0,0 +1,165 @@
+import heapq
+import logging
+import math
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.db import close_old_connections
+
+from prometrix_cloud_security.models import Camera, CameraImage
+from prometrix_cloud_security.schedule import get_schedule
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CameraSchedule(object):
+    """
+        Camera.save_schedule, either interval in seconds ("1", "0.5", "60")
+        or cron expression ("*/5 * * * *")
+    """
+    # cron expressions which never fire are checked again after a day
+    RETRY = 24 * 60 * 60
+
+    def __init__(self, expression):
+        self.expression = expression
+        try:
+            self.interval = float(expression)
+            self.cron = None
+        except ValueError:
+            self.interval = None
+            self.cron = get_schedule(expression)
+        if self.interval is not None and (math.isnan(self.interval) or math.isinf(self.interval)
+                                          or self.interval <= 0):
+            raise ValueError("interval must be a positive number of seconds")
+
+    def next_run(self, after):
+        if self.interval is not None:
+            return after + self.interval
+        return self.cron.next_fire(after) or after + self.RETRY
+
+    def period(self):
+        return 60 if self.interval is None else self.interval
+
+
+class CameraRecorder(object):
+    """
+        Polls every enabled camera with save_schedule and saves its images.
+        Captures run on a bounded thread pool, one at a time per camera;
+        first runs and intervals are jittered, unreachable cameras back off
+    """
+    def __init__(self, workers=None, jitter=None, max_backoff=None, refresh=None):
+        self.workers = workers or settings.RECORDER_WORKERS
+        self.jitter = settings.RECORDER_JITTER if jitter is None else jitter
+        self.max_backoff = max_backoff or settings.RECORDER_MAX_BACKOFF
+        self.refresh = refresh or settings.RECORDER_REFRESH
+        self.condition = threading.Condition()
+        self.heap = []
+        self.cameras = {}
+        self.schedules = {}
+        self.failures = {}
+        self.stats = dict(saved=0, not_modified=0, failed=0, lag=0.0)
+        self.stopped = False
+        self.pool = None
+
+    def load_cameras(self):
+        now = time.time()
+        cameras = dict((camera.id, camera) for camera in
+                       Camera.objects.filter(enabled=True).exclude(save_schedule=''))
+        with self.condition:
+            for camera_id, camera in cameras.items():
+                schedule = self.schedules.get(camera_id)
+                if schedule and schedule.expression == camera.save_schedule:
+                    continue
+                try:
+                    schedule = CameraSchedule(camera.save_schedule)
+                except Exception as e:
+                    logger.error("Camera (id=%s) has invalid save_schedule: %s", camera_id, e)
+                    continue
+                self.schedules[camera_id] = schedule
+                # spread first captures over one period, avoids thundering herd
+                self.push(schedule.next_run(now - random.uniform(0, schedule.period())), camera_id)
+            for camera_id in set(self.schedules) - set(cameras):
+                del self.schedules[camera_id]
+            self.cameras = cameras
+            self.condition.notify()
+
+    def push(self, due, camera_id):
+        heapq.heappush(self.heap, (due, camera_id, self.schedules[camera_id]))
+
+    def next_due(self, due, schedule, camera_id):
+        now = time.time()
+        failures = self.failures.get(camera_id, 0)
+        if failures:
+            return now + min(self.max_backoff, schedule.period() * 2 ** failures)
+        next_due = schedule.next_run(due)
+        if schedule.interval:
+            next_due += random.uniform(-self.jitter, self.jitter) * schedule.interval
+            # fell behind, do not try to catch up on missed frames
+            next_due = max(next_due, now)
+        return next_due
+
+    def capture(self, camera, due):
+        lag = time.time() - due
+        try:
+            image = CameraImage(camera=camera, site_id=camera.site_id)
+            image.save(conditional=True)
+            result = 'not_modified' if image.not_modified else 'saved'
+        except Exception as e:
+            result = 'failed'
+            logger.warning("Camera (id=%s) capture failed: %s", camera.id, e)
+        finally:
+            close_old_connections()
+        with self.condition:
+            self.stats[result] += 1
+            self.stats['lag'] = max(self.stats['lag'], lag)
+            if result == 'failed':
+                self.failures[camera.id] = self.failures.get(camera.id, 0) + 1
+            else:
+                self.failures.pop(camera.id, None)
+
+    def on_captured(self, camera_id, schedule, due):
+        with self.condition:
+            # camera could be removed or rescheduled meanwhile
+            if self.schedules.get(camera_id) is schedule:
+                self.push(self.next_due(due, schedule, camera_id), camera_id)
+                self.condition.notify()
+
+    def run_capture(self, camera, schedule, due):
+        try:
+            self.capture(camera, due)
+        finally:
+            self.on_captured(camera.id, schedule, due)
+
+    def run(self, duration=None):
+        self.pool = ThreadPool(self.workers)
+        started = time.time()
+        next_refresh = started + self.refresh
+        self.load_cameras()
+        while not self.stopped:
+            now = time.time()
+            if duration and now - started >= duration:
+                break
+            if now >= next_refresh:
+                self.load_cameras()
+                next_refresh = now + self.refresh
+            with self.condition:
+                while self.heap and self.heap[0][0] <= now:
+                    due, camera_id, schedule = heapq.heappop(self.heap)
+                    if self.schedules.get(camera_id) is not schedule:
+                        continue
+                    self.pool.apply_async(self.run_capture, (self.cameras[camera_id], schedule, due))
+                wake_up = min(self.heap[0][0] if self.heap else next_refresh, next_refresh)
+                if duration:
+                    wake_up = min(wake_up, started + duration)
+                self.condition.wait(max(0, wake_up - time.time()))
+        self.pool.close()
+        self.pool.join()
+        return self.stats
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
@@ -0,0 +1,182 @@
+import json
+import time
+import operator
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db.models import Q
+
+from prometrix_cloud_security.models import Site, Camera, AlarmZone, AlarmLog, CameraImage
+from prometrix_cloud_security.utils import chunked, to_datetime, to_timestamp
+from settings import settings
+
+
+class RetentionPolicy(object):
+    """
+        tiers are [age, interval] pairs ordered by age: frames younger than
+        age keep one frame per interval seconds (0 - every frame), frames
+        older than the last tier are removed. With keep_alarm_frames frames
+        taken around alarms of the camera's zones are kept forever, those
+        of archived alarm logs are marked with CameraImage.keep
+    """
+    def __init__(self, tiers, keep_alarm_frames=True):
+        tiers = [(int(age), int(interval)) for age, interval in tiers]
+        if not tiers or tiers != sorted(tiers) or any(interval < 0 for age, interval in tiers):
+            raise ValueError("tiers must be [age, interval] pairs ordered by age")
+        self.tiers = tiers
+        self.keep_alarm_frames = keep_alarm_frames
+
+    @classmethod
+    def parse(cls, image_retention):
+        """
+            Policy of Site.image_retention, IMAGE_RETENTION when empty
+        """
+        policy = json.loads(image_retention) if image_retention else settings.IMAGE_RETENTION
+        return cls(policy['tiers'], policy.get('keep_alarm_frames', True))
+
+    @property
+    def keep_all_age(self):
+        """
+            Frames younger than this are all kept, they are not even read
+        """
+        age = 0
+        for max_age, interval in self.tiers:
+            if interval:
+                break
+            age = max_age
+        return age
+
+    def interval(self, age):
+        """
+            Seconds between kept frames of age, None when they are removed
+        """
+        for max_age, interval in self.tiers:
+            if age < max_age:
+                return interval
+        return None
+
+
+def alarm_times(zone_ids, start, end):
+    """
+        Sorted timestamps of alarms of zones from start to end, widened
+        by IMAGE_RETENTION_ALARM_WINDOW
+    """
+    window = settings.IMAGE_RETENTION_ALARM_WINDOW
+    logged = AlarmLog.objects.filter(alarm_zone_id__in=zone_ids,
+                                     last_alarm__range=(to_datetime(start - window), to_datetime(end + window)))
+    return sorted(to_timestamp(last_alarm) for last_alarm in logged.values_list('last_alarm', flat=True))
+
+
+def mark_alarm_frames(rows):
+    """
+        Marks frames of zone cameras within IMAGE_RETENTION_ALARM_WINDOW
+        of (alarm_zone_id, last_alarm) rows to be kept, before the logs
+        retention reads alarms from go away. One UPDATE per zone and
+        100 rows
+    """
+    window = settings.IMAGE_RETENTION_ALARM_WINDOW
+    zone_cameras = defaultdict(list)
+    for zone_id, camera_id in AlarmZone.cameras.through.objects.filter(
+            alarmzone_id__in=set(zone_id for zone_id, last_alarm in rows)).values_list('alarmzone_id', 'camera_id'):
+        zone_cameras[zone_id].append(camera_id)
+    zone_ranges = defaultdict(list)
+    for zone_id, last_alarm in rows:
+        timestamp = to_timestamp(last_alarm)
+        zone_ranges[zone_id].append(Q(logged__range=(to_datetime(timestamp - window), to_datetime(timestamp + window))))
+    for zone_id, camera_ids in zone_cameras.items():
+        for ranges in chunked(zone_ranges[zone_id], 100):
+            CameraImage.objects.filter(reduce(operator.or_, ranges), camera_id__in=camera_ids, keep=False)\
+                .update(keep=True)
+
+
+def is_alarm_frame(alarms, timestamp):
+    window = settings.IMAGE_RETENTION_ALARM_WINDOW
+    i = bisect_left(alarms, timestamp - window)
+    return i < len(alarms) and alarms[i] <= timestamp + window
+
+
+def measure_files(names):
+    storage = CameraImage._meta.get_field('image_data').storage
+    size = 0
+    for name in names:
+        try:
+            size += storage.size(name)
+        except (OSError, IOError):
+            pass
+    return size
+
+
+class RetentionRun(object):
+    """
+        Applies retention policies of sites to their camera images. Images
+        of every camera are read in batches by (logged, id), only the id,
+        time and file names, so the table is never loaded at once. Rows of a
+        batch are removed with one DELETE, then their files
+    """
+    def __init__(self, now=None, dry_run=False, batch_size=None):
+        self.now = now or time.time()
+        self.dry_run = dry_run
+        self.batch_size = batch_size or settings.IMAGE_RETENTION_BATCH_SIZE
+        self.scanned = 0
+        self.deleted = 0
+        self.files = 0
+        self.bytes = 0
+
+    def run(self, site_ids=None):
+        sites = Site.objects.all() if site_ids is None else Site.objects.filter(id__in=site_ids)
+        for site_id, image_retention in sites.values_list('id', 'image_retention').order_by('id').iterator():
+            self.prune_site(site_id, RetentionPolicy.parse(image_retention))
+        return self
+
+    def prune_site(self, site_id, policy):
+        for camera_id in Camera.objects.filter(site_id=site_id).values_list('id', flat=True).order_by('id'):
+            self.prune_camera(camera_id, policy)
+
+    def prune_camera(self, camera_id, policy):
+        zone_ids = list(AlarmZone.cameras.through.objects.filter(camera_id=camera_id)
+                        .values_list('alarmzone_id', flat=True)) if policy.keep_alarm_frames else []
+        images = CameraImage.objects.filter(camera_id=camera_id,
+                                            logged__lt=to_datetime(self.now - policy.keep_all_age))\
+            .order_by('logged', 'id').values_list('id', 'logged', 'image_data', 'image_data_thumb', 'keep')
+        last_key = None
+        after = None
+        while True:
+            batch = images if after is None else \
+                images.filter(Q(logged__gt=after[1]) | Q(logged=after[1], id__gt=after[0]))
+            rows = list(batch[:self.batch_size])
+            if not rows:
+                return
+            alarms = alarm_times(zone_ids, to_timestamp(rows[0][1]), to_timestamp(rows[-1][1])) if zone_ids else []
+            doomed = []
+            for row in rows:
+                timestamp = to_timestamp(row[1])
+                interval = policy.interval(self.now - timestamp)
+                if interval == 0 or is_alarm_frame(alarms, timestamp) or (policy.keep_alarm_frames and row[4]):
+                    continue
+                key = (interval, timestamp // interval) if interval else None
+                # the first frame of every interval is kept
+                if key is None or key == last_key:
+                    doomed.append(row)
+                else:
+                    last_key = key
+            self.scanned += len(rows)
+            self.remove(doomed)
+            if len(rows) < self.batch_size:
+                return
+            after = rows[-1][:2]
+
+    def remove(self, rows):
+        if not rows:
+            return
+        ids = [row[0] for row in rows]
+        files = [row[2:4] for row in rows]
+        if self.dry_run:
+            names = CameraImage.unreferenced_files(files, exclude_ids=ids)
+            self.bytes += measure_files(names)
+        else:
+            # one DELETE, camera images have no delete signals or relations
+            CameraImage.objects.filter(id__in=ids).delete()
+            names = CameraImage.unreferenced_files(files)
+            self.bytes += CameraImage.delete_files(names)
+        self.deleted += len(rows)
+        self.files += len(names)
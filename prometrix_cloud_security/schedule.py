@@ -0,0 +1,115 @@
+import calendar
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import cronex
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledSchedule(object):
+    """
+        Cron expression parsed once. Computes next fire time jumping over
+        whole days and over hours / minutes not in the expression, only
+        periodic (%) minute and hour fields fall back to scanning minutes
+    """
+    # how far ahead the next fire time is searched
+    LOOKAHEAD_DAYS = 5 * 366
+    LOOKAHEAD_MINUTES = 7 * 24 * 60
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.cron = cronex.CronExpression(str(expression))
+        minutes, hours = self.cron.numerical_tab[:2]
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.static = bool(self.minutes and self.hours) and \
+            not any('%' in field for field in self.cron.string_tab[:2])
+        # (minute, first fire at or after it), no fire falls in between
+        self.cached = None
+        self.lock = threading.Lock()
+
+    def check(self, timestamp):
+        return self.cron.check_trigger(time.gmtime(timestamp)[:5])
+
+    def next_fire(self, after):
+        """
+            Returns timestamp of the first minute after `after` (UTC)
+            the expression fires at, None if there is none in lookahead
+        """
+        minute = (int(after) // 60 + 1) * 60
+        if not self.static:
+            for i in range(self.LOOKAHEAD_MINUTES):
+                if self.check(minute):
+                    return minute
+                minute += 60
+            return None
+
+        start = datetime.utcfromtimestamp(minute)
+        day = start.date()
+        for i in range(self.LOOKAHEAD_DAYS):
+            # minute and hour fields are plain sets, day fields are checked once per day
+            if self.cron.check_trigger((day.year, day.month, day.day, self.hours[0], self.minutes[0])):
+                first_hour, first_minute = (start.hour, start.minute) if i == 0 else (0, 0)
+                for hour in self.hours:
+                    if hour < first_hour:
+                        continue
+                    for m in self.minutes:
+                        if hour == first_hour and m < first_minute:
+                            continue
+                        return calendar.timegm((day.year, day.month, day.day, hour, m, 0))
+            day += timedelta(days=1)
+        return None
+
+    def fires_at(self, timestamp):
+        """
+            True if the expression fires in the minute of timestamp, next fire
+            time is cached, so most calls do not evaluate the expression.
+            Minutes outside of the cached span are evaluated again
+        """
+        minute = int(timestamp) // 60 * 60
+        with self.lock:
+            cached = self.cached
+        if cached and cached[1] is not None and cached[0] <= minute <= cached[1]:
+            return cached[1] == minute
+        next_at = self.next_fire(minute - 60)
+        with self.lock:
+            self.cached = (minute, next_at)
+        return next_at == minute
+
+
+_schedules = {}
+_schedules_lock = threading.Lock()
+MAX_CACHED_SCHEDULES = 10000
+
+
+def get_schedule(expression):
+    """
+        Returns CompiledSchedule cached by expression string
+    """
+    schedule = _schedules.get(expression)
+    if schedule is None:
+        schedule = CompiledSchedule(expression)
+        with _schedules_lock:
+            if len(_schedules) >= MAX_CACHED_SCHEDULES:
+                _schedules.clear()
+            _schedules[expression] = schedule
+    return schedule
+
+
+def split_firing(expressions, now):
+    """
+        Splits expressions into (firing in the minute of now, not firing),
+        invalid expressions are left out of both
+    """
+    firing, idle = [], []
+    for expression in expressions:
+        try:
+            fires = get_schedule(expression).fires_at(now)
+        except Exception:
+            logger.exception("Invalid schedule %r", expression)
+            continue
+        (firing if fires else idle).append(expression)
+    return firing, idle
@@ -171,6 +171,116 @@ CORS_ORIGIN_WHITELIST = (
     'localhost:3001'
 )
 
+# Action URLs requested on alarm zone activation / deactivation
+ACTION_DISPATCH_WORKERS = 20
+ACTION_DISPATCH_TIMEOUT = 5  # seconds, can be overridden per action
+ACTION_DISPATCH_POOL_MAXSIZE = 10  # keep-alive connections per host and worker
+ACTION_DISPATCH_WAIT = 30  # seconds a request waits for its actions at most
+
+# Background jobs (async alarm activation), run in-process
+JOB_QUEUE_WORKERS = 4
+JOB_QUEUE_SYNC = False  # run jobs inline, useful for tests
+JOB_QUEUE_STALE_AFTER = 600  # seconds, older queued / running jobs are failed when a queue starts
+
+# Camera snapshots taken on alarm zone activation
+CAMERA_CAPTURE_WORKERS = 20
+CAMERA_CAPTURE_TIMEOUT = 5  # seconds per camera
+CAMERA_CAPTURE_ZONE_DEADLINE = 10  # seconds for all cameras of a zone
+CAMERA_FETCH_MAX_SIZE = 10 * 1024 * 1024  # bytes, larger images are rejected
+CAMERA_FETCH_POOL_MAXSIZE = 4  # keep-alive connections per camera host
+CAMERA_THUMBNAIL_SIZES = [(150, 150)]  # first one goes to CameraImage.image_data_thumb
+CAMERA_THUMBNAIL_QUALITY = 75
+THUMBNAIL_POOL_PROCESSES = None  # defaults to number of CPUs
+THUMBNAIL_POOL_SYNC = False  # make thumbnails inline, useful for tests
+
+# Scheduled camera recording (manage.py record_cameras)
+RECORDER_WORKERS = 50  # concurrent captures
+RECORDER_JITTER = 0.1  # +- fraction of camera interval
+RECORDER_MAX_BACKOFF = 300  # seconds between retries of unreachable camera
+RECORDER_REFRESH = 60  # seconds between reloads of camera list
+
+# Device heartbeat / telemetry ingestion
+DEVICE_KEY_CACHE_TIMEOUT = 60  # seconds
+INGEST_CHUNK_SIZE = 200  # devices per UPDATE statement
+
+# Telemetry history
+TELEMETRY_FLUSH_INTERVAL = 10  # seconds readings are buffered before written, 0 writes inline
+TELEMETRY_BUFFER_MAX = 5000  # readings waiting which trigger early flush
+TELEMETRY_RAW_SPAN = 3600  # longest range in seconds answered with raw readings
+TELEMETRY_MAX_POINTS = 1500  # rollup resolution is chosen to stay under this
+
+# Offline device detection (manage.py monitor_heartbeats)
+HEARTBEAT_TIMEOUTS = dict(sensors=120, lights=120, cameras=300)  # seconds without heartbeat before offline
+HEARTBEAT_MONITOR_POLL_INTERVAL = 0.5  # seconds between polls of new heartbeats
+HEARTBEAT_MONITOR_OVERLAP = 2  # seconds polls look back for heartbeats committed late
+HEARTBEAT_MONITOR_REFRESH = 300  # seconds between full reloads of devices
+
+# Alarm trigger gating
+ALARM_ZONE_DEBOUNCE = 5  # seconds repeated activations of a zone are coalesced, sensors also wait Sensor.timeout
+ALARM_GATE_SHARED = False  # share blocks between processes through django cache, needs memcached / redis
+
+# List endpoints
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000  # largest ?page_size= allowed
+API_STREAM_BATCH_SIZE = 500  # rows per query of ?stream= responses
+SITE_MEMBERSHIP_CACHE_TIMEOUT = 0  # seconds site ids of user are cached, 0 - off; used with memcached / redis only
+API_RESPONSE_CACHE_TIMEOUT = 0  # seconds site detail responses are cached per user and site version, 0 - off
+
+# Alarm statistics and alarm log archival (aggregate_alarm_logs, archive_alarm_logs commands)
+ALARM_STATS_MAX_POINTS = 1500  # buckets of one object per statistics request
+ALARM_LOG_ARCHIVE_AFTER = 365  # days alarm logs stay in the database
+ALARM_LOG_ARCHIVE_DIR = os.path.join(PROJECT_ROOT, 'archive')  # monthly gzipped files, not served
+ALARM_LOG_ARCHIVE_BATCH_SIZE = 1000
+
+# Alarm clips (record_clips command), frames of zone cameras before and after activation
+ALARM_CLIPS_ENABLED = False  # activations request clips, record_clips has to run
+CLIP_FRAME_INTERVAL = 1  # seconds between frames of a camera
+CLIP_PRE_SECONDS = 10  # seconds of frames before the event
+CLIP_POST_FRAMES = 10  # frames after the event
+CLIP_POST_TIMEOUT = 30  # seconds post frames are waited for, the clip is written with what it has
+CLIP_RING_FRAMES = 15  # frames buffered per camera
+CLIP_RING_BYTES = 4 * 1024 * 1024  # bytes buffered per camera
+CLIP_WORKERS = 20  # concurrent frame fetches
+CLIP_POLL_INTERVAL = 0.5  # seconds between checks for new clips
+CLIP_REFRESH = 60  # seconds between reloads of alarm zone cameras
+CLIP_RETENTION = 30  # days clips and their files are kept, 0 - forever; their alarm logs are archived after
+CLIP_PRUNE_INTERVAL = 3600  # seconds between removals of clips past CLIP_RETENTION
+CLIP_PRUNE_BATCH_SIZE = 100
+
+# Motion filter, frames hardly differing from the last stored frame of the camera are not stored
+MOTION_FILTER_ENABLED = False
+MOTION_FILTER_ACTION = 'drop'  # 'drop' - frame is not stored, 'thumbnail' - only its thumbnails are
+MOTION_FILTER_THRESHOLD = 0.01  # share of changed pixels a frame needs to be stored
+MOTION_FILTER_PIXEL_THRESHOLD = 25  # grayscale difference (0-255) of a changed pixel
+MOTION_FILTER_SIZE = (64, 48)  # frames are compared downscaled to this
+MOTION_FILTER_CAMERAS = 1000  # cameras whose last stored frame is remembered
+# saved / skipped frames are counted only with a shared cache (memcached / redis); numpy is optional
+
+# Camera image retention (prune_images command), sites override it with Site.image_retention
+IMAGE_RETENTION = dict(tiers=[[86400, 0], [30 * 86400, 60]],  # every frame for a day, one a minute for 30 days
+                       keep_alarm_frames=True)  # frames around alarms are never removed
+IMAGE_RETENTION_ALARM_WINDOW = 60  # seconds around an alarm of the camera's zones
+IMAGE_RETENTION_BATCH_SIZE = 500
+
+# Camera images under MEDIA_URL cam/pictures/
+MEDIA_SERVE_BACKEND = 'file'  # 'file' - sent by the app server, 'x-sendfile' (Apache, lighttpd), 'x-accel-redirect' (nginx)
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'  # nginx internal location with alias to MEDIA_ROOT
+MEDIA_CACHE_MAX_AGE = 31536000  # seconds browsers keep images, they never change once written
+
+# Site events (Server-Sent Events)
+EVENT_HUB_BACKEND = 'prometrix_cloud_security.events.DatabaseEventHub'  # shared by processes, events.EventHub - one process only
+EVENTS_QUEUE_SIZE = 1000  # events waiting per client before it is reset
+EVENTS_HISTORY = 100  # last events per site replayed after Last-Event-ID, EventHub only
+EVENTS_POLL_INTERVAL = 1  # seconds between polls of SiteEvent, DatabaseEventHub only
+EVENTS_POLL_LIMIT = 1000  # events read per poll
+EVENTS_POLL_WINDOW = 200  # ids below the last one read again, their transactions may commit late
+EVENTS_FRAME_INTERVAL = 10  # seconds between camera_image events of a camera, frames in between are not announced
+EVENTS_RETENTION = 3600  # seconds SiteEvent rows are kept for reconnecting clients
+EVENTS_MAX_STREAMS = 20  # open streams per process, each holds a worker thread; more are answered 503
+EVENTS_KEEPALIVE = 15  # seconds between keepalive comments
+EVENTS_STREAM_MAX_AGE = 300  # seconds a stream stays open before the client reconnects
+EVENTS_RETRY = 3  # seconds clients wait before reconnecting
+
 try:
     from production import *
 except ImportError as e:
@@ -0,0 +1,88 @@
+import os
+import re
+import errno
+import hashlib
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# names already addressed by content: <hash>.jpg and thumbnails derived from them (utils.gen_thumb_name)
+ADDRESSED_RE = re.compile(r'^(\d+x\d+_)?[0-9a-f]{40}\.\w+$')
+
+
+def makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+        Stores files under the directory given by upload_to, named by sha1
+        of their content and sharded by its first two hex digits:
+        cam/pictures/1/<name>.jpg -> cam/pictures/1/ab/ab12...ef.jpg
+        A frame equal to a stored one is not written again, the file is
+        shared by every row with that frame and left untouched;
+        CameraImage.unreferenced_files tells when it is no longer used.
+        Directories are made only when a write finds them missing
+    """
+    def get_available_name(self, name, max_length=None):
+        # equal names have equal content, there is nothing to avoid
+        return name
+
+    def get_addressed_name(self, name, digest):
+        directory, basename = os.path.split(name)
+        extension = os.path.splitext(basename)[1]
+        return '{directory}/{shard}/{digest}{extension}'.format(directory=directory, shard=digest[:2],
+                                                                digest=digest, extension=extension)
+
+    def _save(self, name, content):
+        temp_path, digest = self.write_temp(os.path.dirname(self.path(name)), content)
+        try:
+            if not ADDRESSED_RE.match(os.path.basename(name)):
+                name = self.get_addressed_name(name, digest)
+            path = self.path(name)
+            if os.path.exists(path):
+                return name
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            try:
+                os.rename(temp_path, path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                makedirs(os.path.dirname(path))
+                os.rename(temp_path, path)
+            temp_path = None
+            return name
+        finally:
+            if temp_path is not None:
+                os.unlink(temp_path)
+
+    def write_temp(self, directory, content):
+        """
+            Streams content into a temporary file of directory while hashing
+            it, returns (temporary path, sha1 hex digest). The file is renamed
+            to its name once known, so a half written file is never seen under
+            the name other rows share
+        """
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            makedirs(directory)
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        digest = hashlib.sha1()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        return temp_path, digest.hexdigest()
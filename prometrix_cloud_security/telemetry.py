@@ -0,0 +1,285 @@
+import sys
+import time
+import array
+import atexit
+import threading
+from collections import defaultdict
+
+from django.db import connection, transaction, IntegrityError
+
+from prometrix_cloud_security.jobs import get_job_queue
+from prometrix_cloud_security.models import Sensor, Light, TelemetryChunk, TelemetryRollup
+from prometrix_cloud_security.utils import chunked, to_datetime, to_timestamp
+from settings import settings
+
+METRICS = ('temperature', 'ambient_light', 'digital_inputs')
+DEVICE_MODELS = (('sensors', Sensor), ('lights', Light))
+RESOLUTIONS = (60, 3600, 86400)
+RAW = 0
+CHUNK_SPAN = 3600
+
+
+def pack(numbers):
+    data = array.array('f', numbers)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tostring()
+
+
+def to_bytes(data):
+    """
+        BinaryField value comes back as buffer or memoryview depending on backend
+    """
+    return data.tobytes() if isinstance(data, memoryview) else bytes(data)
+
+
+def unpack(data):
+    numbers = array.array('f')
+    numbers.fromstring(to_bytes(data))
+    if sys.byteorder == 'big':
+        numbers.byteswap()
+    return numbers
+
+
+def resolve_devices(items):
+    """
+        {(site_id, mac_address): [(device_type, device_id), ...]}
+        for all devices of readings, one query per site and device model
+    """
+    macs = defaultdict(set)
+    for site_id, timestamp, reading in items:
+        macs[site_id].add(reading['mac_address'])
+    devices = defaultdict(list)
+    for site_id, site_macs in macs.items():
+        for device_type, model in DEVICE_MODELS:
+            for mac_chunk in chunked(site_macs, 500):
+                for mac_address, device_id in model.objects.filter(site_id=site_id, mac_address__in=mac_chunk)\
+                        .values_list('mac_address', 'id'):
+                    devices[(site_id, mac_address)].append((device_type, device_id))
+    return devices
+
+
+def executemany(model, sets, rows):
+    """
+        UPDATE of many rows by id with different values in one call
+    """
+    qn = connection.ops.quote_name
+    sql = 'UPDATE {table} SET {sets} WHERE {pk} = %s'.format(table=qn(model._meta.db_table), sets=sets,
+                                                             pk=qn(model._meta.pk.column))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def append_chunks(samples):
+    groups = defaultdict(list)
+    for key, points in samples.items():
+        for timestamp, value in points:
+            start = int(timestamp) // CHUNK_SPAN * CHUNK_SPAN
+            groups[key + (start,)].append((timestamp - start, value))
+
+    qn = connection.ops.quote_name
+    binary = TelemetryChunk._meta.get_field('values')
+    for keys in chunked(groups, 500):
+        existing = dict(((c.device_type, c.device_id, c.metric, to_timestamp(c.start)), c) for c in
+                        TelemetryChunk.objects.select_for_update()
+                        .filter(device_id__in=set(key[2] for key in keys),
+                                start__in=set(to_datetime(key[4]) for key in keys)))
+        updates, created = [], []
+        for key in keys:
+            site_id, device_type, device_id, metric, start = key
+            offsets = pack(offset for offset, value in groups[key])
+            values = pack(value for offset, value in groups[key])
+            chunk = existing.get((device_type, device_id, metric, start))
+            if chunk:
+                updates.append((binary.get_db_prep_value(to_bytes(chunk.offsets) + offsets, connection),
+                                binary.get_db_prep_value(to_bytes(chunk.values) + values, connection),
+                                chunk.count + len(groups[key]), chunk.id))
+            else:
+                created.append(TelemetryChunk(site_id=site_id, device_type=device_type, device_id=device_id,
+                                              metric=metric, start=to_datetime(start),
+                                              day=to_datetime(start).date(), count=len(groups[key]),
+                                              offsets=offsets, values=values))
+        if updates:
+            executemany(TelemetryChunk, '{offsets} = %s, {values} = %s, {count} = %s'.format(
+                offsets=qn('offsets'), values=qn('values'), count=qn('count')), updates)
+        TelemetryChunk.objects.bulk_create(created)
+
+
+def update_rollups(samples):
+    aggregates = {}
+    for key, points in samples.items():
+        for timestamp, value in points:
+            for resolution in RESOLUTIONS:
+                rollup_key = key + (resolution, int(timestamp) // resolution * resolution)
+                aggregate = aggregates.get(rollup_key)
+                if aggregate is None:
+                    aggregates[rollup_key] = [1, value, value, value]
+                else:
+                    aggregate[0] += 1
+                    aggregate[1] += value
+                    aggregate[2] = min(aggregate[2], value)
+                    aggregate[3] = max(aggregate[3], value)
+
+    qn = connection.ops.quote_name
+    sets = '{count} = {count} + %s, {total} = {total} + %s, ' \
+           '{minimum} = CASE WHEN {minimum} < %s THEN {minimum} ELSE %s END, ' \
+           '{maximum} = CASE WHEN {maximum} > %s THEN {maximum} ELSE %s END'.format(
+               count=qn('count'), total=qn('total'), minimum=qn('minimum'), maximum=qn('maximum'))
+    for keys in chunked(aggregates, 500):
+        existing = dict(((device_type, device_id, metric, resolution, to_timestamp(start)), rollup_id)
+                        for rollup_id, device_type, device_id, metric, resolution, start in
+                        TelemetryRollup.objects.filter(device_id__in=set(key[2] for key in keys),
+                                                       start__in=set(to_datetime(key[5]) for key in keys))
+                        .values_list('id', 'device_type', 'device_id', 'metric', 'resolution', 'start'))
+        updates, created = [], []
+        for key in keys:
+            count, total, minimum, maximum = aggregates[key]
+            rollup_id = existing.get(key[1:])
+            if rollup_id:
+                updates.append((count, total, minimum, minimum, maximum, maximum, rollup_id))
+            else:
+                created.append(TelemetryRollup(site_id=key[0], device_type=key[1], device_id=key[2], metric=key[3],
+                                               resolution=key[4], start=to_datetime(key[5]), count=count,
+                                               total=total, minimum=minimum, maximum=maximum))
+        if updates:
+            executemany(TelemetryRollup, sets, updates)
+        TelemetryRollup.objects.bulk_create(created)
+
+
+# chunks are read, appended to and written back; select_for_update orders
+# writes of processes where rows are locked, not on SQLite
+_write_lock = threading.Lock()
+
+
+def write_telemetry(items):
+    """
+        Stores readings [(site_id, timestamp, reading)], reading is a dict with
+        mac_address and metrics; appends them to hour chunks and updates
+        minute / hour / day rollups, with a few statements per 500 keys.
+        Writes of one process are serialized
+    """
+    devices = resolve_devices(items)
+    samples = defaultdict(list)
+    for site_id, timestamp, reading in items:
+        for device_type, device_id in devices.get((site_id, reading['mac_address']), ()):
+            for metric in METRICS:
+                value = reading.get(metric)
+                if value is not None:
+                    samples[(site_id, device_type, device_id, metric)].append((timestamp, float(value)))
+    if not samples:
+        return
+    with _write_lock:
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    append_chunks(samples)
+                    update_rollups(samples)
+                return
+            except IntegrityError:
+                # another process created the same chunk or rollup, they exist now
+                if attempt:
+                    raise
+
+
+def choose_resolution(span):
+    """
+        Raw readings for short ranges, otherwise the finest
+        rollup giving at most TELEMETRY_MAX_POINTS points
+    """
+    if span <= settings.TELEMETRY_RAW_SPAN:
+        return RAW
+    for resolution in RESOLUTIONS:
+        if float(span) / resolution <= settings.TELEMETRY_MAX_POINTS:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def query_telemetry(device_type, device_id, metric, start, end, resolution=None):
+    """
+        Readings of device metric between start and end timestamps,
+        returns (resolution, points)
+    """
+    if resolution is None:
+        resolution = choose_resolution(end - start)
+    if resolution == RAW:
+        points = []
+        for chunk in TelemetryChunk.objects.filter(device_type=device_type, device_id=device_id, metric=metric,
+                                                   start__gte=to_datetime(start // CHUNK_SPAN * CHUNK_SPAN),
+                                                   start__lt=to_datetime(end)).order_by('start'):
+            chunk_start = to_timestamp(chunk.start)
+            readings = sorted(zip(unpack(chunk.offsets), unpack(chunk.values)))
+            points.extend(dict(time=round(chunk_start + offset, 3), value=value)
+                          for offset, value in readings if start <= chunk_start + offset < end)
+        return resolution, points
+
+    rollups = TelemetryRollup.objects.filter(device_type=device_type, device_id=device_id, metric=metric,
+                                             resolution=resolution,
+                                             start__gte=to_datetime(start // resolution * resolution),
+                                             start__lt=to_datetime(end)).order_by('start')\
+        .values_list('start', 'count', 'total', 'minimum', 'maximum')
+    return resolution, [dict(time=to_timestamp(rollup_start), count=count, avg=total / count, min=minimum, max=maximum)
+                        for rollup_start, count, total, minimum, maximum in rollups]
+
+
+class TelemetryBuffer(object):
+    """
+        Collects readings of heartbeats and writes them every
+        TELEMETRY_FLUSH_INTERVAL seconds (or when TELEMETRY_BUFFER_MAX
+        readings are waiting) through the job queue. Readings still
+        waiting when the process exits are written on the way out
+    """
+    def __init__(self, flush_interval=None, max_readings=None):
+        self.flush_interval = settings.TELEMETRY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_readings = max_readings or settings.TELEMETRY_BUFFER_MAX
+        self.lock = threading.Lock()
+        self.items = []
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='telemetry-buffer')
+                self.thread.daemon = True
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            get_job_queue().enqueue(self.flush)
+
+    def add(self, site_id, readings, now):
+        timestamp = to_timestamp(now)
+        items = [(site_id, timestamp, reading) for reading in readings
+                 if any(reading.get(metric) is not None for metric in METRICS)]
+        if not self.flush_interval:
+            write_telemetry(items)
+            return
+        self.start()
+        with self.lock:
+            self.items.extend(items)
+            full = len(self.items) >= self.max_readings
+        if full:
+            get_job_queue().enqueue(self.flush)
+
+    def flush(self):
+        with self.lock:
+            items, self.items = self.items, []
+        if items:
+            write_telemetry(items)
+
+
+_telemetry_buffer = None
+_telemetry_buffer_lock = threading.Lock()
+
+
+def get_telemetry_buffer():
+    """
+        Returns telemetry buffer shared by the whole process
+    """
+    global _telemetry_buffer
+    if _telemetry_buffer is None:
+        with _telemetry_buffer_lock:
+            if _telemetry_buffer is None:
+                _telemetry_buffer = TelemetryBuffer()
+    return _telemetry_buffer
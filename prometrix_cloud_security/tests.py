@@ -0,0 +1,1039 @@
+"""
+Tests of the engines behind the API, run with
+
+    python manage.py test prometrix_cloud_security
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import StringIO
+import tempfile
+import threading
+from datetime import timedelta
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from PIL import Image as PImage
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from prometrix_cloud_security import models
+from prometrix_cloud_security.archive import AlarmLogArchiver, read_archive
+from prometrix_cloud_security.capture import SnapshotCapture
+from prometrix_cloud_security.clips import ClipRecorder, FrameRing, Recording
+from prometrix_cloud_security.dispatch import ActionDispatcher
+from prometrix_cloud_security.events import EventHub, DatabaseEventHub, is_frame_due
+from prometrix_cloud_security.fetch import CameraFetcher, CameraFetchError, ImageTooLarge
+from prometrix_cloud_security.gate import TriggerGate
+from prometrix_cloud_security.jobs import JobQueue, get_job_queue
+from prometrix_cloud_security.models import Site, Sensor, Camera, AlarmZone, CameraImage, AlarmLog, Light, SiteEvent, \
+    AlarmClip, AlarmStat, AlarmJob, TelemetryChunk
+from prometrix_cloud_security.monitor import HeartbeatMonitor
+from prometrix_cloud_security.motion import MotionFilter
+from prometrix_cloud_security.recorder import CameraRecorder, CameraSchedule
+from prometrix_cloud_security.retention import RetentionRun, RetentionPolicy
+from prometrix_cloud_security.schedule import CompiledSchedule, split_firing
+from prometrix_cloud_security.settings import settings
+from prometrix_cloud_security.storage import ContentAddressedStorage
+from prometrix_cloud_security.telemetry import RAW, get_telemetry_buffer, write_telemetry, query_telemetry, \
+    choose_resolution
+from prometrix_cloud_security.thumbnails import ThumbnailPool, make_thumbnails
+from prometrix_cloud_security.utils import to_datetime, to_timestamp, is_cache_shared
+
+ENDPOINTS = (
+    'sites/',
+    'sites/{site}/',
+    'sites/{site}/sensors/',
+    'sites/{site}/cameras/',
+    'sites/{site}/alarm_zones/',
+    'sites/{site}/alarm_logs/',
+    'sites/{site}/lights/',
+    'sites/{site}/cameras/{camera}/images/',
+    'sites/{site}/sensors/{sensor}/',
+    'sites/{site}/alarm_zones/{zone}/',
+    'sites/{site}/last-saved-image/',
+    'sites/{site}/alarm_stats/?scope=sensors&resolution=3600',
+)
+SMALL = 3
+LARGE = 30
+
+
+def fill(count):
+    """
+        count sites shared by count users, the last one
+        with count objects of every kind, all related to each other
+    """
+    now = timezone.now()
+    users = [User.objects.create_user('user{0}_{1}'.format(count, i)) for i in range(count)]
+    for i in range(count):
+        site = Site.objects.create()
+        site.users.add(*users)
+    cameras = [Camera.objects.create(heartbeat_updated=now, site=site) for i in range(count)]
+    zones = [AlarmZone.objects.create(last_alarm=now, priority=1, site=site) for i in range(count)]
+    for zone in zones:
+        zone.cameras.add(*cameras)
+    sensors = [Sensor.objects.create(heartbeat_updated=now, mac_address=str(i), public_ip='', last_alarm=now,
+                                     alarm_enable=False, timeout=0, site=site) for i in range(count)]
+    for sensor in sensors:
+        sensor.alarm_zones.add(*zones)
+    Light.objects.bulk_create([Light(heartbeat_updated=now, mac_address=str(i), public_ip='', alarm_zone=zones[0],
+                                     status=False, light_intensity=0, site=site) for i in range(count)])
+    AlarmLog.objects.bulk_create([AlarmLog(last_alarm=now, alarm_text='', site=site, sensor=sensors[0],
+                                           alarm_zone=zones[0]) for i in range(count)])
+    CameraImage.objects.bulk_create([CameraImage(camera=cameras[0], site=site) for i in range(count)])
+    return users[0], dict(site=site.id, camera=cameras[0].id, sensor=sensors[0].id, zone=zones[0].id)
+
+
+class QueryCountTest(TestCase):
+    """
+        Fills sites with SMALL and then LARGE objects of every kind and requests
+        every endpoint; the number of SQL queries has to be the same for both
+        sizes, a failure means an N+1 query came back
+    """
+
+    def get(self, user, endpoint, ids):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/v1/' + endpoint.format(**ids))
+        self.assertEqual(response.status_code, 200, endpoint)
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        small_user, small_ids = fill(SMALL)
+        counts = {}
+        for endpoint in ENDPOINTS:
+            with CaptureQueriesContext(connection) as queries:
+                self.get(small_user, endpoint, small_ids)
+            counts[endpoint] = len(queries.captured_queries)
+
+        large_user, large_ids = fill(LARGE)
+        for endpoint in ENDPOINTS:
+            with self.assertNumQueries(counts[endpoint]):
+                self.get(large_user, endpoint, large_ids)
+
+
+class SerializeToDictTest(TestCase):
+
+    def test_same_as_django_serializer(self):
+        from django.core.serializers import serialize
+        user, ids = fill(SMALL)
+        for instance in (Site.objects.get(id=ids['site']), Camera.objects.get(id=ids['camera']),
+                         Sensor.objects.get(id=ids['sensor']), AlarmZone.objects.get(id=ids['zone']),
+                         AlarmLog.objects.first(), Light.objects.first()):
+            fields = json.loads(serialize('json', [instance]))[0]['fields']
+            fields['id'] = instance.pk
+            self.assertEqual(json.loads(json.dumps(instance.serialize_to_dict())), fields)
+
+
+class HeartbeatTest(TestCase):
+
+    def setUp(self):
+        # sites of device keys are cached
+        cache.clear()
+        now = timezone.now()
+        self.site = Site.objects.create(device_key='key')
+        self.sensor = Sensor.objects.create(heartbeat_updated=now, mac_address='aa', public_ip='', last_alarm=now,
+                                            alarm_enable=False, timeout=0, site=self.site, temperature=20)
+        self.client = APIClient()
+
+    def tearDown(self):
+        # buffered readings go to the test database, not at exit
+        get_telemetry_buffer().flush()
+
+    def post(self, body):
+        return self.client.post('/api/v1/devices/heartbeats/', body, content_type='application/json',
+                                HTTP_X_DEVICE_KEY='key')
+
+    def test_heartbeat_updates_sensor(self):
+        response = self.post(json.dumps(dict(heartbeats=[dict(mac_address='aa', temperature=21.5)])))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, dict(received=1, updated=1))
+        self.assertEqual(Sensor.objects.get(id=self.sensor.id).temperature, 21.5)
+
+    def test_not_finite_temperature_is_rejected(self):
+        for temperature in ('"nan"', '"inf"', 'NaN', '-Infinity'):
+            response = self.post('{"heartbeats": [{"mac_address": "aa", "temperature": %s}]}' % temperature)
+            self.assertEqual(response.status_code, 400, temperature)
+        self.assertEqual(Sensor.objects.get(id=self.sensor.id).temperature, 20)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.ids = fill(SMALL)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, endpoint, etag=None):
+        kwargs = dict(HTTP_IF_NONE_MATCH=etag) if etag else {}
+        return self.client.get('/api/v1/' + endpoint.format(**self.ids), **kwargs)
+
+    def assertChanged(self, endpoint, change):
+        etag = self.get(endpoint)['ETag']
+        self.assertEqual(self.get(endpoint, etag).status_code, 304, endpoint)
+        change()
+        response = self.get(endpoint, etag)
+        self.assertEqual(response.status_code, 200, endpoint)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_heartbeat_changes_sensor_detail(self):
+        Site.objects.filter(id=self.ids['site']).update(device_key='key')
+        self.assertChanged('sites/{site}/sensors/{sensor}/', lambda: APIClient().post(
+            '/api/v1/devices/heartbeats/', json.dumps(dict(heartbeats=[dict(mac_address='0')])),
+            content_type='application/json', HTTP_X_DEVICE_KEY='key'))
+
+    def test_queryset_delete_changes_site(self):
+        self.assertChanged('sites/{site}/alarm_zones/{zone}/',
+                           lambda: Light.objects.filter(site=self.ids['site']).delete())
+
+    def test_new_image_changes_last_saved_image(self):
+        self.assertChanged('sites/{site}/last-saved-image/', lambda: CameraImage.objects.bulk_create(
+            [CameraImage(camera_id=self.ids['camera'], site_id=self.ids['site'])]))
+
+
+class BulkEnableTest(TestCase):
+
+    def setUp(self):
+        self.user, self.ids = fill(SMALL)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def patch(self, body):
+        return self.client.patch('/api/v1/sites/{site}/sensors/'.format(**self.ids), json.dumps(body),
+                                 content_type='application/json')
+
+    def test_returns_changed_ids(self):
+        sensor_ids = sorted(Sensor.objects.filter(site=self.ids['site']).values_list('id', flat=True))
+        Sensor.objects.filter(id=sensor_ids[0]).update(enabled=False)
+        response = self.patch(dict(enabled=False, ids=sensor_ids))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, dict(Sensor=dict(ids=sensor_ids[1:], enabled=False)))
+        self.assertFalse(Sensor.objects.filter(id__in=sensor_ids, enabled=True).exists())
+        response = self.patch(dict(enabled=True, filter=dict(mac_address='0')))
+        self.assertEqual(response.data, dict(Sensor=dict(ids=[sensor_ids[0]], enabled=True)))
+
+    def test_rejects_bad_requests(self):
+        for body in (dict(enabled='yes', ids=[1]), dict(enabled=True), dict(enabled=True, ids=['1']),
+                     dict(enabled=True, filter=dict(site=1)), dict(enabled=True, filter=dict(timeout='x'))):
+            self.assertEqual(self.patch(body).status_code, 400, body)
+
+
+class AlarmLogArchiverTest(TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.saved_archive_dir, settings.ALARM_LOG_ARCHIVE_DIR = settings.ALARM_LOG_ARCHIVE_DIR, self.archive_dir
+        user, self.ids = fill(SMALL)
+        self.old = timezone.now() - timedelta(days=400)
+
+    def tearDown(self):
+        settings.ALARM_LOG_ARCHIVE_DIR = self.saved_archive_dir
+        shutil.rmtree(self.archive_dir)
+
+    def add_frame(self, logged):
+        # save() downloads the frame, logged is set on insert
+        CameraImage.objects.bulk_create([CameraImage(camera_id=self.ids['camera'], site_id=self.ids['site'])])
+        image_id = CameraImage.objects.order_by('-id').values_list('id', flat=True).first()
+        CameraImage.objects.filter(id=image_id).update(logged=logged)
+        return image_id
+
+    def test_archives_old_logs_and_keeps_their_frames(self):
+        logs = [AlarmLog.objects.create(last_alarm=self.old - timedelta(hours=i), alarm_text='old',
+                                        site_id=self.ids['site'], sensor_id=self.ids['sensor'],
+                                        alarm_zone_id=self.ids['zone']) for i in range(3)]
+        alarm_frame = self.add_frame(logs[1].last_alarm + timedelta(seconds=10))
+        other_frame = self.add_frame(logs[1].last_alarm + timedelta(hours=12))
+
+        archiver = AlarmLogArchiver(batch_size=2).run(timezone.now() - timedelta(days=365))
+        self.assertEqual(archiver.archived, 3)
+        self.assertFalse(AlarmLog.objects.filter(id__in=[log.id for log in logs]).exists())
+        archived = [row for month in archiver.months for row in read_archive(month)]
+        self.assertEqual(sorted(row['id'] for row in archived), sorted(log.id for log in logs))
+
+        RetentionRun().run([self.ids['site']])
+        self.assertEqual(list(CameraImage.objects.filter(id__in=[alarm_frame, other_frame])
+                              .values_list('id', 'keep')), [(alarm_frame, True)])
+
+    def test_batch_written_again_is_read_once(self):
+        log = AlarmLog.objects.create(last_alarm=self.old, alarm_text='old', site_id=self.ids['site'],
+                                      sensor_id=self.ids['sensor'], alarm_zone_id=self.ids['zone'])
+        archiver = AlarmLogArchiver()
+        rows = list(AlarmLog.objects.filter(id=log.id).values())
+        archiver.write(rows)
+        archiver.write(rows)
+        self.assertEqual([row['id'] for row in read_archive(self.old.strftime('%Y-%m'))], [log.id])
+        self.assertEqual([name for name in os.listdir(self.archive_dir) if name.endswith('.tmp')], [])
+
+
+class ContentAddressedStorageTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_equal_content_is_stored_once(self):
+        name = self.storage.save('cam/pictures/1/image.jpg', ContentFile('frame'))
+        self.assertEqual(name, 'cam/pictures/1/{shard}/{digest}.jpg'.format(
+            shard=hashlib.sha1('frame').hexdigest()[:2], digest=hashlib.sha1('frame').hexdigest()))
+        os.utime(self.storage.path(name), (1000000000, 1000000000))
+        self.assertEqual(self.storage.save('cam/pictures/1/image.jpg', ContentFile('frame')), name)
+        # media ETag and Last-Modified come from the file, a frame stored again does not change them
+        self.assertEqual(os.path.getmtime(self.storage.path(name)), 1000000000)
+        self.assertNotEqual(self.storage.save('cam/pictures/1/image.jpg', ContentFile('other')), name)
+        self.assertEqual(sorted(name for root, dirs, files in os.walk(self.location) for name in files
+                                if name.startswith('.tmp')), [])
+
+    def test_delete_removes_file(self):
+        name = self.storage.save('cam/pictures/1/image.jpg', ContentFile('frame'))
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def test_shared_files_are_deleted_with_the_last_row(self):
+        user, ids = fill(SMALL)
+        files = ('cam/pictures/1/ab/ab.jpg', 'cam/pictures/1/ab/thumb.jpg')
+        CameraImage.objects.bulk_create([CameraImage(camera_id=ids['camera'], site_id=ids['site'],
+                                                     image_data=files[0], image_data_thumb=files[1])] * 2)
+        first, second = CameraImage.objects.filter(image_data=files[0]).values_list('id', flat=True)
+        self.assertEqual(CameraImage.unreferenced_files([files], exclude_ids=[first]), [])
+        self.assertEqual(CameraImage.unreferenced_files([files], exclude_ids=[first, second]),
+                         sorted(CameraImage.file_names(*files)))
+
+
+class EventHubTest(TestCase):
+
+    def setUp(self):
+        user, self.ids = fill(SMALL)
+
+    def test_subscriptions_get_events_of_their_site(self):
+        hub = EventHub(queue_size=10, history=10)
+        first = hub.publish(self.ids['site'], 'alarm_log', dict(id=1))
+        subscription = hub.subscribe(self.ids['site'])
+        other = hub.subscribe(self.ids['site'] + 1)
+        second = hub.publish(self.ids['site'], 'alarm_log', dict(id=2))
+        self.assertEqual(subscription.get(0), second)
+        self.assertIsNone(other.get(0))
+        replayed = hub.subscribe(self.ids['site'], last_event_id=first.id - 1)
+        self.assertEqual([replayed.get(0), replayed.get(0)], [first, second])
+        for s in (subscription, other, replayed):
+            s.close()
+        self.assertEqual(hub.count(), 0)
+
+    def test_events_committed_late_are_handed_over_once(self):
+        hub = DatabaseEventHub(queue_size=10, window=10)
+        # polled by the test, not by a thread
+        hub.start = lambda: None
+        subscription = hub.subscribe(self.ids['site'])
+        base = subscription.last_id
+        SiteEvent.objects.create(id=base + 2, site_id=self.ids['site'], kind='a', payload='{}')
+        hub.poll()
+        self.assertEqual(subscription.get(0).id, base + 2)
+        # took its id first, committed after the poll
+        SiteEvent.objects.create(id=base + 1, site_id=self.ids['site'], kind='b', payload='{}')
+        hub.poll()
+        hub.poll()
+        self.assertEqual(subscription.get(0).id, base + 1)
+        self.assertIsNone(subscription.get(0))
+        subscription.close()
+
+    def test_frames_are_announced_once_per_interval(self):
+        now = time.time()
+        self.assertTrue(is_frame_due(-1, now))
+        self.assertFalse(is_frame_due(-1, now + settings.EVENTS_FRAME_INTERVAL / 2.0))
+        self.assertTrue(is_frame_due(-2, now))
+        self.assertTrue(is_frame_due(-1, now + settings.EVENTS_FRAME_INTERVAL))
+
+
+class ClipRecorderTest(TestCase):
+
+    def setUp(self):
+        user, self.ids = fill(SMALL)
+        self.log = AlarmLog.objects.filter(site_id=self.ids['site']).first()
+
+    def add_clip(self, status=AlarmClip.PENDING, age=0):
+        clip = AlarmClip.objects.create(alarm_log=self.log, camera_id=self.ids['camera'], site_id=self.ids['site'],
+                                        status=status)
+        AlarmClip.objects.filter(id=clip.id).update(created=timezone.now() - timedelta(seconds=age))
+        return clip.id
+
+    def status(self, clip_id):
+        return AlarmClip.objects.get(id=clip_id).status
+
+    def test_frame_ring_is_bounded(self):
+        ring = FrameRing(max_frames=3, max_bytes=25)
+        for i in range(5):
+            ring.append(i, 'x' * 10)
+        self.assertEqual([timestamp for timestamp, data in ring.frames], [3, 4])
+        self.assertEqual(ring.between(4, 10), [(4, 'x' * 10)])
+
+    def test_pending_clip_is_claimed_once(self):
+        clip_id = self.add_clip()
+        first, second = ClipRecorder(), ClipRecorder()
+        first.pick_clips()
+        second.pick_clips()
+        self.assertEqual((list(first.recordings), list(second.recordings)), ([clip_id], []))
+        self.assertEqual(self.status(clip_id), AlarmClip.RECORDING)
+
+    def test_only_abandoned_recordings_fail(self):
+        recording = self.add_clip(AlarmClip.RECORDING, age=1)
+        abandoned = self.add_clip(AlarmClip.RECORDING, age=3 * settings.CLIP_POST_TIMEOUT)
+        ClipRecorder().pick_clips()
+        self.assertEqual((self.status(recording), self.status(abandoned)), (AlarmClip.RECORDING, AlarmClip.FAILED))
+
+    def test_failed_clip_is_not_written(self):
+        clip_id = self.add_clip(AlarmClip.FAILED)
+        recorder = ClipRecorder()
+        recorder.write(Recording(clip_id, self.ids['camera'], self.log.id, time.time(), []))
+        self.assertEqual(self.status(clip_id), AlarmClip.FAILED)
+        self.assertEqual(recorder.stats['clips'], 0)
+
+
+def make_jpeg(size=(640, 480)):
+    buf = StringIO.StringIO()
+    PImage.new('RGB', size, (200, 10, 10)).save(buf, 'jpeg')
+    return buf.getvalue()
+
+
+class ThumbnailPoolTest(TestCase):
+
+    def test_thumbnails_of_every_size(self):
+        thumbs = make_thumbnails(make_jpeg())
+        self.assertEqual(sorted(thumbs), sorted(tuple(size) for size in settings.CAMERA_THUMBNAIL_SIZES))
+        for (width, height), thumb in thumbs.items():
+            thumb_width, thumb_height = PImage.open(thumb).size
+            self.assertTrue(thumb_width <= width and thumb_height <= height)
+
+    def test_sync_pool_makes_thumbnails_inline(self):
+        results = []
+        ThumbnailPool(sync=True).submit(make_jpeg(), results.append)
+        self.assertEqual(len(results), 1)
+
+    def test_pool_of_parent_process_is_not_used(self):
+        pool = ThumbnailPool(processes=1, sync=False)
+        self.assertIsNone(pool.pool)
+        inherited = pool.start().pool
+        try:
+            pool.pid = -1
+            self.assertIsNot(pool.start().pool, inherited)
+            pool.pool.terminate()
+        finally:
+            inherited.terminate()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    def handle_error(self, request, client_address):
+        # clients of timed out actions hang up
+        pass
+
+
+class ActionHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(1)
+        self.send_response(404 if self.path.startswith('/missing') else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class ActionDispatcherTest(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ActionHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever).start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.dispatcher = ActionDispatcher(workers=4, timeout=5, max_wait=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_statuses_of_every_url_once(self):
+        actions = [self.url + 'on', ' %son ' % self.url, {'url': self.url + 'missing', 'timeout': 2}]
+        self.assertEqual(self.dispatcher.run(actions), {self.url + 'on': 200, self.url + 'missing': 404})
+
+    def test_slow_urls_time_out_of_wait(self):
+        started = time.time()
+        result = self.dispatcher.run([self.url + 'on', self.url + 'slow'], wait=0.5)
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(result, {self.url + 'on': 200, self.url + 'slow': ActionDispatcher.TIMED_OUT})
+
+    def test_errors_are_returned_as_text(self):
+        result = self.dispatcher.run([{'url': self.url + 'slow', 'timeout': 0.2}, 'no-scheme'])
+        self.assertTrue(result[self.url + 'slow'].startswith('ReadTimeout: '))
+        self.assertTrue(result['no-scheme'].startswith('MissingSchema: '))
+        json.dumps(result)
+
+    def test_callback_receives_batch_result(self):
+        results = []
+        batch = self.dispatcher.submit([self.url + 'on'], callback=results.append)
+        batch.done.wait(5)
+        self.assertEqual(results, [{self.url + 'on': 200}])
+        self.assertEqual(self.dispatcher.submit([]).wait(0), {})
+
+
+class TriggerGateTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_one_claim_per_block(self):
+        gate = TriggerGate(shared=False)
+        self.assertIsNone(gate.blocked_until('zone:1', 100))
+        self.assertTrue(gate.claim('zone:1', 10, 100))
+        self.assertFalse(gate.claim('zone:1', 10, 105))
+        self.assertEqual(gate.blocked_until('zone:1', 105), 110)
+        self.assertEqual(gate.blocked_until('zone:1', 106), 110)
+        self.assertEqual(gate.coalesced['zone:1'], 2)
+        self.assertIsNone(gate.blocked_until('zone:1', 110))
+        self.assertTrue(gate.claim('zone:1', 10, 110))
+        self.assertTrue(gate.claim('zone:2', 10, 110))
+
+    def test_block_keeps_later_expiry(self):
+        gate = TriggerGate(shared=False)
+        gate.block('sensor:1', 120)
+        gate.block('sensor:1', 110)
+        self.assertEqual(gate.blocked_until('sensor:1', 100), 120)
+        self.assertFalse(gate.claim('sensor:1', 10, 100))
+
+    def test_expired_blocks_are_purged(self):
+        gate = TriggerGate(shared=False)
+        gate.MAX_BLOCKS = 2
+        gate.claim('zone:1', 10, 100)
+        gate.claim('zone:2', 10, 100)
+        gate.blocked_until('zone:1', 105)
+        gate.claim('zone:3', 10, 200)
+        self.assertEqual(sorted(gate.blocks), ['zone:3'])
+        self.assertNotIn('zone:1', gate.coalesced)
+
+    def test_shared_blocks_let_one_process_through(self):
+        now = time.time()
+        first, second = TriggerGate(shared=True), TriggerGate(shared=True)
+        self.assertTrue(first.claim('zone:1', 10, now))
+        self.assertFalse(second.claim('zone:1', 10, now))
+        self.assertEqual(second.blocked_until('zone:1', now + 1), now + 10)
+        self.assertEqual(second.blocks, {'zone:1': now + 10})
+
+
+class CompiledScheduleTest(TestCase):
+    EXPRESSIONS = ('*/15 * * * *', '30 9 * * 1-5', '0 0 1 3 *', '5,10 22 * * 0', '* * * * *')
+    # Thursday 2017-02-23 21:59 UTC
+    START = 1487887140
+
+    def scan(self, schedule, after):
+        minute = (after // 60 + 1) * 60
+        while not schedule.check(minute):
+            minute += 60
+        return minute
+
+    def test_next_fire_matches_minute_scan(self):
+        for expression in self.EXPRESSIONS:
+            schedule = CompiledSchedule(expression)
+            self.assertTrue(schedule.static)
+            for after in (self.START, self.START + 61, self.START + 3 * 24 * 3600 + 7):
+                self.assertEqual(schedule.next_fire(after), self.scan(schedule, after), expression)
+
+    def test_fires_at_matches_expression(self):
+        for expression in self.EXPRESSIONS:
+            schedule = CompiledSchedule(expression)
+            for minute in range(self.START, self.START + 2 * 24 * 3600, 60):
+                self.assertEqual(schedule.fires_at(minute + 30), schedule.check(minute), (expression, minute))
+
+    def test_split_firing_leaves_out_invalid(self):
+        # Friday 2017-02-24 09:30 UTC
+        now = 1487928600
+        self.assertEqual(split_firing(['30 9 * * 1-5', '31 9 * * *', 'not cron'], now),
+                         (['30 9 * * 1-5'], ['31 9 * * *']))
+
+
+class TelemetryTest(TestCase):
+    # 2017-02-23 21:00 UTC
+    HOUR = 1487883600
+
+    def setUp(self):
+        now = timezone.now()
+        self.site = Site.objects.create()
+        self.sensor = Sensor.objects.create(heartbeat_updated=now, mac_address='aa', public_ip='', last_alarm=now,
+                                            alarm_enable=False, timeout=0, site=self.site)
+
+    def write(self, *points):
+        write_telemetry([(self.site.id, self.HOUR + offset, dict(mac_address=mac_address, temperature=value))
+                         for offset, mac_address, value in points])
+
+    def test_readings_appended_to_chunks_and_rollups(self):
+        self.write((10, 'aa', 20.5), (70, 'aa', 22.5), (30, 'unknown', 99))
+        # the second write updates chunks and rollups of the first one
+        self.write((20, 'aa', 21.0), (3610, 'aa', 18.0))
+        self.assertEqual(TelemetryChunk.objects.count(), 2)
+
+        resolution, points = query_telemetry('sensors', self.sensor.id, 'temperature',
+                                             self.HOUR, self.HOUR + 3600)
+        self.assertEqual(resolution, RAW)
+        self.assertEqual(points, [dict(time=self.HOUR + 10, value=20.5), dict(time=self.HOUR + 20, value=21.0),
+                                  dict(time=self.HOUR + 70, value=22.5)])
+
+        resolution, points = query_telemetry('sensors', self.sensor.id, 'temperature',
+                                             self.HOUR, self.HOUR + 7200, resolution=60)
+        self.assertEqual(points, [dict(time=self.HOUR, count=2, avg=20.75, min=20.5, max=21.0),
+                                  dict(time=self.HOUR + 60, count=1, avg=22.5, min=22.5, max=22.5),
+                                  dict(time=self.HOUR + 3600, count=1, avg=18.0, min=18.0, max=18.0)])
+
+        resolution, points = query_telemetry('sensors', self.sensor.id, 'temperature',
+                                             self.HOUR - 86400, self.HOUR + 86400)
+        self.assertEqual(resolution, 3600)
+        self.assertEqual([(point['count'], point['min'], point['max']) for point in points],
+                         [(3, 20.5, 22.5), (1, 18.0, 18.0)])
+
+    def test_resolution_keeps_points_under_limit(self):
+        self.assertEqual(choose_resolution(settings.TELEMETRY_RAW_SPAN), RAW)
+        self.assertEqual(choose_resolution(settings.TELEMETRY_RAW_SPAN + 1), 60)
+        self.assertEqual(choose_resolution(60 * settings.TELEMETRY_MAX_POINTS + 60), 3600)
+        self.assertEqual(choose_resolution(10 ** 9), 86400)
+
+
+class RetentionTest(TestCase):
+    # 2017-02-23 21:00 UTC
+    HOUR = 1487883600
+    NOW = HOUR + 5 * 3600
+    POLICY = dict(tiers=[[3600, 0], [7200, 60], [10800, 600]])
+
+    def setUp(self):
+        user, ids = fill(1)
+        self.camera_id = ids['camera']
+        Site.objects.filter(id=ids['site']).update(image_retention=json.dumps(self.POLICY))
+        CameraImage.objects.all().delete()
+        AlarmLog.objects.all().delete()
+        AlarmLog.objects.create(last_alarm=to_datetime(self.HOUR + 6000), alarm_text='', site_id=ids['site'],
+                                sensor_id=ids['sensor'], alarm_zone_id=ids['zone'])
+        # offsets from HOUR: every frame kept for an hour, one a minute for the next and
+        # one every 10 minutes for the third hour, older ones removed unless kept for an alarm
+        self.kept = [17000, 14050, 14000, 9700, 9000, 6030, 5000]
+        self.removed = [14010, 9300, 7000, 4000]
+        CameraImage.objects.bulk_create([CameraImage(camera_id=self.camera_id, site_id=ids['site'])
+                                         for offset in self.kept + self.removed])
+        for image_id, offset in zip(CameraImage.objects.order_by('id').values_list('id', flat=True),
+                                    self.kept + self.removed):
+            CameraImage.objects.filter(id=image_id).update(logged=to_datetime(self.HOUR + offset),
+                                                           keep=offset == 5000)
+
+    def offsets(self):
+        return sorted(to_timestamp(logged) - self.HOUR for logged in
+                      CameraImage.objects.values_list('logged', flat=True))
+
+    def test_frames_thinned_by_age(self):
+        run = RetentionRun(now=self.NOW, batch_size=2).run()
+        self.assertEqual(self.offsets(), sorted(self.kept))
+        self.assertEqual((run.scanned, run.deleted), (10, len(self.removed)))
+
+    def test_dry_run_deletes_nothing(self):
+        run = RetentionRun(now=self.NOW, dry_run=True).run()
+        self.assertEqual(run.deleted, len(self.removed))
+        self.assertEqual(self.offsets(), sorted(self.kept + self.removed))
+
+    def test_alarm_frames_only_kept_by_policy(self):
+        Site.objects.update(image_retention=json.dumps(dict(self.POLICY, keep_alarm_frames=False)))
+        RetentionRun(now=self.NOW).run()
+        self.assertEqual(self.offsets(), [9000, 9700, 14000, 14050, 17000])
+
+    def test_tiers_must_be_ordered(self):
+        self.assertEqual(RetentionPolicy.parse('').tiers, [(86400, 0), (30 * 86400, 60)])
+        with self.assertRaises(ValueError):
+            RetentionPolicy([[7200, 60], [3600, 0]])
+
+
+class CameraMediaTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.media_root = settings.MEDIA_ROOT
+        self.backend = settings.MEDIA_SERVE_BACKEND
+        settings.MEDIA_ROOT = tempfile.mkdtemp()
+        user, ids = fill(1)
+        directory = os.path.join(settings.MEDIA_ROOT, 'cam', 'pictures', str(ids['camera']), 'ab')
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'frame.jpg'), 'wb') as f:
+            f.write('abcdefghij')
+        self.url = '/media/cam/pictures/{camera}/ab/frame.jpg'.format(**ids)
+        self.client.force_authenticate(user)
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+        settings.MEDIA_ROOT = self.media_root
+        settings.MEDIA_SERVE_BACKEND = self.backend
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        content = ''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, content
+
+    def test_whole_file(self):
+        response, content = self.get()
+        self.assertEqual((response.status_code, content), (200, 'abcdefghij'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag'])[0].status_code, 304)
+
+    def test_ranges(self):
+        etag = self.get()[0]['ETag']
+        for header, content, content_range in (('bytes=2-4', 'cde', 'bytes 2-4/10'),
+                                               ('bytes=-3', 'hij', 'bytes 7-9/10'),
+                                               ('bytes=8-', 'ij', 'bytes 8-9/10'),
+                                               ('bytes=8-100', 'ij', 'bytes 8-9/10')):
+            response, body = self.get(HTTP_RANGE=header, HTTP_IF_RANGE=etag)
+            self.assertEqual((response.status_code, body, response['Content-Range']), (206, content, content_range))
+        response, body = self.get(HTTP_RANGE='bytes=10-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+        # the file changed since If-Range, so it is sent whole
+        response, body = self.get(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"other"')
+        self.assertEqual((response.status_code, body), (200, 'abcdefghij'))
+        # several ranges are not supported
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-1,4-5')[0].status_code, 200)
+
+    def test_front_server_sends_file(self):
+        settings.MEDIA_SERVE_BACKEND = 'x-accel-redirect'
+        response, content = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], settings.MEDIA_ACCEL_REDIRECT_PREFIX + self.url[7:])
+        self.assertEqual(content, '')
+
+    def test_only_users_of_site(self):
+        self.client.force_authenticate(User.objects.create_user('other'))
+        self.assertEqual(self.get()[0].status_code, 404)
+
+
+class KeysetPaginationTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.batch_size = settings.API_STREAM_BATCH_SIZE
+        settings.API_STREAM_BATCH_SIZE = 2
+        user, ids = fill(5)
+        self.url = '/api/v1/sites/{site}/alarm_logs/'.format(**ids)
+        # all logs of fill have the same last_alarm, pages tell them apart by id
+        self.ids = sorted(AlarmLog.objects.filter(site_id=ids['site']).values_list('id', flat=True), reverse=True)
+        self.client.force_authenticate(user)
+
+    def tearDown(self):
+        settings.API_STREAM_BATCH_SIZE = self.batch_size
+
+    def test_pages_follow_cursor(self):
+        url, pages = self.url + '?ordering=-last_alarm&page_size=2', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        self.assertEqual(pages, [self.ids[:2], self.ids[2:4], self.ids[4:]])
+        self.assertEqual(self.client.get(self.url + '?ordering=alarm_text').status_code, 400)
+
+    def test_stream_all_rows_in_batches(self):
+        response = self.client.get(self.url + '?stream=ndjson')
+        rows = [json.loads(line) for line in ''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], sorted(self.ids))
+        response = self.client.get(self.url + '?stream=json')
+        self.assertEqual(json.loads(''.join(response.streaming_content)), rows)
+        self.assertEqual(self.client.get(self.url + '?stream=xml').status_code, 400)
+
+
+class CameraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/frame.jpg' and self.headers.get('If-None-Match') == '"1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = dict(frame='frame', large='x' * 100, error='')[self.path[1:].split('.')[0]]
+        self.send_response(500 if self.path.startswith('/error') else 200)
+        self.send_header('ETag', '"1"')
+        if not self.path.endswith('.chunked'):
+            self.send_header('Content-Length', str(len(body)))
+        else:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CameraFetcherTest(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CameraHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever).start()
+        self.fetcher = CameraFetcher(timeout=5, max_size=50)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def camera(self, path):
+        return Camera(id=1, image_url='http://127.0.0.1:%d/%s' % (self.server.server_port, path))
+
+    def test_unchanged_frame_is_not_downloaded_again(self):
+        image_file = self.fetcher.fetch(self.camera('frame.jpg'))
+        self.assertEqual((image_file.content, image_file.size), ('frame', 5))
+        self.assertIsNone(self.fetcher.fetch(self.camera('frame.jpg')))
+        self.assertEqual(self.fetcher.fetch(self.camera('frame.jpg'), conditional=False).content, 'frame')
+        # one keep-alive session per camera host
+        self.assertEqual(len(self.fetcher.sessions), 1)
+
+    def test_large_images_are_rejected(self):
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.fetch(self.camera('large.jpg'))
+        # no Content-Length, the limit is checked while reading
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.fetch(self.camera('large.chunked'))
+
+    def test_error_status_fails(self):
+        with self.assertRaises(CameraFetchError):
+            self.fetcher.fetch(self.camera('error.jpg'))
+
+
+class HeartbeatMonitorTest(TestCase):
+
+    def setUp(self):
+        user, ids = fill(1)
+        self.sensor_id = ids['sensor']
+        self.offline, self.online = [], []
+        self.monitor = HeartbeatMonitor(timeouts=dict(sensors=60, lights=120, cameras=180), overlap=0,
+                                        on_offline=self.offline.extend, on_online=self.online.extend)
+        self.monitor.load()
+        self.now = to_timestamp(Sensor.objects.get(id=self.sensor_id).heartbeat_updated)
+
+    def test_offline_devices_reported_once(self):
+        self.assertEqual(self.monitor.check(self.now + 59), [])
+        self.assertEqual(self.monitor.check(self.now + 150),
+                         [('sensors', self.sensor_id), ('lights', Light.objects.get().id)])
+        self.assertEqual(self.monitor.check(self.now + 150), [])
+        self.monitor.check(self.now + 200)
+        self.assertEqual(sorted(device_type for device_type, device_id in self.offline),
+                         ['cameras', 'lights', 'sensors'])
+        # still offline after the index is rebuilt
+        self.monitor.load()
+        self.assertEqual(self.monitor.check(self.now + 300), [])
+
+    def test_heartbeat_brings_device_back(self):
+        self.monitor.check(self.now + 100)
+        Sensor.objects.filter(id=self.sensor_id).update(heartbeat_updated=to_datetime(self.now + 90))
+        self.monitor.poll()
+        self.assertEqual(self.online, [('sensors', self.sensor_id)])
+        self.assertNotIn(('sensors', self.sensor_id), self.monitor.check(self.now + 149))
+        self.assertIn(('sensors', self.sensor_id), self.monitor.check(self.now + 150))
+
+
+class MotionFilterTest(TestCase):
+
+    def frame(self, box=None):
+        im = PImage.new('L', (640, 480), 100)
+        if box:
+            im.paste(250, box)
+        buf = StringIO.StringIO()
+        im.save(buf, 'jpeg')
+        return buf.getvalue()
+
+    def test_only_changed_frames_stored(self):
+        motion_filter = MotionFilter(threshold=0.05, cameras=1)
+        self.assertTrue(motion_filter.check(1, self.frame()))
+        self.assertFalse(motion_filter.check(1, self.frame()))
+        # a small change stays under the threshold
+        self.assertFalse(motion_filter.check(1, self.frame((0, 0, 10, 10))))
+        self.assertTrue(motion_filter.check(1, self.frame((0, 0, 320, 240))))
+        # compared with the last stored frame, not with the skipped ones
+        self.assertFalse(motion_filter.check(1, self.frame((0, 0, 320, 250))))
+        # only the last camera is remembered
+        self.assertTrue(motion_filter.check(2, self.frame()))
+        self.assertTrue(motion_filter.check(1, self.frame((0, 0, 320, 240))))
+
+
+class SiteMembershipCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.timeout = settings.SITE_MEMBERSHIP_CACHE_TIMEOUT
+        settings.SITE_MEMBERSHIP_CACHE_TIMEOUT = 60
+        # local memory cache stands in for a shared one
+        models.is_cache_shared = lambda: True
+        self.user = User.objects.create_user('member')
+        self.sites = [Site.objects.create() for i in range(2)]
+        self.sites[0].users.add(self.user)
+
+    def tearDown(self):
+        settings.SITE_MEMBERSHIP_CACHE_TIMEOUT = self.timeout
+        models.is_cache_shared = is_cache_shared
+
+    def test_cached_until_membership_changes(self):
+        self.assertEqual(Site.get_user_site_ids(self.user.id), {self.sites[0].id})
+        with self.assertNumQueries(0):
+            Site.get_user_site_ids(self.user.id)
+        self.user.site_set.add(self.sites[1])
+        self.assertEqual(Site.get_user_site_ids(self.user.id), {self.sites[0].id, self.sites[1].id})
+        self.sites[0].users.remove(self.user)
+        self.assertEqual(Site.get_user_site_ids(self.user.id), {self.sites[1].id})
+        self.sites[1].users.clear()
+        self.assertEqual(Site.get_user_site_ids(self.user.id), set())
+
+    def test_forgotten_with_site(self):
+        Site.get_user_site_ids(self.user.id)
+        self.sites[0].delete()
+        self.assertEqual(Site.get_user_site_ids(self.user.id), set())
+
+
+class AlarmStatTest(TestCase):
+    # 2017-02-23 00:00 UTC
+    DAY = 1487808000
+
+    def setUp(self):
+        user, self.ids = fill(1)
+        AlarmLog.objects.all().delete()
+        AlarmStat.objects.all().delete()
+
+    def log(self, offset):
+        return AlarmLog.objects.create(last_alarm=to_datetime(self.DAY + offset), alarm_text='',
+                                       site_id=self.ids['site'], sensor_id=self.ids['sensor'],
+                                       alarm_zone_id=self.ids['zone'])
+
+    def counts(self, scope, resolution):
+        return list(AlarmStat.objects.filter(scope=scope, resolution=resolution).order_by('start')
+                    .values_list('object_id', 'start', 'count'))
+
+    def test_logs_counted_on_insert(self):
+        for offset in (10, 20, 3700):
+            self.log(offset)
+        self.assertEqual(self.counts('sensors', 3600), [(self.ids['sensor'], to_datetime(self.DAY), 2),
+                                                        (self.ids['sensor'], to_datetime(self.DAY + 3600), 1)])
+        self.assertEqual(self.counts('alarm_zones', 86400), [(self.ids['zone'], to_datetime(self.DAY), 3)])
+        self.assertEqual(self.counts('sites', 86400), [(self.ids['site'], to_datetime(self.DAY), 3)])
+
+    def test_rebuild_recounts_day(self):
+        self.log(10)
+        removed = self.log(3700)
+        AlarmLog.objects.filter(id=removed.id).delete()
+        AlarmStat.objects.filter(scope='sites', resolution=86400).update(count=7)
+        self.assertEqual(AlarmStat.rebuild(self.DAY), 1)
+        self.assertEqual(self.counts('sites', 86400), [(self.ids['site'], to_datetime(self.DAY), 1)])
+        # an hour without logs is kept with no alarms
+        self.assertEqual([count for object_id, start, count in self.counts('sensors', 3600)], [1, 0])
+
+
+class CameraRecorderTest(TestCase):
+
+    def test_schedules(self):
+        self.assertEqual(CameraSchedule('0.5').next_run(100), 100.5)
+        # Thursday 2017-02-23 21:59 UTC, next */5 minute is 22:00
+        self.assertEqual(CameraSchedule('*/5 * * * *').next_run(1487887140), 1487887200)
+        for expression in ('0', '-1', 'nan', 'inf'):
+            with self.assertRaises(ValueError):
+                CameraSchedule(expression)
+
+    def test_failed_cameras_back_off(self):
+        recorder = CameraRecorder(jitter=0, max_backoff=30)
+        schedule = CameraSchedule('5')
+        now = time.time()
+        self.assertAlmostEqual(recorder.next_due(now, schedule, 1), now + 5, places=1)
+        # behind schedule, missed frames are not caught up on
+        self.assertAlmostEqual(recorder.next_due(now - 60, schedule, 1), now, places=1)
+        recorder.failures[1] = 1
+        self.assertAlmostEqual(recorder.next_due(now, schedule, 1), now + 10, places=1)
+        recorder.failures[1] = 5
+        self.assertAlmostEqual(recorder.next_due(now, schedule, 1), now + 30, places=1)
+
+    def test_cameras_with_valid_schedules_loaded(self):
+        user, ids = fill(3)
+        cameras = list(Camera.objects.filter(site_id=ids['site']).order_by('id'))
+        for camera, save_schedule in zip(cameras, ('10', 'not cron', '')):
+            Camera.objects.filter(id=camera.id).update(save_schedule=save_schedule)
+        recorder = CameraRecorder()
+        recorder.load_cameras()
+        self.assertEqual(sorted(recorder.schedules), [cameras[0].id])
+        self.assertEqual([camera_id for due, camera_id, schedule in recorder.heap], [cameras[0].id])
+        # schedule removed meanwhile
+        Camera.objects.filter(id=cameras[0].id).update(save_schedule='')
+        recorder.load_cameras()
+        self.assertEqual(recorder.schedules, {})
+
+
+class SnapshotImage(object):
+    """
+        Stands in for CameraImage, save() takes seconds or fails
+    """
+    def __init__(self, camera_id, seconds=0, error=None):
+        self.camera_id = camera_id
+        self.id = camera_id * 10
+        self.seconds = seconds
+        self.error = error
+        self.not_modified = False
+
+    def save(self, timeout=None, conditional=False):
+        time.sleep(self.seconds)
+        if self.error:
+            raise self.error
+
+
+class SnapshotCaptureTest(TestCase):
+
+    def test_cameras_captured_concurrently_until_deadline(self):
+        started = time.time()
+        result = SnapshotCapture(workers=3).capture([SnapshotImage(1, 0.3), SnapshotImage(2, 0.3),
+                                                     SnapshotImage(3, 2), SnapshotImage(4, error=IOError('down'))],
+                                                    deadline=0.6)
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(dict((camera_id, row['status']) for camera_id, row in result.items()),
+                         {1: 'ok', 2: 'ok', 3: 'timeout', 4: 'error'})
+        self.assertEqual((result[1]['image'], result[4]['error']), (10, 'down'))
+
+
+class AlarmJobTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.sync = get_job_queue().sync
+        get_job_queue().sync = True
+        user, self.ids = fill(1)
+        AlarmZone.objects.filter(id=self.ids['zone']).update(enabled=False)
+        self.client.force_authenticate(user)
+
+    def tearDown(self):
+        get_job_queue().sync = self.sync
+
+    def test_deactivation_answered_before_its_job_runs(self):
+        response = self.client.get('/api/v1/sites/{site}/alarm_zones/{zone}/deactivate/?async=1'.format(**self.ids))
+        self.assertEqual(response.status_code, 202)
+        response = self.client.get('/api/v1/sites/{site}/jobs/{job}/'.format(job=response.data['job_id'], **self.ids))
+        self.assertEqual((response.data['kind'], response.data['status']), (AlarmJob.DEACTIVATE, AlarmJob.DONE))
+
+    def test_failed_job_does_not_stop_queue(self):
+        done = []
+        queue = JobQueue(workers=1, sync=False)
+        queue.recover = lambda: None
+        queue.enqueue(lambda: 1 / 0)
+        queue.enqueue(done.append, 1)
+        queue.queue.join()
+        self.assertEqual(done, [1])
+
+    def test_lost_jobs_failed(self):
+        log = AlarmLog.objects.first()
+        job = AlarmJob.objects.create(kind=AlarmJob.ACTIVATE, site_id=self.ids['site'],
+                                      alarm_zone_id=self.ids['zone'], alarm_log=log)
+        self.assertEqual(AlarmJob.fail_stale(60), 0)
+        AlarmJob.objects.filter(id=job.id).update(created=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(AlarmJob.fail_stale(60), 1)
+        self.assertEqual(AlarmJob.objects.get(id=job.id).status, AlarmJob.FAILED)
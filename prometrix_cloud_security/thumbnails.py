@@ -0,0 +1,120 @@
+import os
+import logging
+import StringIO
+import threading
+import traceback
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+from PIL import Image as PImage
+
+from prometrix_cloud_security.jobs import get_job_queue
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def make_thumbnails(data, sizes=None, quality=None):
+    """
+        Decodes JPEG bytes once and returns {size: buffer with encoded thumbnail}.
+        Draft mode lets the JPEG decoder scale down while decoding, so the full
+        resolution image is never built; sizes are produced largest first,
+        each one from the previous
+    """
+    sizes = sizes or settings.CAMERA_THUMBNAIL_SIZES
+    quality = quality or settings.CAMERA_THUMBNAIL_QUALITY
+    im = PImage.open(StringIO.StringIO(data))
+    im.draft('RGB', (max(w for w, h in sizes), max(h for w, h in sizes)))
+    # decode now, thumbnail() would draft an unloaded image once more
+    im.load()
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+
+    result = {}
+    for size in sorted(sizes, key=lambda s: s[0] * s[1], reverse=True):
+        im.thumbnail(size, PImage.ANTIALIAS)
+        temp_handle = StringIO.StringIO()
+        im.save(temp_handle, 'jpeg', quality=quality)
+        temp_handle.seek(0)
+        result[tuple(size)] = temp_handle
+    return result
+
+
+def make_thumbnails_data(data, sizes, quality):
+    """
+        Runs in pool process, returns {size: encoded bytes}
+        or text of the error on failure
+    """
+    try:
+        return dict((size, temp_handle.getvalue())
+                    for size, temp_handle in make_thumbnails(data, sizes, quality).items())
+    except Exception:
+        return traceback.format_exc()
+
+
+class ThumbnailPool(object):
+    """
+        Pool of processes making thumbnails, so decoding and encoding
+        do not hold the GIL of web worker. Results are handed back
+        through the job queue. The pool is started by the first submit
+        of every process: one made before the app server forked its
+        workers belongs to the master and is never used by them.
+        With sync=True work is done inline
+    """
+    def __init__(self, processes=None, sync=None):
+        self.processes = processes or settings.THUMBNAIL_POOL_PROCESSES or cpu_count()
+        self.sync = settings.THUMBNAIL_POOL_SYNC if sync is None else sync
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pid = None
+
+    def start(self):
+        with self.lock:
+            if not self.sync and (self.pool is None or self.pid != os.getpid()):
+                self.pool = Pool(self.processes)
+                self.pid = os.getpid()
+        return self
+
+    @property
+    def inline(self):
+        return self.sync
+
+    def submit(self, data, callback):
+        """
+            callback receives {size: buffer} once thumbnails are ready
+        """
+        if self.inline:
+            callback(make_thumbnails(data))
+            return
+        self.start()
+        self.pool.apply_async(make_thumbnails_data,
+                              (data, settings.CAMERA_THUMBNAIL_SIZES, settings.CAMERA_THUMBNAIL_QUALITY),
+                              callback=partial(self.on_result, data, callback))
+
+    def on_result(self, data, callback, result):
+        # called in pool result thread, keep it free
+        if isinstance(result, basestring):
+            logger.warning("Thumbnail creation failed in pool, making it inline:\n%s", result)
+            get_job_queue().enqueue(self.make_inline, data, callback)
+            return
+        thumbs = dict((size, StringIO.StringIO(data)) for size, data in result.items())
+        get_job_queue().enqueue(callback, thumbs)
+
+    def make_inline(self, data, callback):
+        callback(make_thumbnails(data))
+
+
+_thumbnail_pool = None
+_thumbnail_pool_lock = threading.Lock()
+
+
+def get_thumbnail_pool():
+    """
+        Returns thumbnail pool shared by the whole process
+    """
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        with _thumbnail_pool_lock:
+            if _thumbnail_pool is None:
+                _thumbnail_pool = ThumbnailPool()
+    return _thumbnail_pool
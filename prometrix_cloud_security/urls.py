@@ -19,11 +19,15 @@ from django.contrib.auth.models import User
 from django.conf.urls.static import static
 
 import api
+from api.views import CameraMediaView
 from settings import settings
 
 urlpatterns = [
     url(r'^api/v1/', include('prometrix_cloud_security.api.urls')),
+    # images may be in a shard directory of the camera
+    url(r'^{media}cam/pictures/(?P<camera_id>\d+)/(?P<name>(?:[0-9a-f]{{2}}/)?[^/]+)$'.format(
+        media=settings.MEDIA_URL.lstrip('/')), CameraMediaView.as_view(), name='camera_media'),
     url(r'', include('prometrix_cloud_security.template.urls')),
     url(r'^admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) \
-  + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    # media is never served as static files, camera_media checks access
+] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,11 +1,12 @@
 import os
 import json
+import calendar
 from datetime import datetime
-from threading import Thread
-from Queue import Queue
 
-import requests
-from settings import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
 
 
 def ensure_dir(f):
@@ -14,17 +15,29 @@ def ensure_dir(f):
 
 
 def gen_save_path(instance, filename):
-    path = r'cam/pictures/{cam_id}'.format(cam_id=str(instance.camera.id))
-    ensure_dir(settings.MEDIA_ROOT + "/" + path + "/")
-    dt_now = datetime.now().strftime('%Y-%m-%d_%H%M%S')
-    return '{path}/{fname}.{extension}'.format(path=path, fname=dt_now, extension='jpg')
+    """
+        Directory and extension of camera image, the name itself is a
+        placeholder, ContentAddressedStorage names files by their content
+    """
+    return 'cam/pictures/{cam_id}/image.jpg'.format(cam_id=instance.camera_id)
 
 
 def gen_save_path_thumb(instance, filename):
-    path = r'cam/pictures/{cam_id}'.format(cam_id=str(instance.camera.id))
-    ensure_dir(settings.MEDIA_ROOT + "/" + path + "/")
-    dt_now = datetime.now().strftime('%Y-%m-%d_%H%M%S')
-    return '{path}/{fname}.{extension}'.format(path=path, fname="150x150_"+dt_now, extension='jpg')
+    return 'cam/pictures/{cam_id}/thumb.jpg'.format(cam_id=instance.camera_id)
+
+
+def gen_clip_path(instance, filename):
+    return 'cam/pictures/{cam_id}/clip_{alarm_log_id}.mjpeg'.format(cam_id=instance.camera_id,
+                                                                     alarm_log_id=instance.alarm_log_id)
+
+
+def gen_thumb_name(image_name, size):
+    """
+        Name of additional thumbnail stored next to the image,
+        cam/pictures/1/<name>.jpg -> cam/pictures/1/320x240_<name>.jpg
+    """
+    path, fname = os.path.split(image_name)
+    return '{path}/{width}x{height}_{fname}'.format(path=path, width=size[0], height=size[1], fname=fname)
 
 
 def to_list(str_list):
@@ -34,38 +47,38 @@ def to_list(str_list):
     return json.loads(str_list) if str_list else []
 
 
-class ThreadedQueue(object):
+def to_bool(value):
+    """
+        Converts query string flag '1' / 'true' / 'yes' / 'on' to True, anything else to False
+    """
+    return bool(value) and value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def chunked(items, size):
     """
-        Class for running queues tasks in separated threads
+        Splits list into lists of at most size items
     """
-    def __init__(self, concurrent=None):
-        self.concurrent = concurrent or 200
-        self.queue = Queue(concurrent * 2)
-        self.result = {}
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
-    def do_work(self):
-        while True:
-            url = self.queue.get()
-            status, url = self.get_status(url)
-            self.result.update({url: status})
-            self.queue.task_done()
 
-    def get_status(self, ourl):
-        try:
-            r = requests.get(ourl)
-            return r.status_code, ourl
-        except requests.exceptions.RequestException as e:
-            return e, ourl
+def to_datetime(timestamp):
+    """
+        Unix timestamp to aware UTC datetime
+    """
+    return datetime.utcfromtimestamp(timestamp).replace(tzinfo=timezone.utc)
 
-    def run(self, urls_list):
-        for i in range(self.concurrent):
-            t = Thread(target=self.do_work)
-            t.daemon = True
-            t.start()
 
-        for url in urls_list:
-            self.queue.put(url.strip())
-        self.queue.join()
+def to_timestamp(dt):
+    """
+        Aware datetime to unix timestamp
+    """
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
 
-        return self.result
 
+def is_cache_shared():
+    """
+        True when the default cache is seen by all processes,
+        local memory and dummy caches are not
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))